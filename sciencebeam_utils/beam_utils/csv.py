@@ -1,7 +1,16 @@
 from __future__ import absolute_import
 
+import csv as stdlib_csv
+import hashlib
+import heapq
 import logging
+import os
+from contextlib import contextmanager
 from io import StringIO
+from itertools import groupby, islice
+from operator import itemgetter
+from tempfile import TemporaryDirectory
+from uuid import uuid4
 
 from backports import csv  # pylint: disable=no-name-in-module
 
@@ -9,11 +18,16 @@ from six import text_type
 
 import apache_beam as beam
 from apache_beam.io.textio import WriteToText
+from apache_beam.io.filesystems import FileSystems
+from apache_beam.utils.windowed_value import WindowedValue
 from apache_beam.io.filesystem import CompressionTypes
 from apache_beam.io.filebasedsource import FileBasedSource
 
-from sciencebeam_utils.beam_utils.utils import (
-    TransformAndLog
+from sciencebeam_utils.beam_utils.io import (
+    DEFAULT_BUFFER_SIZE,
+    find_matching_filenames,
+    iter_decoded_lines,
+    open_buffered_text_file
 )
 
 from sciencebeam_utils.utils.csv import (
@@ -21,6 +35,22 @@ from sciencebeam_utils.utils.csv import (
 )
 
 
+DEFAULT_CSV_BATCH_SIZE = 1000
+
+DEFAULT_MAX_ROWS_IN_MEMORY = 100000
+
+FILE_EXT_BY_COMPRESSION_TYPE = {
+    compression_type: ext
+    for compression_type, ext in [
+        (CompressionTypes.GZIP, '.gz'),
+        (CompressionTypes.BZIP2, '.bz2'),
+        # not available in older versions of Apache Beam
+        (getattr(CompressionTypes, 'ZSTD', None), '.zst')
+    ]
+    if compression_type is not None
+}
+
+
 def get_logger():
     return logging.getLogger(__name__)
 
@@ -52,28 +82,366 @@ def format_csv_rows(rows, delimiter=','):
     return result
 
 
-class WriteDictCsv(beam.PTransform):
-    def __init__(self, path, columns, file_name_suffix=None):
+def write_csv_row_with_line_feed(writer, out, row):
+    """
+    Writes the row using the writer (with the default line terminator '\\r\\n', which ensures
+    that values containing '\\r' will be quoted), replacing the line terminator by a line feed.
+    """
+    writer.writerow(row)
+    out.seek(out.tell() - 2)
+    out.write('\n')
+    out.truncate()
+
+
+class FormatDictCsvRowsFn(beam.DoFn):  # pylint: disable=abstract-method
+    """
+    Formats dict elements as CSV rows (equivalent to DictToList and format_csv_rows),
+    using a single CSV writer per bundle.
+    Emits UTF-8 encoded chunks of up to batch_size rows, separated by a line feed
+    (without a trailing line feed, as that will be added by WriteToText).
+    """
+
+    def __init__(self, columns, delimiter=',', batch_size=DEFAULT_CSV_BATCH_SIZE):
+        super(FormatDictCsvRowsFn, self).__init__()
+        self.columns = columns
+        self.delimiter = delimiter
+        self.batch_size = batch_size
+        self._out = None
+        self._writer = None
+        self._row_count = 0
+        self._window = None
+
+    def start_bundle(self):
+        self._out = StringIO()
+        self._writer = stdlib_csv.writer(self._out, delimiter=self.delimiter)
+        self._row_count = 0
+        self._window = None
+
+    def _flush(self):
+        chunk = self._out.getvalue()
+        self._out.seek(0)
+        self._out.truncate()
+        self._row_count = 0
+        return chunk[:-1].encode('utf-8')
+
+    def process(self, element, window=beam.DoFn.WindowParam):  # pylint: disable=arguments-differ
+        if self._row_count and window != self._window:
+            yield WindowedValue(self._flush(), self._window.max_timestamp(), [self._window])
+        self._window = window
+        write_csv_row_with_line_feed(
+            self._writer, self._out,
+            [_to_text(element.get(column)) for column in self.columns]
+        )
+        self._row_count += 1
+        if self._row_count >= self.batch_size:
+            yield self._flush()
+
+    def finish_bundle(self):
+        if self._row_count:
+            yield WindowedValue(self._flush(), self._window.max_timestamp(), [self._window])
+
+
+def get_compression_type(compression):
+    if compression is None:
+        return None
+    # compression types are strings, e.g. 'gzip' or 'zstd'
+    if not CompressionTypes.is_valid_compression_type(compression):
+        raise ValueError('unsupported compression: %s' % compression)
+    return compression
+
+
+def get_shard_file_path(path, shard_index, shard_count, file_name_suffix):
+    # using the same naming as the default shard name template of WriteToText
+    return '%s-%05d-of-%05d%s' % (path, shard_index, shard_count, file_name_suffix or '')
+
+
+TEMP_SHARD_FILE_INFIX = '.temp-'
+
+
+def get_shard_file_pattern(path, file_name_suffix):
+    return '%s-*-of-*%s' % (path, file_name_suffix or '')
+
+
+def get_temp_shard_file_path(shard_file_path):
+    # unique per attempt, in case writing the shard is retried
+    return shard_file_path + TEMP_SHARD_FILE_INFIX + uuid4().hex
+
+
+def finalize_shard_files(temp_and_shard_file_paths, path, file_name_suffix):
+    """
+    Renames the temporary shard files to their final names, then deletes any other files
+    matching the shard file pattern (e.g. stale shards of a previous run with a different
+    shard count, or temporary files of failed attempts).
+    Returns the shard file paths.
+    """
+    temp_and_shard_file_paths = sorted(temp_and_shard_file_paths, key=itemgetter(1))
+    shard_file_paths = [shard_file_path for _, shard_file_path in temp_and_shard_file_paths]
+    if temp_and_shard_file_paths:
+        FileSystems.rename(
+            [temp_file_path for temp_file_path, _ in temp_and_shard_file_paths],
+            shard_file_paths
+        )
+    shard_file_pattern = get_shard_file_pattern(path, file_name_suffix)
+    shard_file_path_set = set(shard_file_paths)
+    stale_file_paths = sorted({
+        file_metadata.path
+        for match_result in FileSystems.match([
+            shard_file_pattern, shard_file_pattern + TEMP_SHARD_FILE_INFIX + '*'
+        ])
+        for file_metadata in match_result.metadata_list
+        if file_metadata.path not in shard_file_path_set
+    })
+    if stale_file_paths:
+        get_logger().info('deleting stale shard files: %s', stale_file_paths)
+        FileSystems.delete(stale_file_paths)
+    return shard_file_paths
+
+
+def get_chunk_key(chunk):
+    # a deterministic key (identical chunks will be assigned to the same shard)
+    return hashlib.sha1(chunk).digest()
+
+
+def get_shard_index_by_chunk_key(chunk_size_by_key, max_bytes_per_shard):
+    """
+    Packs the chunks (ordered by key) into consecutive shards,
+    starting a new shard if the next chunk would exceed max_bytes_per_shard.
+    Shards will therefore not exceed it (unless a single chunk does).
+    """
+    shard_index_by_key = {}
+    shard_index = 0
+    shard_bytes = 0
+    for key in sorted(chunk_size_by_key):
+        chunk_size = chunk_size_by_key[key]
+        if shard_bytes and shard_bytes + chunk_size > max_bytes_per_shard:
+            shard_index += 1
+            shard_bytes = 0
+        shard_index_by_key[key] = shard_index
+        shard_bytes += chunk_size
+    return shard_index_by_key
+
+
+def get_shard_count_for_shard_index_by_key(shard_index_by_key):
+    # at least one shard (with just the header) will be written, as with WriteToText
+    return max(shard_index_by_key.values()) + 1 if shard_index_by_key else 1
+
+
+class WriteShardFn(beam.DoFn):  # pylint: disable=abstract-method
+    """
+    Writes the chunks of a shard (as grouped by shard index) to a temporary shard file,
+    yielding the temporary and final shard file path (see finalize_shard_files).
+    Every chunk will be followed by a line feed (as with WriteToText),
+    None chunks are ignored (allowing shards without chunks to be written).
+    """
+
+    def __init__(self, path, file_name_suffix, header=None, compression_type=None):
+        super(WriteShardFn, self).__init__()
+        self.path = path
+        self.file_name_suffix = file_name_suffix
+        self.header = header
+        self.compression_type = compression_type or CompressionTypes.AUTO
+
+    def process(self, element, shard_count):  # pylint: disable=arguments-differ
+        shard_index, chunks = element
+        shard_file_path = get_shard_file_path(
+            self.path, shard_index, shard_count, self.file_name_suffix
+        )
+        temp_shard_file_path = get_temp_shard_file_path(shard_file_path)
+        with FileSystems.create(
+                temp_shard_file_path, compression_type=self.compression_type) as f:
+            if self.header:
+                f.write(self.header + b'\n')
+            for chunk in chunks:
+                if chunk is not None:
+                    f.write(chunk + b'\n')
+        yield temp_shard_file_path, shard_file_path
+
+
+class WriteToTextWithMaxBytesPerShard(beam.PTransform):
+    """
+    Writes byte chunks to text files, with the number of shards determined by the
+    (uncompressed) size of the chunks, i.e. shards will have up to max_bytes_per_shard.
+    Chunks are packed into shards (see get_shard_index_by_chunk_key).
+    With no chunks, a single shard with just the header will be written.
+    Shards are written to temporary files first, and only renamed once all of them
+    were written (other files matching the shard file pattern will be deleted).
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self, path, max_bytes_per_shard, file_name_suffix='', header=None,
+            compression_type=None):
+        super(WriteToTextWithMaxBytesPerShard, self).__init__()
+        self.path = path
+        self.max_bytes_per_shard = max_bytes_per_shard
+        self.file_name_suffix = file_name_suffix
+        self.header = header
+        self.compression_type = compression_type
+
+    def expand(self, input_or_inputs):
+        max_bytes_per_shard = self.max_bytes_per_shard
+        keyed_chunks = (
+            input_or_inputs |
+            "AddKey" >> beam.Map(lambda chunk: (get_chunk_key(chunk), chunk))
+        )
+        shard_index_by_key = (
+            keyed_chunks |
+            "GetSize" >> beam.Map(lambda key_and_chunk: (
+                key_and_chunk[0], len(key_and_chunk[1]) + 1
+            )) |
+            "GetSizePerKey" >> beam.CombinePerKey(sum) |
+            "ToDict" >> beam.combiners.ToDict() |
+            "GetShardIndexByKey" >> beam.Map(
+                get_shard_index_by_chunk_key, max_bytes_per_shard
+            )
+        )
+        shard_count = beam.pvalue.AsSingleton(
+            shard_index_by_key |
+            "GetShardCount" >> beam.Map(get_shard_count_for_shard_index_by_key)
+        )
+        chunks_by_shard = (
+            keyed_chunks |
+            "AssignShard" >> beam.Map(
+                lambda key_and_chunk, shard_index_by_key: (
+                    shard_index_by_key[key_and_chunk[0]], key_and_chunk[1]
+                ),
+                beam.pvalue.AsSingleton(shard_index_by_key)
+            )
+        )
+        # making sure every shard is written (even without any chunks)
+        all_shards = (
+            shard_index_by_key |
+            "GetAllShards" >> beam.FlatMap(lambda shard_index_by_key: [
+                (shard_index, None)
+                for shard_index in range(
+                    get_shard_count_for_shard_index_by_key(shard_index_by_key)
+                )
+            ])
+        )
+        return (
+            (chunks_by_shard, all_shards) |
+            "Flatten" >> beam.Flatten() |
+            "GroupByShard" >> beam.GroupByKey() |
+            "WriteShard" >> beam.ParDo(WriteShardFn(
+                self.path, self.file_name_suffix, header=self.header,
+                compression_type=self.compression_type
+            ), shard_count) |
+            "CollectShards" >> beam.combiners.ToList() |
+            "FinalizeShards" >> beam.FlatMap(
+                finalize_shard_files, self.path, self.file_name_suffix
+            )
+        )
+
+
+class WriteDictCsv(beam.PTransform):  # pylint: disable=too-many-instance-attributes
+    """
+    Writes dicts to CSV/TSV files (the delimiter is determined by the file name).
+
+    Sharding can be controlled via either:
+    * num_shards: an explicit number of shards
+    * max_bytes_per_shard: the approximate (uncompressed) size of a shard,
+      the number of shards will grow with the data
+    compression: 'gzip' or 'zstd' (by default determined by the file name suffix),
+      the file extension will be added to the suffix if not already present.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self, path, columns, file_name_suffix=None, batch_size=DEFAULT_CSV_BATCH_SIZE,
+            num_shards=None, max_bytes_per_shard=None, compression=None):
         super(WriteDictCsv, self).__init__()
+        if num_shards and max_bytes_per_shard:
+            raise ValueError('only one of num_shards or max_bytes_per_shard can be specified')
         self.path = path
         self.columns = columns
+        self.compression_type = get_compression_type(compression)
+        compression_ext = FILE_EXT_BY_COMPRESSION_TYPE.get(self.compression_type)
+        if compression_ext and not (file_name_suffix or '').endswith(compression_ext):
+            file_name_suffix = (file_name_suffix or '') + compression_ext
+        self.file_name_suffix = file_name_suffix
+        self.delimiter = csv_delimiter_by_filename(path + (file_name_suffix or ''))
+        self.batch_size = batch_size
+        self.num_shards = num_shards
+        self.max_bytes_per_shard = max_bytes_per_shard
+
+    def _get_write_transform(self):
+        header = format_csv_rows([self.columns], delimiter=self.delimiter).encode('utf-8')
+        if self.max_bytes_per_shard:
+            return WriteToTextWithMaxBytesPerShard(
+                self.path,
+                self.max_bytes_per_shard,
+                file_name_suffix=self.file_name_suffix,
+                header=header,
+                compression_type=self.compression_type
+            )
+        optional_kwargs = {}
+        if self.num_shards:
+            optional_kwargs['num_shards'] = self.num_shards
+        if self.compression_type:
+            optional_kwargs['compression_type'] = self.compression_type
+        return WriteToText(
+            self.path,
+            file_name_suffix=self.file_name_suffix,
+            header=header,
+            **optional_kwargs
+        )
+
+    def expand(self, input_or_inputs):
+        return (
+            input_or_inputs |
+            "Format" >> beam.ParDo(FormatDictCsvRowsFn(
+                self.columns, delimiter=self.delimiter, batch_size=self.batch_size
+            )) |
+            "Write" >> self._get_write_transform()
+        )
+
+
+DEAD_LETTER_CSV_COLUMNS = [
+    'element', 'exception_type', 'exception', 'traceback',
+    'start_timestamp', 'duration_seconds'
+]
+
+
+def dead_letter_record_to_csv_dict(dead_letter_record, element_to_text_fn=None):
+    exception = dead_letter_record['exception']
+    element = dead_letter_record['element']
+    return {
+        'element': element_to_text_fn(element) if element_to_text_fn else element,
+        'exception_type': (
+            dead_letter_record.get('exception_type') or type(exception).__name__
+        ),
+        'exception': exception,
+        'traceback': dead_letter_record.get('traceback'),
+        'start_timestamp': dead_letter_record.get('start_timestamp'),
+        'duration_seconds': dead_letter_record.get('duration_seconds')
+    }
+
+
+class WriteDeadLetterCsv(beam.PTransform):
+    """
+    Writes the dead letter records output by MapOrLog (with dead_letter_tag) using WriteDictCsv.
+    element_to_text_fn may be used to only write the relevant part of the failed element
+    (e.g. the source url, to retry just those).
+    """
+
+    def __init__(self, path, element_to_text_fn=None, file_name_suffix='.tsv', **kwargs):
+        super(WriteDeadLetterCsv, self).__init__()
+        self.path = path
+        self.element_to_text_fn = element_to_text_fn
         self.file_name_suffix = file_name_suffix
-        self.delimiter = csv_delimiter_by_filename(path + file_name_suffix)
+        self.kwargs = kwargs
 
     def expand(self, input_or_inputs):
+        element_to_text_fn = self.element_to_text_fn
         return (
             input_or_inputs |
-            "ToList" >> beam.Map(DictToList(self.columns)) |
-            "Format" >> TransformAndLog(
-                beam.Map(lambda x: format_csv_rows([x], delimiter=self.delimiter)),
-                log_prefix='formatted csv: ',
-                log_level='debug'
+            "ToCsvDict" >> beam.Map(
+                lambda x: dead_letter_record_to_csv_dict(
+                    x, element_to_text_fn=element_to_text_fn
+                )
             ) |
-            "Utf8Encode" >> beam.Map(lambda x: x.encode('utf-8')) |
-            "Write" >> WriteToText(
-                self.path,
+            "WriteDictCsv" >> WriteDictCsv(
+                self.path, DEAD_LETTER_CSV_COLUMNS,
                 file_name_suffix=self.file_name_suffix,
-                header=format_csv_rows([self.columns], delimiter=self.delimiter).encode('utf-8')
+                **self.kwargs
             )
         )
 
@@ -81,6 +449,86 @@ class WriteDictCsv(beam.PTransform):
 def _strip_quotes(s):
     return s[1:-1] if len(s) >= 2 and s[0] == '"' and s[-1] == '"' else s
 
+
+def _get_csv_column_index(header_row, column):
+    if isinstance(column, int):
+        return column
+    if header_row is None:
+        raise ValueError('header is required to select column by name: %s' % column)
+    try:
+        return header_row.index(column)
+    except ValueError as exc:
+        raise ValueError(
+            'column %s not found, available columns: %s' % (column, header_row)
+        ) from exc
+
+
+BOOL_BY_CSV_VALUE = {
+    'true': True,
+    '1': True,
+    'false': False,
+    '0': False
+}
+
+
+def parse_csv_bool(value):
+    try:
+        return BOOL_BY_CSV_VALUE[value.strip().lower()]
+    except KeyError as exc:
+        raise ValueError('invalid boolean value: %r' % value) from exc
+
+
+def _get_csv_value_converter(value_type):
+    if value_type is None or value_type is text_type:
+        return None
+    if value_type is bool:
+        # bool('false') would be True
+        value_type = parse_csv_bool
+
+    def convert(value):
+        return value_type(value) if value else None
+
+    return convert
+
+
+def get_csv_record_fn(header_row, columns, schema=None):
+    """
+    Returns a function converting a parsed CSV row to a tuple of the values of the columns.
+    Values are converted using the type of the column within the schema (if any),
+    e.g. {'count': int}. Empty values of columns with a type are converted to None.
+    """
+    schema = schema or {}
+    column_indices = [_get_csv_column_index(header_row, column) for column in columns]
+    typed_values = [
+        (position, converter)
+        for position, converter in enumerate(
+            _get_csv_value_converter(schema.get(column)) for column in columns
+        )
+        if converter is not None
+    ]
+    if len(column_indices) == 1:
+        column_index = column_indices[0]
+
+        def get_values(row):
+            return (row[column_index],)
+    else:
+        get_values = itemgetter(*column_indices)
+    min_row_length = max(column_indices) + 1 if column_indices else 0
+
+    def to_record(row):
+        if len(row) < min_row_length:
+            row = row + [''] * (min_row_length - len(row))
+        values = get_values(row)
+        if not typed_values:
+            return values
+        values = list(values)
+        for position, converter in typed_values:
+            values[position] = converter(values[position])
+        return tuple(values)
+
+    return to_record
+
+
 # copied and modified from https://github.com/pabloem/beam_utils
 # (move back if still active)
 
@@ -102,7 +550,7 @@ class ReadLineIterator:
         return line
 
 
-class CsvFileSource(FileBasedSource):
+class CsvFileSource(FileBasedSource):  # pylint: disable=too-many-instance-attributes
     """ A source for a GCS or local comma-separated-file
     Parses a text file assuming newline-delimited lines,
     and comma-delimited fields. Assumes UTF-8 encoding.
@@ -112,7 +560,8 @@ class CsvFileSource(FileBasedSource):
             self, file_pattern,
             compression_type=CompressionTypes.AUTO,
             delimiter=',', header=True, dictionary_output=True,
-            validate=True, limit=None):
+            validate=True, limit=None, splittable=False,
+            block_size=DEFAULT_BUFFER_SIZE, schema=None, columns=None):
         """ Initialize a CsvFileSource.
         Args:
           delimiter: The delimiter character in the CSV file.
@@ -121,6 +570,16 @@ class CsvFileSource(FileBasedSource):
           dictionary_output: The kind of records that the CsvFileSource outputs.
             If True, then it will output dict()'s, if False it will output list()'s.
             Default: True
+          splittable: Whether the file may be split into ranges read in parallel.
+            Only valid for CSV files without newlines within (quoted) values.
+            (compressed files will still be read as a whole)
+            Default: False
+          block_size: The size of the blocks to read (when not splittable).
+          schema: The types of the columns, e.g. {'count': int}.
+            Values will be converted once by the source.
+          columns: The columns to output (by default the columns of the schema).
+            If either schema or columns is set, the CsvFileSource will output tuple()'s
+            of the values of the columns (rather than dict()'s or list()'s).
         Raises:
           ValueError: If the input arguments are not consistent.
         """
@@ -128,51 +587,159 @@ class CsvFileSource(FileBasedSource):
             file_pattern,
             compression_type=compression_type,
             validate=validate,
-            splittable=False  # Can't just split anywhere
+            splittable=splittable  # Can't just split anywhere (unless there are no multi-lines)
         )
         self.delimiter = delimiter
         self.header = header
         self.dictionary_output = dictionary_output
         self.limit = limit
-        self._file = None
+        self.block_size = block_size
+        self.schema = dict(schema) if schema else None
+        self.columns = (
+            list(columns) if columns is not None
+            else list(self.schema) if self.schema
+            else None
+        )
+        self._header_row_and_end_position_by_file_name = {}
 
-        if not self.header and dictionary_output:
+        if not self.header and dictionary_output and self.columns is None:
             raise ValueError(
                 'header is required for the CSV reader to provide dictionary output'
             )
+        if splittable and limit:
+            raise ValueError('limit is not supported by the splittable CSV reader')
+
+    def _get_output_fn(self, headers):
+        if self.columns is not None:
+            return get_csv_record_fn(headers, self.columns, schema=self.schema)
+        if self.dictionary_output:
+            return lambda row: dict(zip(headers, row))
+        return None
+
+    def _parse_csv_lines(self, lines):
+        # using the (faster) C csv implementation
+        return stdlib_csv.reader(lines, delimiter=self.delimiter)
+
+    def _get_header_row_and_end_position(self, file_name):
+        # the header is read once from the start of the file (rather than for every range)
+        result = self._header_row_and_end_position_by_file_name.get(file_name)
+        if result is None:
+            with self.open_file(file_name) as f:
+                line = f.readline()
+            header_row = next(self._parse_csv_lines([line.decode('utf-8')]), [])
+            result = (header_row, len(line))
+            self._header_row_and_end_position_by_file_name[file_name] = result
+        return result
+
+    def _iter_lines_in_range(self, f, position, offset_range_tracker):
+        # every record starts with a line, claim the line start position
+        while offset_range_tracker.try_claim(position):
+            line = f.readline()
+            if not line:
+                return
+            position += len(line)
+            yield line.decode('utf-8')
+
+    def _read_records_in_range(self, file_name, offset_range_tracker):
+        headers, position = (
+            self._get_header_row_and_end_position(file_name)
+            if self.header
+            else (None, 0)
+        )
+        start_position = offset_range_tracker.start_position()
+        with self.open_file(file_name) as f:
+            if start_position > position:
+                # resynchronise on the next line, the line containing the start position
+                # belongs to the previous range (unless it starts at the start position)
+                f.seek(start_position - 1)
+                position = start_position - 1 + len(f.readline())
+            else:
+                f.seek(position)
+            rows = self._parse_csv_lines(
+                self._iter_lines_in_range(f, position, offset_range_tracker)
+            )
+            to_output = self._get_output_fn(headers)
+            yield from map(to_output, rows) if to_output else rows
 
     def read_records(self, file_name, offset_range_tracker):
+        if self.splittable:
+            yield from self._read_records_in_range(file_name, offset_range_tracker)
+            return
+
         # If a multi-file pattern was specified as a source then make sure the
         # start/end offsets use the default values for reading the entire file.
-        headers = None
-        self._file = self.open_file(file_name)
+        # the file will be closed as soon as the limit is reached
+        with self.open_file(file_name) as f:
+            rows = self._parse_csv_lines(
+                iter_decoded_lines(f, block_size=self.block_size)
+            )
 
-        reader = csv.reader(ReadLineIterator(self._file), delimiter=text_type(self.delimiter))
+            headers = None
+            if self.header:
+                headers = next(rows, None)
+                if headers is None:
+                    return
 
-        line_no = 0
-        for i, row in enumerate(reader):
-            if self.header and i == 0:
-                headers = row
-                continue
+            if self.limit:
+                rows = islice(rows, self.limit)
 
-            if self.limit and line_no >= self.limit:
-                break
+            to_output = self._get_output_fn(headers)
+            yield from map(to_output, rows) if to_output else rows
+
+
+def iter_csv_records_with_global_limit(file_pattern, limit, **source_kwargs):
+    """
+    Reads the rows of the matching files (in sorted order) until the limit is reached
+    across all of the files, without opening the remaining files.
+    """
+    remaining = limit
+    for file_name in sorted(find_matching_filenames(file_pattern)):
+        source = CsvFileSource(file_name, limit=remaining, validate=False, **source_kwargs)
+        for record in source.read_records(file_name, None):
+            yield record
+            remaining -= 1
+        if remaining <= 0:
+            return
+
+
+def ReadCsvWithGlobalLimit(file_pattern, limit, **source_kwargs):
+    # reading the files sequentially (within a single task), to stop once the limit is reached
+    return (
+        "Create" >> beam.Create([file_pattern]) |
+        "ReadWithGlobalLimit" >> beam.FlatMap(
+            lambda pattern: iter_csv_records_with_global_limit(
+                pattern, limit, **source_kwargs
+            )
+        )
+    )
 
-            line_no += 1
-            if self.dictionary_output:
-                yield dict(zip(headers, row))
-            else:
-                yield row
 
+def _read_csv_source(  # pylint: disable=too-many-arguments
+        input_or_inputs, filename, limit, global_limit, splittable, **source_kwargs):
+    if limit and global_limit:
+        return input_or_inputs | ReadCsvWithGlobalLimit(filename, limit, **source_kwargs)
+    return input_or_inputs | beam.io.Read(CsvFileSource(
+        filename,
+        limit=limit,
+        # the limit requires the file to be read as a whole
+        splittable=splittable and not limit,
+        **source_kwargs
+    ))
 
-class ReadDictCsv(beam.PTransform):
+
+class ReadDictCsv(beam.PTransform):  # pylint: disable=too-many-instance-attributes
     """
     Simplified CSV parser, which does not support:
     * multi-line values
     * delimiter within value
     """
 
-    def __init__(self, filename, header=True, limit=None):
+    def __init__(  # pylint: disable=too-many-arguments
+            self, filename, header=True, limit=None, splittable=False, global_limit=False):
+        """
+        With global_limit, the limit applies to the rows across all of the matching files
+        (rather than to the rows of every file).
+        """
         super(ReadDictCsv, self).__init__()
         if not header:
             raise RuntimeError('header required')
@@ -180,14 +747,215 @@ class ReadDictCsv(beam.PTransform):
         self.columns = None
         self.delimiter = csv_delimiter_by_filename(filename)
         self.limit = limit
+        self.splittable = splittable
+        self.global_limit = global_limit
         self.row_num = 0
 
     def expand(self, input_or_inputs):
+        return _read_csv_source(
+            input_or_inputs,
+            self.filename,
+            limit=self.limit,
+            global_limit=self.global_limit,
+            splittable=self.splittable,
+            delimiter=self.delimiter
+        )
+
+
+class ReadCsvRecords(beam.PTransform):  # pylint: disable=too-many-instance-attributes
+    """
+    Reads the columns of the CSV file as tuples,
+    with the values converted using the types of the schema (if any).
+    e.g. ReadCsvRecords('scores.tsv', schema={'id': str, 'score': float})
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self, filename, columns=None, schema=None, header=True, limit=None,
+            splittable=False, global_limit=False):
+        super(ReadCsvRecords, self).__init__()
+        if columns is None and not schema:
+            raise ValueError('either columns or schema required')
+        self.filename = filename
+        self.columns = columns
+        self.schema = schema
+        self.header = header
+        self.delimiter = csv_delimiter_by_filename(filename)
+        self.limit = limit
+        self.splittable = splittable
+        self.global_limit = global_limit
+
+    def expand(self, input_or_inputs):
+        return _read_csv_source(
+            input_or_inputs,
+            self.filename,
+            limit=self.limit,
+            global_limit=self.global_limit,
+            splittable=self.splittable,
+            delimiter=self.delimiter,
+            header=self.header,
+            schema=self.schema,
+            columns=self.columns
+        )
+
+
+@contextmanager
+def open_csv_reader(file_name, delimiter=None):
+    if delimiter is None:
+        delimiter = csv_delimiter_by_filename(file_name)
+    with open_buffered_text_file(file_name, newline='') as f:
+        yield stdlib_csv.reader(f, delimiter=delimiter)
+
+
+def get_csv_header(file_name):
+    with open_csv_reader(file_name) as reader:
+        return next(reader, [])
+
+
+def iter_csv_rows_with_columns(file_names, columns):
+    """
+    Reads the rows of the CSV files (with header), skipping the header of every file.
+    Values are returned in the order of the columns (missing values will be empty).
+    """
+    for file_name in file_names:
+        with open_csv_reader(file_name) as reader:
+            header_row = next(reader, None)
+            if header_row is None:
+                continue
+            if header_row == columns:
+                yield from reader
+                continue
+            index_by_column = {column: index for index, column in enumerate(header_row)}
+            column_indices = [index_by_column.get(column) for column in columns]
+            for row in reader:
+                yield [
+                    row[index] if index is not None and index < len(row) else ''
+                    for index in column_indices
+                ]
+
+
+def _save_temp_csv_rows(file_name, rows):
+    with open(file_name, 'w', encoding='utf-8', newline='') as f:
+        stdlib_csv.writer(f).writerows(rows)
+
+
+def _iter_temp_csv_rows(file_name):
+    with open(file_name, 'r', encoding='utf-8', newline='') as f:
+        yield from stdlib_csv.reader(f)
+
+
+def iter_externally_sorted_rows(rows, key, max_rows_in_memory=DEFAULT_MAX_ROWS_IN_MEMORY):
+    """
+    Sorts the rows (stable), with at most max_rows_in_memory rows held in memory.
+    Sorted runs exceeding that will be saved to temporary files and merged.
+    """
+    with TemporaryDirectory(suffix='-sort') as temp_dir:
+        run_file_names = []
+        rows = iter(rows)
+        while True:
+            run = list(islice(rows, max_rows_in_memory))
+            run.sort(key=key)
+            if not run_file_names and len(run) < max_rows_in_memory:
+                # all of the rows fit into memory
+                yield from run
+                return
+            if run:
+                run_file_name = os.path.join(temp_dir, 'run-%d.csv' % len(run_file_names))
+                _save_temp_csv_rows(run_file_name, run)
+                run_file_names.append(run_file_name)
+            if len(run) < max_rows_in_memory:
+                break
+        yield from heapq.merge(
+            *[_iter_temp_csv_rows(run_file_name) for run_file_name in run_file_names],
+            key=key
+        )
+
+
+def iter_first_row_by_key(sorted_rows, key):
+    return (next(group) for _, group in groupby(sorted_rows, key=key))
+
+
+def save_csv_rows(file_name, columns, rows, batch_size=DEFAULT_CSV_BATCH_SIZE):
+    """
+    Saves the rows with the header written once (rows are formatted as by WriteDictCsv).
+    Returns the number of rows saved.
+    """
+    delimiter = csv_delimiter_by_filename(file_name)
+    out = StringIO()
+    writer = stdlib_csv.writer(out, delimiter=delimiter)
+    row_count = 0
+    with FileSystems.create(file_name) as f:
+        f.write(format_csv_rows([columns], delimiter=delimiter).encode('utf-8') + b'\n')
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            for row in batch:
+                write_csv_row_with_line_feed(writer, out, row)
+            f.write(out.getvalue().encode('utf-8'))
+            out.seek(0)
+            out.truncate()
+            row_count += len(batch)
+    return row_count
+
+
+def merge_csv_files(  # pylint: disable=too-many-arguments
+        file_names, output_file_name, key_column=None, sort=False, dedupe=False,
+        max_rows_in_memory=DEFAULT_MAX_ROWS_IN_MEMORY):
+    """
+    Merges CSV/TSV files (e.g. the shards written by WriteDictCsv) into a single file,
+    with the header written once (the columns of the first file).
+    With sort, the rows will be sorted by the key column (using an external sort).
+    With dedupe, only the first row for every key will be kept (implies sort).
+    Returns the number of rows saved.
+    """
+    if (sort or dedupe) and not key_column:
+        raise ValueError('key column required to sort or dedupe')
+    file_names = list(file_names)
+    if not file_names:
+        raise ValueError('no files to merge')
+    columns = get_csv_header(file_names[0])
+    rows = iter_csv_rows_with_columns(file_names, columns)
+    if sort or dedupe:
+        key = itemgetter(_get_csv_column_index(columns, key_column))
+        rows = iter_externally_sorted_rows(rows, key, max_rows_in_memory=max_rows_in_memory)
+        if dedupe:
+            rows = iter_first_row_by_key(rows, key)
+    return save_csv_rows(output_file_name, columns, iter(rows))
+
+
+def merge_csv_files_matching_pattern(file_pattern, output_file_name, **kwargs):
+    file_names = sorted(
+        file_name
+        for file_name in find_matching_filenames(file_pattern)
+        if file_name != output_file_name
+    )
+    get_logger().info('merging %d files into: %s', len(file_names), output_file_name)
+    return merge_csv_files(file_names, output_file_name, **kwargs)
+
+
+class MergeCsvFiles(beam.PTransform):
+    """
+    Merges the CSV/TSV files matching the pattern into a single file
+    (see merge_csv_files), e.g. after the shards have been written by WriteDictCsv.
+    As a single file is written, the merge runs within a single task.
+    Outputs the number of rows saved.
+    """
+
+    def __init__(self, file_pattern, output_file_name, **kwargs):
+        super(MergeCsvFiles, self).__init__()
+        self.file_pattern = file_pattern
+        self.output_file_name = output_file_name
+        self.kwargs = kwargs
+
+    def expand(self, input_or_inputs):
+        output_file_name = self.output_file_name
+        kwargs = self.kwargs
         return (
             input_or_inputs |
-            beam.io.Read(CsvFileSource(
-                self.filename,
-                delimiter=self.delimiter,
-                limit=self.limit
-            ))
+            "Create" >> beam.Create([self.file_pattern]) |
+            "Merge" >> beam.Map(
+                lambda file_pattern: merge_csv_files_matching_pattern(
+                    file_pattern, output_file_name, **kwargs
+                )
+            )
         )
@@ -0,0 +1,169 @@
+import logging
+import sqlite3
+import threading
+from time import time
+from typing import NamedTuple, Optional
+
+from apache_beam.io.filesystems import FileSystems
+from apache_beam.io.filesystem import BeamIOError
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+
+# missing files are likely to be created (e.g. by the next pipeline run),
+# by default they are therefore not cached
+DEFAULT_MISSING_TTL_SECONDS = 0
+
+DEFAULT_COMMIT_INTERVAL = 1000
+
+GLOB_CHARS = {'*', '?', '['}
+
+
+class FileMetadata(NamedTuple):
+    exists: bool
+    size_in_bytes: Optional[int] = None
+    last_updated_in_seconds: Optional[float] = None
+
+
+MISSING_FILE_METADATA = FileMetadata(exists=False)
+
+
+def to_file_metadata(beam_file_metadata) -> FileMetadata:
+    return FileMetadata(
+        exists=True,
+        size_in_bytes=beam_file_metadata.size_in_bytes,
+        last_updated_in_seconds=getattr(beam_file_metadata, 'last_updated_in_seconds', None)
+    )
+
+
+def get_file_metadata(path: str) -> FileMetadata:
+    """
+    Retrieves the file metadata from the file system.
+    Note: for a path without glob characters, Beam's match will check whether the file exists
+    before retrieving its metadata (usually two requests). Use FileSystems.exists instead
+    if only the existence is required.
+    """
+    if any(c in path for c in GLOB_CHARS):
+        return FileMetadata(exists=FileSystems.exists(path))
+    try:
+        metadata_list = FileSystems.match([path])[0].metadata_list
+    except BeamIOError:
+        return FileMetadata(exists=FileSystems.exists(path))
+    for beam_file_metadata in metadata_list:
+        if beam_file_metadata.path == path:
+            return to_file_metadata(beam_file_metadata)
+    return MISSING_FILE_METADATA
+
+
+class FileMetadataCache:  # pylint: disable=too-many-instance-attributes
+    """
+    Local (sqlite based) cache of the file metadata, to avoid repeated file system requests
+    (e.g. across runs over the same files).
+
+    Entries older than ttl_seconds will be ignored.
+    Entries of missing files are only kept for missing_ttl_seconds
+    (by default they are not cached).
+    With refresh, cached entries will be ignored (but updated).
+    The cache is thread-safe.
+    """
+
+    def __init__(
+            self, cache_path: str,
+            ttl_seconds: float = DEFAULT_TTL_SECONDS,
+            missing_ttl_seconds: float = DEFAULT_MISSING_TTL_SECONDS,
+            refresh: bool = False,
+            commit_interval: int = DEFAULT_COMMIT_INTERVAL):
+        self.cache_path = cache_path
+        self.ttl_seconds = ttl_seconds
+        self.missing_ttl_seconds = missing_ttl_seconds
+        self.refresh = refresh
+        self.commit_interval = commit_interval
+        self._lock = threading.Lock()
+        self._uncommitted_count = 0
+        self._connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS file_metadata ('
+            ' path TEXT PRIMARY KEY,'
+            ' exists_flag INTEGER NOT NULL,'
+            ' size_in_bytes INTEGER,'
+            ' last_updated_in_seconds REAL,'
+            ' cached_at REAL NOT NULL'
+            ')'
+        )
+        self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def get(self, path: str) -> Optional[FileMetadata]:
+        if self.refresh:
+            return None
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT exists_flag, size_in_bytes, last_updated_in_seconds, cached_at'
+                ' FROM file_metadata WHERE path = ?',
+                (path,)
+            ).fetchone()
+        if row is None:
+            return None
+        exists_flag, size_in_bytes, last_updated_in_seconds, cached_at = row
+        ttl_seconds = self.ttl_seconds if exists_flag else self.missing_ttl_seconds
+        if ttl_seconds is not None and time() - cached_at > ttl_seconds:
+            return None
+        return FileMetadata(
+            exists=bool(exists_flag),
+            size_in_bytes=size_in_bytes,
+            last_updated_in_seconds=last_updated_in_seconds
+        )
+
+    def put(self, path: str, file_metadata: FileMetadata):
+        if not file_metadata.exists and not self.missing_ttl_seconds:
+            self.invalidate(path)
+            return
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO file_metadata'
+                ' (path, exists_flag, size_in_bytes, last_updated_in_seconds, cached_at)'
+                ' VALUES (?, ?, ?, ?, ?)',
+                (
+                    path, int(file_metadata.exists), file_metadata.size_in_bytes,
+                    file_metadata.last_updated_in_seconds, time()
+                )
+            )
+            self._on_change()
+
+    def invalidate(self, path: str):
+        with self._lock:
+            self._connection.execute('DELETE FROM file_metadata WHERE path = ?', (path,))
+            self._on_change()
+
+    def get_file_metadata(self, path: str) -> FileMetadata:
+        file_metadata = self.get(path)
+        if file_metadata is not None:
+            return file_metadata
+        file_metadata = get_file_metadata(path)
+        self.put(path, file_metadata)
+        return file_metadata
+
+    def exists(self, path: str) -> bool:
+        return self.get_file_metadata(path).exists
+
+    def _on_change(self):
+        self._uncommitted_count += 1
+        if self._uncommitted_count >= self.commit_interval:
+            self._commit()
+
+    def _commit(self):
+        self._connection.commit()
+        self._uncommitted_count = 0
+
+    def close(self):
+        with self._lock:
+            self._commit()
+            self._connection.close()
@@ -1,13 +1,16 @@
 from itertools import islice
 
 import apache_beam as beam
+from apache_beam.utils.windowed_value import WindowedValue
 
 from sciencebeam_utils.beam_utils.csv import (
     ReadDictCsv
 )
 
 from sciencebeam_utils.beam_utils.io import (
-    find_matching_filenames
+    DEFAULT_MAX_CONCURRENCY,
+    find_matching_filenames,
+    read_all_from_paths
 )
 
 from sciencebeam_utils.beam_utils.utils import (
@@ -15,10 +18,13 @@ from sciencebeam_utils.beam_utils.utils import (
 )
 
 from sciencebeam_utils.utils.file_list import (
-    load_file_list
+    iter_file_list
 )
 
 
+DEFAULT_READ_BATCH_SIZE = 100
+
+
 def find_matching_filenames_with_limit(pattern, limit=None):
     return islice(
         find_matching_filenames(pattern),
@@ -27,7 +33,8 @@ def find_matching_filenames_with_limit(pattern, limit=None):
 
 
 def ReadFileList(file_list_path, column, limit=None):
-    file_list = load_file_list(file_list_path, column=column, limit=limit)
+    # beam.Create will materialise the values, avoid creating intermediate lists
+    file_list = iter_file_list(file_list_path, column=column, limit=limit)
     return beam.Create(file_list)
 
 
@@ -52,3 +59,51 @@ def DeferredFindFiles(file_pattern, limit=None):
             lambda pattern: find_matching_filenames_with_limit(pattern, limit)
         )
     ))
+
+
+class ReadFileContents(beam.DoFn):  # pylint: disable=abstract-method
+    """
+    Reads the content of the file paths, outputting (path, content) tuples.
+    Paths are batched within a bundle, with every batch read concurrently
+    (see read_all_from_paths).
+    """
+
+    def __init__(
+            self, batch_size=DEFAULT_READ_BATCH_SIZE,
+            max_concurrency=DEFAULT_MAX_CONCURRENCY, max_in_flight_bytes=None):
+        super(ReadFileContents, self).__init__()
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_in_flight_bytes = max_in_flight_bytes
+        self._paths = []
+        self._window = None
+
+    def start_bundle(self):
+        self._paths = []
+        self._window = None
+
+    def _read_batch(self):
+        paths = self._paths
+        self._paths = []
+        return read_all_from_paths(
+            paths,
+            max_concurrency=self.max_concurrency,
+            max_in_flight_bytes=self.max_in_flight_bytes
+        )
+
+    def _read_batch_in_window(self):
+        window = self._window
+        for path_and_content in self._read_batch():
+            yield WindowedValue(path_and_content, window.max_timestamp(), [window])
+
+    def process(self, element, window=beam.DoFn.WindowParam):  # pylint: disable=arguments-differ
+        if self._paths and window != self._window:
+            yield from self._read_batch_in_window()
+        self._window = window
+        self._paths.append(element)
+        if len(self._paths) >= self.batch_size:
+            yield from self._read_batch()
+
+    def finish_bundle(self):
+        if self._paths:
+            yield from self._read_batch_in_window()
@@ -1,15 +1,34 @@
 from __future__ import absolute_import
 
 import codecs
+import io
 import logging
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from contextlib import contextmanager
 from io import BytesIO
+from itertools import islice
+from typing import Optional
 
+from apache_beam.io.filesystem import BeamIOError, CompressionTypes
 from apache_beam.io.filesystems import FileSystems
+from apache_beam.io.localfilesystem import LocalFileSystem
+
+from sciencebeam_utils.beam_utils.file_metadata_cache import FileMetadataCache
 
 
 DEFAULT_BUFFER_SIZE = 4096 * 1024
 
+DEFAULT_MAX_CONCURRENCY = 16
+
+DEFAULT_EXISTING_DIRECTORY_CACHE_SIZE = 10000
+
+# file systems without real directories (creating directories is not required)
+OBJECT_STORE_SCHEMES = {'gs', 's3', 'azfs'}
+
 
 def get_logger():
     return logging.getLogger(__name__)
@@ -27,6 +46,64 @@ def open_file(path, mode='r', encoding='utf-8', **kwargs):
         raise ValueError('invalid mode: %s' % mode)
 
 
+class _RawReaderAdapter(io.RawIOBase):
+    """
+    Adapts a file-like object with a read method (e.g. Beam's CompressedFile)
+    to the io API, so that it can be wrapped in an io.BufferedReader.
+    The wrapped file object will not be closed.
+    """
+
+    def __init__(self, fp):
+        super().__init__()
+        self._fp = fp
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self._fp.read(len(b))
+        n = len(data)
+        b[:n] = data
+        return n
+
+
+@contextmanager
+def open_buffered_text_file(
+        path, encoding='utf-8', buffer_size=DEFAULT_BUFFER_SIZE, newline=None, **kwargs):
+    """
+    Opens the file for reading text, decoding it in large blocks.
+    That is considerably faster than the codecs.StreamReaderWriter used by open_file.
+    Use newline='' when passing the file to the csv reader.
+    """
+    with FileSystems.open(path, **kwargs) as fp:
+        with io.TextIOWrapper(
+            io.BufferedReader(_RawReaderAdapter(fp), buffer_size=buffer_size),
+            encoding=encoding,
+            newline=newline
+        ) as text_fp:
+            yield text_fp
+
+
+def iter_decoded_lines(fp, encoding='utf-8', block_size=DEFAULT_BUFFER_SIZE):
+    """
+    Reads the (binary) file-like object in large blocks, decoding them incrementally
+    and splitting the lines in bulk.
+    Lines are only split on the line feed character and will retain it (as with readline).
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    remainder = ''
+    while True:
+        block = fp.read(block_size)
+        text = remainder + decoder.decode(block, final=not block)
+        if not block:
+            if text:
+                yield text
+            return
+        lines = io.StringIO(text, newline='\n').readlines()
+        remainder = lines.pop() if lines and not lines[-1].endswith('\n') else ''
+        yield from lines
+
+
 def read_all_from_path(path, buffer_size=DEFAULT_BUFFER_SIZE):
     with FileSystems.open(path) as f:
         out = BytesIO()
@@ -38,6 +115,169 @@ def read_all_from_path(path, buffer_size=DEFAULT_BUFFER_SIZE):
         return out.getvalue()
 
 
+class _InFlightBytesLimiter:
+    def __init__(self, max_in_flight_bytes):
+        self.max_in_flight_bytes = max_in_flight_bytes
+        self._in_flight_bytes = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def acquire(self, size):
+        with self._condition:
+            # a single file exceeding the limit will still be read (on its own)
+            self._condition.wait_for(lambda: (
+                self._closed
+                or not self._in_flight_bytes
+                or self._in_flight_bytes + size <= self.max_in_flight_bytes
+            ))
+            self._in_flight_bytes += size
+
+    def release(self, size):
+        with self._condition:
+            self._in_flight_bytes -= size
+            self._condition.notify_all()
+
+    def adjust(self, size_delta):
+        # e.g. replacing the size hint with the actual size once read
+        with self._condition:
+            self._in_flight_bytes += size_delta
+            if size_delta < 0:
+                self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+def read_all_from_paths(  # pylint: disable=too-many-arguments
+        paths, max_concurrency=DEFAULT_MAX_CONCURRENCY, max_in_flight_bytes=None,
+        buffer_size=DEFAULT_BUFFER_SIZE, size_hint_fn=None):
+    """
+    Reads the files concurrently (using a thread pool),
+    yielding (path, content) as each read completes (i.e. not in the order of the paths).
+    With max_in_flight_bytes, reads will wait while the total size of the content read
+    (but not yet consumed) exceeds it. Without knowing the size of a file before reading it,
+    that limit may be exceeded by up to max_concurrency files.
+    size_hint_fn may return the (expected) size of a file, e.g. using already listed metadata,
+    which will then be reserved before reading it (no additional requests will be made).
+    """
+    limiter = _InFlightBytesLimiter(max_in_flight_bytes) if max_in_flight_bytes else None
+
+    def read(path):
+        reserved_size = 0
+        if limiter is not None:
+            if size_hint_fn is not None:
+                reserved_size = size_hint_fn(path) or 0
+            limiter.acquire(reserved_size)
+        try:
+            content = read_all_from_path(path, buffer_size=buffer_size)
+        except Exception:
+            if limiter is not None:
+                limiter.release(reserved_size)
+            raise
+        size = len(content)
+        if limiter is not None:
+            limiter.adjust(size - reserved_size)
+        return path, content, size
+
+    paths = iter(paths)
+    # queue some additional reads, so that threads don't need to wait for the consumer
+    max_pending = 2 * max_concurrency
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        pending = set()
+        try:
+            while True:
+                for path in islice(paths, max_pending - len(pending)):
+                    pending.add(executor.submit(read, path))
+                if not pending:
+                    return
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, content, size = future.result()
+                    try:
+                        yield path, content
+                    finally:
+                        if limiter is not None:
+                            limiter.release(size)
+        finally:
+            for future in pending:
+                future.cancel()
+            if limiter is not None:
+                limiter.close()
+
+
+def get_size_hint(path):
+    """
+    Returns the size of the file (as stored, i.e. compressed size of compressed files),
+    or None if the size could not be determined.
+    """
+    try:
+        metadata_list = FileSystems.match([path])[0].metadata_list
+    except BeamIOError:
+        return None
+    for metadata in metadata_list:
+        if metadata.path == path:
+            return metadata.size_in_bytes
+    return None
+
+
+def _is_local_uncompressed_path(path):
+    return (
+        isinstance(FileSystems.get_filesystem(path), LocalFileSystem)
+        and CompressionTypes.detect_compression_type(path) == CompressionTypes.UNCOMPRESSED
+    )
+
+
+def _map_local_file(path):
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            # empty files can't be mapped
+            return memoryview(b'')
+        # the mapping remains valid after the file was closed
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def _readinto(f, view):
+    readinto = getattr(f, 'readinto', None)
+    if readinto is not None:
+        return readinto(view) or 0
+    data = f.read(len(view))
+    view[:len(data)] = data
+    return len(data)
+
+
+def read_all_from_path_as_memoryview(
+        path, buffer_size=DEFAULT_BUFFER_SIZE, size_hint=None, use_mmap=True):
+    """
+    Reads the whole file, without the copy of read_all_from_path.
+    Local uncompressed files will be memory mapped (with use_mmap).
+    Otherwise the content is read into a buffer preallocated using the size hint
+    (by default the size of the file, which may be smaller for compressed files).
+    Returns a memoryview (read-only if memory mapped, otherwise a view of the
+    buffer not referenced elsewhere), use bytes(...) where bytes are required.
+    """
+    if use_mmap and _is_local_uncompressed_path(path):
+        return _map_local_file(path)
+    if size_hint is None:
+        size_hint = get_size_hint(path)
+    buf = bytearray((size_hint or 0) + 1)
+    length = 0
+    with FileSystems.open(path) as f:
+        while True:
+            if length == len(buf):
+                # the size hint was too small (e.g. for compressed files)
+                buf.extend(bytes(max(buffer_size, length)))
+            with memoryview(buf) as view:
+                with view[length:length + buffer_size] as chunk:
+                    n = _readinto(f, chunk)
+            if not n:
+                break
+            length += n
+    # not using memoryview.toreadonly, which requires Python 3.8
+    return memoryview(buf)[:length]
+
+
 def dirname(path):
     return FileSystems.split(path)[0]
 
@@ -50,7 +290,66 @@ def find_matching_filenames(pattern):
     return (x.path for x in FileSystems.match([pattern])[0].metadata_list)
 
 
-def mkdirs_if_not_exists(path):
+class ExistingDirectoryCache:
+    """
+    Directories known to exist (within this process), to avoid repeatedly checking them.
+    The least recently used directories will be removed once max_size is reached.
+    The cache is thread-safe.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_EXISTING_DIRECTORY_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._directories = OrderedDict()
+
+    def __len__(self):
+        return len(self._directories)
+
+    def contains(self, path: str) -> bool:
+        with self._lock:
+            if path not in self._directories:
+                return False
+            self._directories.move_to_end(path)
+            return True
+
+    def add(self, path: str):
+        with self._lock:
+            self._directories[path] = True
+            self._directories.move_to_end(path)
+            while len(self._directories) > self.max_size:
+                self._directories.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._directories.clear()
+
+
+DEFAULT_EXISTING_DIRECTORY_CACHE = ExistingDirectoryCache()
+
+
+def is_object_store_path(path):
+    return FileSystems.get_scheme(path) in OBJECT_STORE_SCHEMES
+
+
+def mkdirs_if_not_exists(
+        path,
+        existing_directory_cache: Optional[ExistingDirectoryCache] = (
+            DEFAULT_EXISTING_DIRECTORY_CACHE
+        ),
+        skip_object_store_directories: bool = False):
+    """
+    Creates the directory, unless it is known to exist.
+    By default, directories that exist will be remembered within the process
+    (pass None as the existing_directory_cache to always check).
+    Directories are intentionally not kept in the (persistent) FileMetadataCache,
+    as they may have been removed since.
+    With skip_object_store_directories, paths of object stores won't be checked at all
+    (as they have no real directories).
+    """
+    if skip_object_store_directories and is_object_store_path(path):
+        return
+    if existing_directory_cache is not None and existing_directory_cache.contains(path):
+        return
     if not FileSystems.exists(path):
         try:
             get_logger().info('attempting to create directory: %s', path)
@@ -58,11 +357,18 @@ def mkdirs_if_not_exists(path):
         except IOError:
             if not FileSystems.exists(path):
                 raise
+    if existing_directory_cache is not None:
+        existing_directory_cache.add(path)
 
 
-def save_file_content(output_filename, data):
-    mkdirs_if_not_exists(dirname(output_filename))
+def save_file_content(output_filename, data, file_metadata_cache: FileMetadataCache = None,
+                      **mkdirs_kwargs):
+    mkdirs_if_not_exists(
+        dirname(output_filename), **mkdirs_kwargs
+    )
     # Note: FileSystems.create transparently handles compression based on the file extension
     with FileSystems.create(output_filename) as f:
         f.write(data)
+    if file_metadata_cache is not None:
+        file_metadata_cache.invalidate(output_filename)
     return output_filename
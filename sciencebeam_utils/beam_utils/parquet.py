@@ -0,0 +1,103 @@
+from __future__ import absolute_import
+
+import logging
+
+import pyarrow as pa
+
+import apache_beam as beam
+from apache_beam.io.parquetio import ReadFromParquet, WriteToParquet
+
+from six import text_type
+
+
+DEFAULT_PARQUET_CODEC = 'snappy'
+
+DEFAULT_ROW_GROUP_BUFFER_SIZE = 64 * 1024 * 1024
+
+
+def get_logger():
+    return logging.getLogger(__name__)
+
+
+def get_string_schema(columns):
+    return pa.schema([(column, pa.string()) for column in columns])
+
+
+def _to_text_or_none(value):
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return text_type(value)
+
+
+def DictToParquetRecord(columns):
+    # only keep the columns, converting the values to text (as for the CSV output)
+    def wrapper(x):
+        return {column: _to_text_or_none(x.get(column)) for column in columns}
+    return wrapper
+
+
+class WriteDictParquet(beam.PTransform):
+    """
+    Writes dicts to Parquet, with the same columns argument as WriteDictCsv.
+    Without a schema, all of the columns are written as (nullable) strings.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self, path, columns, file_name_suffix='.parquet',
+            schema=None, codec=DEFAULT_PARQUET_CODEC,
+            row_group_buffer_size=DEFAULT_ROW_GROUP_BUFFER_SIZE):
+        super(WriteDictParquet, self).__init__()
+        self.path = path
+        self.columns = columns
+        self.file_name_suffix = file_name_suffix
+        self.schema = schema
+        self.codec = codec
+        self.row_group_buffer_size = row_group_buffer_size
+
+    def expand(self, input_or_inputs):
+        if self.schema is None:
+            schema = get_string_schema(self.columns)
+            input_or_inputs = (
+                input_or_inputs |
+                "ToRecord" >> beam.Map(DictToParquetRecord(self.columns))
+            )
+        else:
+            schema = self.schema
+        return (
+            input_or_inputs |
+            "Write" >> WriteToParquet(
+                self.path,
+                schema,
+                codec=self.codec,
+                row_group_buffer_size=self.row_group_buffer_size,
+                file_name_suffix=self.file_name_suffix
+            )
+        )
+
+
+class ReadDictParquet(beam.PTransform):
+    """
+    Reads Parquet files as dicts.
+    Only the passed in columns will be read (all columns if None).
+    Files are split by row groups, allowing them to be read in parallel.
+    """
+
+    def __init__(self, file_pattern, columns=None, min_bundle_size=0, validate=True):
+        super(ReadDictParquet, self).__init__()
+        self.file_pattern = file_pattern
+        self.columns = columns
+        self.min_bundle_size = min_bundle_size
+        self.validate = validate
+
+    def expand(self, input_or_inputs):
+        return (
+            input_or_inputs |
+            ReadFromParquet(
+                self.file_pattern,
+                min_bundle_size=self.min_bundle_size,
+                validate=self.validate,
+                columns=self.columns
+            )
+        )
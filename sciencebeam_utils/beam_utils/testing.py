@@ -26,6 +26,14 @@ from apache_beam.io.filesystem import FileMetadata, MatchResult, CompressionType
 from apache_beam.io.filesystems import FileSystems
 from apache_beam.metrics.metric import MetricsFilter
 
+from sciencebeam_utils.beam_utils.utils import (
+    DEFAULT_LATENCY_BUCKET_BOUNDS_MS,
+    DEFAULT_PERCENTILES,
+    get_latency_bucket_counter_names,
+    get_percentiles_from_bucket_counts,
+    get_processing_time_distribution_name
+)
+
 
 class TestPipeline(_TestPipeline):
     __test__ = False
@@ -254,13 +262,18 @@ def patch_beam_io():
 
 
 def get_counter_values(pipeline_result, names, wait_until_finish=True):
+    """
+    Returns the committed values of the counters,
+    or distributions (as DistributionResult with count, sum, min, max and mean).
+    """
     if wait_until_finish:
         pipeline_result.wait_until_finish()
     counter_values = {}
     for name in names:
-        counter = pipeline_result.metrics().query(
+        query_result = pipeline_result.metrics().query(
             MetricsFilter().with_name(name)
-        )['counters']
+        )
+        counter = query_result['counters'] or query_result['distributions']
         assert len(counter) <= 1
         if len(counter) == 1:
             counter_values[name] = counter[0].committed
@@ -272,3 +285,28 @@ def get_counter_value(pipeline_result, name, default_value=None, wait_until_fini
         pipeline_result, [name], wait_until_finish=wait_until_finish
     )
     return counter_values.get(name, default_value)
+
+
+def get_latency_percentiles(
+        pipeline_result, name, percentiles=DEFAULT_PERCENTILES,
+        bucket_bounds_ms=DEFAULT_LATENCY_BUCKET_BOUNDS_MS, wait_until_finish=True):
+    """
+    Returns the estimated latency percentiles (in milliseconds) recorded by TimedMap.
+    """
+    bucket_counter_names = get_latency_bucket_counter_names(name, bucket_bounds_ms)
+    processing_time_distribution_name = get_processing_time_distribution_name(name)
+    counter_values = get_counter_values(
+        pipeline_result, bucket_counter_names + [processing_time_distribution_name],
+        wait_until_finish=wait_until_finish
+    )
+    processing_time_distribution = counter_values.get(processing_time_distribution_name)
+    return get_percentiles_from_bucket_counts(
+        [counter_values.get(counter_name, 0) for counter_name in bucket_counter_names],
+        bucket_bounds_ms,
+        percentiles=percentiles,
+        max_value=(
+            processing_time_distribution.max / 1000.0
+            if processing_time_distribution
+            else None
+        )
+    )
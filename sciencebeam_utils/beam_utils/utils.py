@@ -1,8 +1,17 @@
 import logging
-from random import getrandbits
+import traceback
+from bisect import bisect_left
+from itertools import accumulate
+from random import getrandbits, random, randrange
+from threading import Lock
+from time import monotonic, perf_counter, time
+from uuid import uuid4
 
 import apache_beam as beam
 from apache_beam.metrics.metric import Metrics
+from apache_beam.transforms.util import ReshufflePerKey
+
+from sciencebeam_utils.utils.exceptions import get_serializable_exception
 
 
 def get_logger():
@@ -27,7 +36,34 @@ def _default_exception_log_fn(exception, value):
     )
 
 
-def MapOrLog(fn, log_fn=None, error_count=None):
+MAIN_OUTPUT_TAG = 'main'
+
+
+def get_dead_letter_record(value, exception, start_timestamp, duration_seconds):
+    return {
+        'element': value,
+        # the exception may be replaced by a SerializableException
+        'exception_type': type(exception).__name__,
+        'exception': get_serializable_exception(exception),
+        # the traceback won't be retained when pickling the exception
+        'traceback': ''.join(traceback.format_exception(
+            type(exception), exception, exception.__traceback__
+        )),
+        'start_timestamp': start_timestamp,
+        'duration_seconds': duration_seconds
+    }
+
+
+def MapOrLog(fn, log_fn=None, error_count=None, dead_letter_tag=None):
+    """
+    Maps the elements using fn, logging (and dropping) elements causing an exception.
+
+    With dead_letter_tag, the failed elements will additionally be output to that tag
+    (see get_dead_letter_record), with the results available via the MAIN_OUTPUT_TAG, e.g.:
+    results = pcoll | MapOrLog(fn, dead_letter_tag='failed')
+    results.main | ...
+    results.failed | WriteDeadLetterCsv(...)
+    """
     if log_fn is None:
         log_fn = _default_exception_log_fn
     error_counter = (
@@ -43,7 +79,83 @@ def MapOrLog(fn, log_fn=None, error_count=None):
             if error_counter:
                 error_counter.inc()
             log_fn(e, x)
-    return beam.FlatMap(wrapper)
+
+    if not dead_letter_tag:
+        return beam.FlatMap(wrapper)
+
+    def wrapper_with_dead_letter(x):
+        start_timestamp = time()
+        start = perf_counter()
+        try:
+            yield fn(x)
+        except Exception as e:  # pylint: disable=broad-except
+            if error_counter:
+                error_counter.inc()
+            log_fn(e, x)
+            yield beam.pvalue.TaggedOutput(dead_letter_tag, get_dead_letter_record(
+                x, e, start_timestamp=start_timestamp,
+                duration_seconds=perf_counter() - start
+            ))
+
+    return beam.FlatMap(wrapper_with_dead_letter).with_outputs(
+        dead_letter_tag, main=MAIN_OUTPUT_TAG
+    )
+
+
+DEFAULT_MAX_BATCH_SIZE = 100
+
+
+def _iter_batch_results_or_log(fn_batch, batch, on_error):
+    try:
+        results = list(fn_batch(batch))
+        if len(results) != len(batch):
+            raise ValueError('expected %d results, but got %d (for batch: %s)' % (
+                len(batch), len(results), batch
+            ))
+    except Exception as e:  # pylint: disable=broad-except
+        if len(batch) == 1:
+            on_error(e, batch[0])
+            return
+        # bisect the batch to isolate the failing items (the remaining items stay batched)
+        middle = len(batch) // 2
+        yield from _iter_batch_results_or_log(fn_batch, batch[:middle], on_error)
+        yield from _iter_batch_results_or_log(fn_batch, batch[middle:], on_error)
+        return
+    yield from results
+
+
+def BatchMapOrLog(
+        fn_batch, min_batch_size=1, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+        log_fn=None, error_count=None):
+    """
+    Similar to MapOrLog, but fn_batch receives a list of elements
+    (batched using beam.BatchElements) and returns a result for every element.
+    If a batch fails, it will be bisected until the failing elements are isolated,
+    which will be logged and counted (as with MapOrLog).
+    A batch with a different number of results is considered failed.
+    """
+    if log_fn is None:
+        log_fn = _default_exception_log_fn
+    error_counter = (
+        Metrics.counter('MapOrLog', error_count)
+        if error_count
+        else None
+    )
+
+    def on_error(e, x):
+        if error_counter:
+            error_counter.inc()
+        log_fn(e, x)
+
+    return GroupTransforms(lambda pcoll: (
+        pcoll |
+        "Batch" >> beam.BatchElements(
+            min_batch_size=min_batch_size, max_batch_size=max_batch_size
+        ) |
+        "MapBatchOrLog" >> beam.FlatMap(
+            lambda batch: _iter_batch_results_or_log(fn_batch, batch, on_error)
+        )
+    ))
 
 
 LEVEL_MAP = {
@@ -84,6 +196,182 @@ def TransformAndCount(transform, counter_name, counter_value_fn=None):
     ))
 
 
+DEFAULT_LATENCY_BUCKET_BOUNDS_MS = (
+    1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000
+)
+
+DEFAULT_PERCENTILES = (50, 95, 99)
+
+
+def get_processing_time_distribution_name(name):
+    return '%s_processing_time_us' % name
+
+
+def get_bytes_in_counter_name(name):
+    return '%s_bytes_in' % name
+
+
+def get_bytes_out_counter_name(name):
+    return '%s_bytes_out' % name
+
+
+def get_latency_bucket_counter_names(name, bucket_bounds_ms=DEFAULT_LATENCY_BUCKET_BOUNDS_MS):
+    return [
+        '%s_latency_le_%dms' % (name, bucket_bound_ms)
+        for bucket_bound_ms in bucket_bounds_ms
+    ] + ['%s_latency_gt_%dms' % (name, bucket_bounds_ms[-1])]
+
+
+def get_percentiles_from_bucket_counts(
+        bucket_counts, bucket_bounds, percentiles=DEFAULT_PERCENTILES, max_value=None):
+    """
+    Estimates the percentiles (as the upper bound of the bucket the percentile falls into),
+    bucket_counts has one more item than bucket_bounds (the values exceeding the last bound,
+    estimated as max_value).
+    """
+    total_count = sum(bucket_counts)
+    if not total_count:
+        return {percentile: None for percentile in percentiles}
+    upper_bounds = list(bucket_bounds) + [max_value]
+    cumulative_counts = list(accumulate(bucket_counts))
+    return {
+        percentile: upper_bounds[min(
+            bisect_left(cumulative_counts, percentile * total_count / 100.0),
+            len(upper_bounds) - 1
+        )]
+        for percentile in percentiles
+    }
+
+
+def get_size_in_bytes(value):
+    """
+    Returns the size of bytes-like values, the length of str values (approximating the bytes)
+    and 0 otherwise (e.g. for dicts, which require a specific function).
+    """
+    if isinstance(value, memoryview):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    return 0
+
+
+class _LatencyRecorder:
+    def __init__(self, namespace, name, bucket_bounds_ms=DEFAULT_LATENCY_BUCKET_BOUNDS_MS):
+        self.bucket_bounds_ms = bucket_bounds_ms
+        self.processing_time_distribution = Metrics.distribution(
+            namespace, get_processing_time_distribution_name(name)
+        )
+        self.latency_bucket_counters = [
+            Metrics.counter(namespace, counter_name)
+            for counter_name in get_latency_bucket_counter_names(name, bucket_bounds_ms)
+        ]
+
+    def record(self, duration_seconds):
+        self.processing_time_distribution.update(int(duration_seconds * 1000000))
+        self.latency_bucket_counters[
+            bisect_left(self.bucket_bounds_ms, duration_seconds * 1000)
+        ].inc()
+
+
+def TimedMap(
+        fn, name, bytes_in_fn=None, bytes_out_fn=None,
+        bucket_bounds_ms=DEFAULT_LATENCY_BUCKET_BOUNDS_MS):
+    """
+    Maps the elements using fn, while recording the processing time per element
+    as a distribution (in microseconds) and as latency bucket counters
+    (allowing percentiles to be estimated, see testing.get_latency_percentiles).
+    bytes_in_fn and bytes_out_fn may be passed in to additionally count the bytes.
+    """
+    namespace = 'TimedMap'
+    latency_recorder = _LatencyRecorder(namespace, name, bucket_bounds_ms)
+    bytes_in_counter = (
+        Metrics.counter(namespace, get_bytes_in_counter_name(name))
+        if bytes_in_fn
+        else None
+    )
+    bytes_out_counter = (
+        Metrics.counter(namespace, get_bytes_out_counter_name(name))
+        if bytes_out_fn
+        else None
+    )
+
+    def wrapper(x):
+        start = perf_counter()
+        result = fn(x)
+        latency_recorder.record(perf_counter() - start)
+        if bytes_in_counter:
+            bytes_in_counter.inc(bytes_in_fn(x))
+        if bytes_out_counter:
+            bytes_out_counter.inc(bytes_out_fn(result))
+        return result
+    return name >> beam.Map(wrapper)
+
+
+def get_bundle_time_name(name):
+    return '%s_bundle' % name
+
+
+def get_elements_in_counter_name(name):
+    return '%s_elements_in' % name
+
+
+def get_elements_out_counter_name(name):
+    return '%s_elements_out' % name
+
+
+class TimeBundleFn(beam.DoFn):  # pylint: disable=abstract-method
+    """
+    Records the wall time of every bundle (from start_bundle to finish_bundle),
+    using the metric names of TimedMap for get_bundle_time_name(name).
+    """
+
+    def __init__(self, name, bucket_bounds_ms=DEFAULT_LATENCY_BUCKET_BOUNDS_MS):
+        super(TimeBundleFn, self).__init__()
+        self.latency_recorder = _LatencyRecorder(
+            'TransformAndTime', get_bundle_time_name(name), bucket_bounds_ms
+        )
+        self._bundle_start = None
+
+    def start_bundle(self):
+        self._bundle_start = perf_counter()
+
+    def process(self, element):  # pylint: disable=arguments-differ
+        yield element
+
+    def finish_bundle(self):
+        self.latency_recorder.record(perf_counter() - self._bundle_start)
+
+
+def TransformAndTime(
+        transform, name, bytes_in_fn=None, bytes_out_fn=None,
+        bucket_bounds_ms=DEFAULT_LATENCY_BUCKET_BOUNDS_MS):
+    """
+    Records the wall time per bundle coming out of the transform (see TimeBundleFn),
+    and counts the elements going into and coming out of the transform.
+    As the steps are usually fused, the bundle time includes the steps before the transform
+    within the same stage (but not the ones after). Percentiles of the bundle time can be
+    estimated via testing.get_latency_percentiles(result, get_bundle_time_name(name)).
+    For the per element processing time of a function, see TimedMap.
+
+    bytes_in_fn and bytes_out_fn may be passed in to additionally count the bytes
+    (e.g. get_size_in_bytes for bytes or str elements).
+    """
+    def expand(pcoll):
+        pcoll = pcoll | "CountIn" >> Count(get_elements_in_counter_name(name), None)
+        if bytes_in_fn:
+            pcoll = pcoll | "BytesIn" >> Count(get_bytes_in_counter_name(name), bytes_in_fn)
+        pcoll = (
+            pcoll |
+            transform |
+            "TimeBundle" >> beam.ParDo(TimeBundleFn(name, bucket_bounds_ms=bucket_bounds_ms)) |
+            "CountOut" >> Count(get_elements_out_counter_name(name), None)
+        )
+        if bytes_out_fn:
+            pcoll = pcoll | "BytesOut" >> Count(get_bytes_out_counter_name(name), bytes_out_fn)
+        return pcoll
+    return GroupTransforms(expand)
+
+
 def _identity(x):
     return x
 
@@ -94,15 +382,94 @@ def _get_default_output_log_fn(log_level, log_prefix, log_value_fn):
     log_level = LEVEL_MAP.get(log_level, log_level)
 
     def _log_fn(x):
-        get_logger().log(
+        logger = get_logger()
+        # avoid calling log_value_fn if the message wouldn't be logged anyway
+        if not logger.isEnabledFor(log_level):
+            return
+        logger.log(
             log_level, '%s%.50s...', log_prefix, log_value_fn(x)
         )
     return _log_fn
 
 
-def TransformAndLog(transform, log_fn=None, log_prefix='', log_value_fn=None, log_level='info'):
+class RateLimiter:
+    """
+    Limits the number of events per second (using fixed one second windows).
+    """
+
+    def __init__(self, max_per_second, clock=monotonic):
+        self.max_per_second = max_per_second
+        self._clock = clock
+        self._lock = Lock()
+        self._window_start = None
+        self._window_count = 0
+
+    def try_acquire(self):
+        now = self._clock()
+        with self._lock:
+            if self._window_start is None or now - self._window_start >= 1.0:
+                self._window_start = now
+                self._window_count = 0
+            if self._window_count >= self.max_per_second:
+                return False
+            self._window_count += 1
+            return True
+
+
+_rate_limiter_by_key = {}
+_rate_limiter_lock = Lock()
+
+
+def get_shared_rate_limiter(key, max_per_second):
+    """
+    Returns the rate limiter for the key, shared within the worker process
+    (i.e. across deserialized copies of the same function).
+    """
+    with _rate_limiter_lock:
+        rate_limiter = _rate_limiter_by_key.get(key)
+        if rate_limiter is None:
+            rate_limiter = RateLimiter(max_per_second)
+            _rate_limiter_by_key[key] = rate_limiter
+        return rate_limiter
+
+
+def _get_sampled_log_fn(log_fn, sample_every=None, sample_probability=None,
+                        max_logs_per_second=None):
+    if not sample_every and sample_probability is None and not max_logs_per_second:
+        return log_fn
+    rate_limiter_key = uuid4().hex
+    # list to allow the count to be updated within the closure
+    element_count = [0]
+
+    def _sampled_log_fn(x):
+        if sample_every:
+            element_index = element_count[0]
+            element_count[0] += 1
+            if element_index % sample_every:
+                return
+        if sample_probability is not None and random() >= sample_probability:
+            return
+        if max_logs_per_second and not get_shared_rate_limiter(
+                rate_limiter_key, max_logs_per_second).try_acquire():
+            return
+        log_fn(x)
+    return _sampled_log_fn
+
+
+def TransformAndLog(  # pylint: disable=too-many-arguments
+        transform, log_fn=None, log_prefix='', log_value_fn=None, log_level='info',
+        sample_every=None, sample_probability=None, max_logs_per_second=None):
+    """
+    Logs the output of the transform.
+    To reduce the logging, only every sample_every-th element or elements with the
+    sample_probability can be logged, limited to max_logs_per_second (per worker).
+    """
     if log_fn is None:
         log_fn = _get_default_output_log_fn(log_level, log_prefix, log_value_fn)
+    log_fn = _get_sampled_log_fn(
+        log_fn, sample_every=sample_every, sample_probability=sample_probability,
+        max_logs_per_second=max_logs_per_second
+    )
 
     return GroupTransforms(lambda pcoll: (
         pcoll |
@@ -126,7 +493,7 @@ def PreventFusion(key_fn=None, name="PreventFusion"):
     See:
     https://cloud.google.com/dataflow/service/dataflow-service-desc#preventing-fusion
 
-    TODO Replace by: https://github.com/apache/beam/pull/4040
+    See Redistribute for an alternative with a bounded number of keys (and optional batching).
     """
     if key_fn is None:
         key_fn = _default_random_key_fn
@@ -136,3 +503,35 @@ def PreventFusion(key_fn=None, name="PreventFusion"):
         "GroupByKey" >> beam.GroupByKey() |
         "Ungroup" >> beam.FlatMap(lambda element: element[1])
     ))
+
+
+DEFAULT_REDISTRIBUTE_BUCKET_COUNT = 1024
+
+
+def Redistribute(bucket_count=DEFAULT_REDISTRIBUTE_BUCKET_COUNT, batch_size=None,
+                 name="Redistribute"):
+    """
+    Redistributes the elements across workers (e.g. to prevent fusion), similar to PreventFusion
+    but using a bounded number of random keys (buckets) and Reshuffle (retaining windows).
+    The bucket count should exceed the number of workers (times the threads per worker).
+
+    Without batch_size, every element is shuffled with its key as well as the timestamp
+    and pane metadata added by Reshuffle. That is about as many bytes per element as
+    PreventFusion (the smaller key offsets the metadata), with a somewhat higher CPU cost.
+    With batch_size, elements will be batched before the shuffle, sharing the key and
+    metadata across the batch (the batches will then be distributed).
+    """
+    if not batch_size:
+        return name >> GroupTransforms(lambda pcoll: (
+            pcoll |
+            "AddKey" >> beam.Map(lambda x: (randrange(bucket_count), x)) |
+            "Reshuffle" >> ReshufflePerKey() |
+            "RemoveKey" >> beam.Map(lambda element: element[1])
+        ))
+    return name >> GroupTransforms(lambda pcoll: (
+        pcoll |
+        "Batch" >> beam.BatchElements(min_batch_size=batch_size, max_batch_size=batch_size) |
+        "AddKey" >> beam.Map(lambda batch: (randrange(bucket_count), batch)) |
+        "Reshuffle" >> ReshufflePerKey() |
+        "Unbatch" >> beam.FlatMap(lambda element: element[1])
+    ))
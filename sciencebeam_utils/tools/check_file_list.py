@@ -2,12 +2,30 @@ from __future__ import division
 
 import argparse
 import logging
+from collections import Counter, deque, OrderedDict
+from contextlib import contextmanager
 from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from math import log, sqrt
+from random import Random
 
 from apache_beam.io.filesystems import FileSystems
+from apache_beam.io.filesystem import BeamIOError
+
+from sciencebeam_utils.beam_utils.file_metadata_cache import (
+    DEFAULT_MISSING_TTL_SECONDS,
+    DEFAULT_TTL_SECONDS,
+    GLOB_CHARS,
+    MISSING_FILE_METADATA,
+    FileMetadata,
+    FileMetadataCache,
+    get_file_metadata,
+    to_file_metadata
+)
 
 from sciencebeam_utils.utils.file_list import (
-    load_file_list
+    iter_file_list
 )
 
 from sciencebeam_utils.tools.tool_utils import (
@@ -23,6 +41,23 @@ LOGGER = logging.getLogger(__name__)
 
 DEFAULT_EXAMPLE_COUNT = 3
 
+DEFAULT_BATCH_SIZE = 10000
+
+DEFAULT_MAX_WORKERS = 50
+
+# listing a directory requires one request per page (e.g. 1000 objects),
+# which is only worth it if enough files in that directory are requested
+DEFAULT_MIN_DIRECTORY_FILE_COUNT = 100
+
+# the listings of large directories may take up a considerable amount of memory
+DEFAULT_MAX_DIRECTORY_LISTING_COUNT = 100
+
+DEFAULT_SAMPLE_MARGIN = 0.01
+
+DEFAULT_SAMPLE_CONFIDENCE = 0.95
+
+MIN_SAMPLE_CHECK_COUNT = 30
+
 
 def parse_args(argv=None):
     parser = argparse.ArgumentParser(
@@ -45,62 +80,610 @@ def parse_args(argv=None):
         help='number of missing examples to display'
     )
 
+    add_file_exists_args(parser)
+    add_file_metadata_cache_args(parser)
+    add_sample_args(parser)
     add_limit_args(parser)
     add_default_args(parser)
 
     return parser.parse_args(argv)
 
 
-def map_file_list_to_file_exists(file_list):
-    with ThreadPoolExecutor(max_workers=50) as executor:
-        return list(executor.map(FileSystems.exists, file_list))
+def add_file_exists_args(parser):
+    parser.add_argument(
+        '--max-workers', type=int, required=False,
+        default=DEFAULT_MAX_WORKERS,
+        help='maximum number of concurrent file checks'
+    )
+    parser.add_argument(
+        '--batch-size', type=int, required=False,
+        default=DEFAULT_BATCH_SIZE,
+        help='number of files to check per batch'
+    )
+    parser.add_argument(
+        '--list-directories', action='store_true', default=False,
+        help=(
+            'check files by listing their parent directories'
+            ' (one request per directory rather than per file)'
+        )
+    )
+
+
+def add_file_metadata_cache_args(parser):
+    parser.add_argument(
+        '--metadata-cache', type=str, required=False,
+        help='path to a local file metadata cache (sqlite), to avoid repeated file checks'
+    )
+    parser.add_argument(
+        '--metadata-cache-ttl', type=float, required=False,
+        default=DEFAULT_TTL_SECONDS,
+        help='number of seconds after which cached file metadata will be ignored'
+    )
+    parser.add_argument(
+        '--metadata-cache-missing-ttl', type=float, required=False,
+        default=DEFAULT_MISSING_TTL_SECONDS,
+        help=(
+            'number of seconds after which cached missing files will be ignored'
+            ' (by default missing files are not cached)'
+        )
+    )
+    parser.add_argument(
+        '--refresh-metadata-cache', action='store_true', default=False,
+        help='ignore (but update) the cached file metadata'
+    )
+
+
+@contextmanager
+def _no_file_metadata_cache():
+    # similar to contextlib.nullcontext, which requires Python 3.7
+    yield None
+
+
+def open_file_metadata_cache_for_args(opt):
+    if not opt.metadata_cache:
+        return _no_file_metadata_cache()
+    LOGGER.info('using file metadata cache: %s', opt.metadata_cache)
+    return FileMetadataCache(
+        opt.metadata_cache,
+        ttl_seconds=opt.metadata_cache_ttl,
+        missing_ttl_seconds=opt.metadata_cache_missing_ttl,
+        refresh=opt.refresh_metadata_cache
+    )
+
+
+def get_file_exists_kwargs(opt, file_metadata_cache: FileMetadataCache = None):
+    kwargs = {
+        'max_workers': opt.max_workers,
+        'batch_size': opt.batch_size,
+        'list_directories': opt.list_directories
+    }
+    if file_metadata_cache is not None:
+        kwargs['file_metadata_cache'] = file_metadata_cache
+    return kwargs
+
+
+def add_sample_args(parser):
+    parser.add_argument(
+        '--sample-size', type=int, required=False,
+        help=(
+            'only check up to this number of randomly selected files'
+            ' and estimate the proportion of existing files'
+        )
+    )
+    parser.add_argument(
+        '--sample-margin', type=float, required=False,
+        default=DEFAULT_SAMPLE_MARGIN,
+        help=(
+            'stop checking the sample once the confidence interval'
+            ' is within this margin (e.g. 0.01 for +/- 1%%)'
+        )
+    )
+    parser.add_argument(
+        '--sample-confidence', type=float, required=False,
+        default=DEFAULT_SAMPLE_CONFIDENCE,
+        help='confidence level of the confidence interval'
+    )
+    parser.add_argument(
+        '--sample-missing-count', type=int, required=False,
+        help='stop checking the sample once this number of missing files were found'
+    )
+    parser.add_argument(
+        '--sample-seed', type=int, required=False,
+        help='random seed used to select the sample'
+    )
+
+
+def get_sample_kwargs(opt):
+    if not opt.sample_size:
+        return {}
+    return {
+        'sample_size': opt.sample_size,
+        'sample_margin': opt.sample_margin,
+        'sample_confidence': opt.sample_confidence,
+        'sample_missing_count': opt.sample_missing_count,
+        'sample_seed': opt.sample_seed
+    }
+
+
+def iter_file_list_batches(file_list, batch_size: int = DEFAULT_BATCH_SIZE):
+    file_list = iter(file_list)
+    while True:
+        batch = list(islice(file_list, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _iter_map_with_bounded_concurrency(executor, fn, iterable, max_in_flight: int):
+    # similar to executor.map, but without submitting all of the items upfront
+    futures = deque()
+    for item in iterable:
+        futures.append((item, executor.submit(fn, item)))
+        if len(futures) >= max_in_flight:
+            item, future = futures.popleft()
+            yield item, future.result()
+    while futures:
+        item, future = futures.popleft()
+        yield item, future.result()
+
+
+def _is_glob_pattern(path):
+    return any(c in path for c in GLOB_CHARS)
+
+
+def get_file_metadata_in_directory(directory):
+    match_result = FileSystems.match([FileSystems.join(directory, '*')])[0]
+    return {
+        beam_file_metadata.path: to_file_metadata(beam_file_metadata)
+        for beam_file_metadata in match_result.metadata_list
+    }
+
+
+def _list_directory_or_none(directory):
+    try:
+        return get_file_metadata_in_directory(directory)
+    except BeamIOError as e:
+        LOGGER.debug('failed to list directory %s, checking files instead: %s', directory, e)
+        return None
+
+
+def _get_file_exists_metadata(file_path):
+    # a single exists request, rather than match (exists and metadata)
+    return FileMetadata(exists=FileSystems.exists(file_path))
+
+
+def _get_file_metadata_list_and_directory_listing(
+        directory_and_file_list, get_file_metadata_fn=get_file_metadata):
+    directory, file_list = directory_and_file_list
+    file_metadata_map = (
+        _list_directory_or_none(directory)
+        if directory is not None
+        else None
+    )
+    if file_metadata_map is None:
+        return [get_file_metadata_fn(file_path) for file_path in file_list], None
+    return [
+        file_metadata_map.get(file_path, MISSING_FILE_METADATA)
+        for file_path in file_list
+    ], file_metadata_map
+
+
+class _DirectoryListings:
+    """
+    Keeps the directory listings of a run, to avoid listing a directory repeatedly.
+    A directory will only be listed once enough files in it were requested (across batches).
+    The least recently used listings will be removed once max_listing_count is reached
+    (a removed directory would be listed again, if requested again).
+    """
+
+    def __init__(
+            self, min_directory_file_count: int,
+            max_listing_count: int = DEFAULT_MAX_DIRECTORY_LISTING_COUNT):
+        self.min_directory_file_count = min_directory_file_count
+        self.max_listing_count = max_listing_count
+        self.file_metadata_map_by_directory = OrderedDict()
+        self.failed_directories = set()
+        self.requested_file_count_by_directory = Counter()
+
+    def get_file_metadata_map(self, directory):
+        file_metadata_map = self.file_metadata_map_by_directory.get(directory)
+        if file_metadata_map is not None:
+            self.file_metadata_map_by_directory.move_to_end(directory)
+        return file_metadata_map
+
+    def should_list_directory(self, directory, file_count: int):
+        if directory in self.failed_directories or _is_glob_pattern(directory):
+            return False
+        self.requested_file_count_by_directory[directory] += file_count
+        return (
+            self.requested_file_count_by_directory[directory]
+            >= self.min_directory_file_count
+        )
+
+    def add(self, directory, file_metadata_map):
+        if file_metadata_map is None:
+            self.failed_directories.add(directory)
+            return
+        self.file_metadata_map_by_directory[directory] = file_metadata_map
+        self.file_metadata_map_by_directory.move_to_end(directory)
+        while len(self.file_metadata_map_by_directory) > self.max_listing_count:
+            self.file_metadata_map_by_directory.popitem(last=False)
+
+
+def _group_file_list_by_directory(file_list):
+    file_list_by_directory = OrderedDict()
+    for file_path in file_list:
+        file_list_by_directory.setdefault(FileSystems.split(file_path)[0], []).append(file_path)
+    return file_list_by_directory
+
+
+def _get_directory_and_file_lists_to_check(
+        file_list, directory_listings: _DirectoryListings, file_metadata_by_path: dict):
+    # resolves files in already listed directories (adding to file_metadata_by_path),
+    # returning the (directory, file_list) to list, or (None, [file_path]) to check individually
+    directory_and_file_lists = []
+    for directory, directory_file_list in _group_file_list_by_directory(file_list).items():
+        file_metadata_map = directory_listings.get_file_metadata_map(directory)
+        if file_metadata_map is not None:
+            for file_path in directory_file_list:
+                file_metadata_by_path[file_path] = file_metadata_map.get(
+                    file_path, MISSING_FILE_METADATA
+                )
+        elif directory_listings.should_list_directory(directory, len(directory_file_list)):
+            directory_and_file_lists.append((directory, directory_file_list))
+        else:
+            # not (yet) worth listing the directory, check files individually
+            directory_and_file_lists.extend(
+                (None, [file_path]) for file_path in directory_file_list
+            )
+    return directory_and_file_lists
+
+
+def _get_cached_file_metadata_by_path(file_list, file_metadata_cache: FileMetadataCache):
+    if file_metadata_cache is None:
+        return {}
+    file_metadata_by_path = {}
+    for file_path in file_list:
+        file_metadata = file_metadata_cache.get(file_path)
+        if file_metadata is not None:
+            file_metadata_by_path[file_path] = file_metadata
+    return file_metadata_by_path
+
+
+def _check_directory_and_file_lists(
+        executor, directory_and_file_lists,
+        directory_listings: _DirectoryListings, file_metadata_by_path: dict,
+        get_file_metadata_fn=get_file_metadata):
+    for (directory, directory_file_list), (file_metadata_list, file_metadata_map) in zip(
+        directory_and_file_lists,
+        executor.map(
+            partial(
+                _get_file_metadata_list_and_directory_listing,
+                get_file_metadata_fn=get_file_metadata_fn
+            ),
+            directory_and_file_lists
+        )
+    ):
+        if directory is not None:
+            directory_listings.add(directory, file_metadata_map)
+        file_metadata_by_path.update(zip(directory_file_list, file_metadata_list))
+
+
+def _iter_file_list_with_file_exists_using_directory_listing(  # pylint: disable=too-many-arguments
+        executor, file_list, batch_size: int, min_directory_file_count: int,
+        max_directory_listing_count: int = DEFAULT_MAX_DIRECTORY_LISTING_COUNT,
+        file_metadata_cache: FileMetadataCache = None):
+    directory_listings = _DirectoryListings(
+        min_directory_file_count, max_listing_count=max_directory_listing_count
+    )
+    # only retrieve the full file metadata of individually checked files if it will be cached
+    get_file_metadata_fn = (
+        get_file_metadata
+        if file_metadata_cache is not None
+        else _get_file_exists_metadata
+    )
+    for file_list_batch in iter_file_list_batches(file_list, batch_size=batch_size):
+        file_metadata_by_path = _get_cached_file_metadata_by_path(
+            file_list_batch, file_metadata_cache
+        )
+        cached_file_paths = set(file_metadata_by_path.keys())
+        directory_and_file_lists = _get_directory_and_file_lists_to_check(
+            [file_path for file_path in file_list_batch if file_path not in file_metadata_by_path],
+            directory_listings=directory_listings,
+            file_metadata_by_path=file_metadata_by_path
+        )
+        _check_directory_and_file_lists(
+            executor, directory_and_file_lists,
+            directory_listings=directory_listings,
+            file_metadata_by_path=file_metadata_by_path,
+            get_file_metadata_fn=get_file_metadata_fn
+        )
+        if file_metadata_cache is not None:
+            for file_path, file_metadata in file_metadata_by_path.items():
+                if file_path not in cached_file_paths:
+                    file_metadata_cache.put(file_path, file_metadata)
+        for file_path in file_list_batch:
+            yield file_path, file_metadata_by_path[file_path].exists
+
+
+def iter_file_list_with_file_exists(  # pylint: disable=too-many-arguments
+        file_list,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        list_directories: bool = False,
+        min_directory_file_count: int = DEFAULT_MIN_DIRECTORY_FILE_COUNT,
+        max_directory_listing_count: int = DEFAULT_MAX_DIRECTORY_LISTING_COUNT,
+        file_metadata_cache: FileMetadataCache = None):
+    """
+    Lazily checks whether the files exist, yielding (file_path, exists) in the original order.
+
+    At most max_workers checks will run concurrently.
+    With list_directories, files sharing a parent directory are checked
+    using a single directory listing (processing batch_size files at a time),
+    once min_directory_file_count files in that directory were requested.
+    Up to max_directory_listing_count listings are kept in memory (least recently used),
+    i.e. a directory is only listed once per call, unless its listing was removed.
+    With a file_metadata_cache, cached results are used and new results are cached.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        if list_directories:
+            yield from _iter_file_list_with_file_exists_using_directory_listing(
+                executor, file_list,
+                batch_size=batch_size,
+                min_directory_file_count=min_directory_file_count,
+                max_directory_listing_count=max_directory_listing_count,
+                file_metadata_cache=file_metadata_cache
+            )
+        else:
+            yield from _iter_map_with_bounded_concurrency(
+                executor,
+                (
+                    file_metadata_cache.exists
+                    if file_metadata_cache is not None
+                    else FileSystems.exists
+                ),
+                file_list,
+                max_in_flight=2 * max_workers
+            )
+
+
+def map_file_list_to_file_exists(file_list, **kwargs):
+    return [
+        file_exists
+        for _, file_exists in iter_file_list_with_file_exists(file_list, **kwargs)
+    ]
 
 
 def format_file_list(file_list):
     return str(file_list)
 
 
+def format_file_exists_counts(
+    file_exists_count: int,
+    file_missing_count: int,
+    files_missing_examples
+):
+    total_count = file_exists_count + file_missing_count
+    if not total_count:
+        return 'empty file list'
+    return (
+        'files exist: %d (%.0f%%), files missing: %d (%.0f%%)%s' % (
+            file_exists_count, 100.0 * file_exists_count / total_count,
+            file_missing_count, 100.0 * file_missing_count / total_count,
+            (
+                ' (example missing: %s)' % format_file_list(files_missing_examples)
+                if files_missing_examples
+                else ''
+            )
+        )
+    )
+
+
 def format_file_exists_results(
     file_exists,
     file_list,
     example_count: int = DEFAULT_EXAMPLE_COUNT
 ):
-    if not file_exists:
-        return 'empty file list'
     file_exists_count = sum(file_exists)
-    file_missing_count = len(file_exists) - file_exists_count
     files_missing = [s for s, exists in zip(file_list, file_exists) if not exists]
+    return format_file_exists_counts(
+        file_exists_count,
+        len(file_exists) - file_exists_count,
+        files_missing[:example_count]
+    )
+
+
+def get_wilson_score_interval(success_count: int, total_count: int, z: float):
+    if not total_count:
+        return 0.0, 1.0
+    p = success_count / total_count
+    z2 = z * z
+    denominator = 1 + z2 / total_count
+    center = (p + z2 / (2 * total_count)) / denominator
+    half_width = z * sqrt(
+        p * (1 - p) / total_count + z2 / (4 * total_count * total_count)
+    ) / denominator
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+# coefficients of the rational approximation of the inverse normal CDF by Peter Acklam
+# (relative error below 1.15e-9), as statistics.NormalDist requires Python 3.8
+_INV_NORM_A = (
+    -3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+    1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00
+)
+_INV_NORM_B = (
+    -5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+    6.680131188771972e+01, -1.328068155288572e+01
+)
+_INV_NORM_C = (
+    -7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00,
+    -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00
+)
+_INV_NORM_D = (
+    7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00,
+    3.754408661907416e+00
+)
+_INV_NORM_P_LOW = 0.02425
+
+
+def _polynomial(coefficients, x):
+    result = 0.0
+    for coefficient in coefficients:
+        result = result * x + coefficient
+    return result
+
+
+def get_normal_inv_cdf(p: float) -> float:
+    if not 0 < p < 1:
+        raise ValueError('p must be between 0 and 1: %s' % p)
+    if p < _INV_NORM_P_LOW:
+        q = sqrt(-2 * log(p))
+        return _polynomial(_INV_NORM_C, q) / (_polynomial(_INV_NORM_D, q) * q + 1)
+    if p > 1 - _INV_NORM_P_LOW:
+        return -get_normal_inv_cdf(1 - p)
+    q = p - 0.5
+    r = q * q
+    return _polynomial(_INV_NORM_A, r) * q / (_polynomial(_INV_NORM_B, r) * r + 1)
+
+
+def get_z_score_for_confidence(confidence: float) -> float:
+    return get_normal_inv_cdf((1 + confidence) / 2)
+
+
+def sample_file_list(file_list, sample_size: int, random: Random = None):
+    """
+    Selects a random sample (using reservoir sampling, reading the file list once).
+    The sample is returned in random order, i.e. any prefix is also a random sample.
+    """
+    if random is None:
+        random = Random()
+    sample = []
+    for i, file_path in enumerate(file_list):
+        if i < sample_size:
+            sample.append(file_path)
+            continue
+        j = random.randint(0, i)
+        if j < sample_size:
+            sample[j] = file_path
+    random.shuffle(sample)
+    return sample
+
+
+def format_file_exists_estimate(
+    file_exists_count: int,
+    file_missing_count: int,
+    files_missing_examples,
+    confidence: float,
+    confidence_interval
+):
+    total_count = file_exists_count + file_missing_count
+    if not total_count:
+        return 'empty file list'
     return (
-        'files exist: %d (%.0f%%), files missing: %d (%.0f%%)%s' % (
-            file_exists_count, 100.0 * file_exists_count / len(file_exists),
-            file_missing_count, 100.0 * file_missing_count / len(file_exists),
+        'files exist (estimated from %d checked files): %.1f%%'
+        ' (%.0f%% confidence interval: %.1f%% - %.1f%%)%s' % (
+            total_count, 100.0 * file_exists_count / total_count,
+            100.0 * confidence,
+            100.0 * confidence_interval[0], 100.0 * confidence_interval[1],
             (
-                ' (example missing: %s)' % format_file_list(files_missing[:example_count])
-                if files_missing
+                ' (example missing: %s)' % format_file_list(files_missing_examples)
+                if files_missing_examples
                 else ''
             )
         )
     )
 
 
+def check_file_sample_and_report_result(  # pylint: disable=too-many-arguments, too-many-locals
+    file_list,
+    sample_size: int,
+    example_count: int = DEFAULT_EXAMPLE_COUNT,
+    sample_margin: float = DEFAULT_SAMPLE_MARGIN,
+    sample_confidence: float = DEFAULT_SAMPLE_CONFIDENCE,
+    sample_missing_count: int = None,
+    sample_seed: int = None,
+    **kwargs
+):
+    sample = sample_file_list(file_list, sample_size, random=Random(sample_seed))
+    z = get_z_score_for_confidence(sample_confidence)
+    file_exists_count = 0
+    file_missing_count = 0
+    files_missing_examples = []
+    confidence_interval = (0.0, 1.0)
+    for file_path, file_exists in iter_file_list_with_file_exists(sample, **kwargs):
+        if file_exists:
+            file_exists_count += 1
+        else:
+            file_missing_count += 1
+            if len(files_missing_examples) < example_count:
+                files_missing_examples.append(file_path)
+        checked_count = file_exists_count + file_missing_count
+        confidence_interval = get_wilson_score_interval(
+            file_exists_count, checked_count, z
+        )
+        if sample_missing_count and file_missing_count >= sample_missing_count:
+            LOGGER.info('found %d missing files, stopping', file_missing_count)
+            break
+        if (
+            checked_count >= MIN_SAMPLE_CHECK_COUNT
+            and (confidence_interval[1] - confidence_interval[0]) / 2 <= sample_margin
+        ):
+            LOGGER.info('confidence interval within margin, stopping')
+            break
+    LOGGER.info(
+        '%s', format_file_exists_estimate(
+            file_exists_count, file_missing_count, files_missing_examples,
+            confidence=sample_confidence,
+            confidence_interval=confidence_interval
+        )
+    )
+    assert file_exists_count > 0
+
+
 def check_files_and_report_result(
     file_list,
-    example_count: int = DEFAULT_EXAMPLE_COUNT
+    example_count: int = DEFAULT_EXAMPLE_COUNT,
+    sample_size: int = None,
+    **kwargs
 ):
-    file_exists = map_file_list_to_file_exists(file_list)
+    if sample_size:
+        check_file_sample_and_report_result(
+            file_list, sample_size=sample_size, example_count=example_count, **kwargs
+        )
+        return
+    # the file list may be a (lazy) iterable, avoid keeping it in memory
+    file_exists_count = 0
+    file_missing_count = 0
+    files_missing_examples = []
+    for file_path, file_exists in iter_file_list_with_file_exists(file_list, **kwargs):
+        if file_exists:
+            file_exists_count += 1
+            continue
+        file_missing_count += 1
+        if len(files_missing_examples) < example_count:
+            files_missing_examples.append(file_path)
     LOGGER.info(
-        '%s', format_file_exists_results(file_exists, file_list, example_count=example_count)
+        '%s', format_file_exists_counts(
+            file_exists_count, file_missing_count, files_missing_examples
+        )
     )
-    assert sum(file_exists) > 0
+    assert file_exists_count > 0
 
 
 def run(opt):
-    file_list = load_file_list(
+    file_list = iter_file_list(
         opt.file_list,
         column=opt.file_column,
         limit=opt.limit
     )
-    check_files_and_report_result(file_list, example_count=opt.example_count)
+    with open_file_metadata_cache_for_args(opt) as file_metadata_cache:
+        check_files_and_report_result(
+            file_list,
+            example_count=opt.example_count,
+            **get_file_exists_kwargs(opt, file_metadata_cache=file_metadata_cache),
+            **get_sample_kwargs(opt)
+        )
 
 
 def main(argv=None):
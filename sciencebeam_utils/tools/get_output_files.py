@@ -1,20 +1,33 @@
 import argparse
 import logging
+from hashlib import blake2b
+from itertools import chain, islice, zip_longest
+
+from apache_beam.io.filesystems import FileSystems
 
 from sciencebeam_utils.utils.file_list import (
-    load_file_list,
+    iter_file_list,
+    iter_plain_file_list,
+    load_plain_file_list,
     save_file_list,
-    to_relative_file_list
+    save_plain_file_list,
+    iter_relative_file_list
 )
 
 from sciencebeam_utils.utils.file_path import (
     join_if_relative_path,
     get_or_validate_base_path,
-    get_output_file
+    iter_output_files
 )
 
 from sciencebeam_utils.tools.check_file_list import (
     DEFAULT_EXAMPLE_COUNT,
+    add_file_exists_args,
+    add_file_metadata_cache_args,
+    add_sample_args,
+    open_file_metadata_cache_for_args,
+    get_file_exists_kwargs,
+    get_sample_kwargs,
     check_files_and_report_result
 )
 
@@ -29,6 +42,13 @@ from sciencebeam_utils.tools.tool_utils import (
 LOGGER = logging.getLogger(__name__)
 
 
+FINGERPRINT_FILE_SUFFIX = '.fingerprints'
+
+FINGERPRINT_DIGEST_SIZE = 8
+
+TEMP_FILE_SUFFIX = '.part'
+
+
 def parse_args(argv=None):
     parser = argparse.ArgumentParser(
         'Get output files based on source files and suffix.'
@@ -74,6 +94,13 @@ def parse_args(argv=None):
 
     add_limit_args(parser)
 
+    parser.add_argument(
+        '--incremental', action='store_true', default=False,
+        help=(
+            'only process source files added or removed since the previous run'
+            ' (requires the fingerprints saved alongside the output file list)'
+        )
+    )
     parser.add_argument(
         '--check', action='store_true', default=False,
         help='check whether the output files exist'
@@ -87,63 +114,274 @@ def parse_args(argv=None):
         default=DEFAULT_EXAMPLE_COUNT,
         help='number of missing examples to display'
     )
+    add_file_exists_args(parser)
+    add_file_metadata_cache_args(parser)
+    add_sample_args(parser)
 
     add_default_args(parser)
 
     return parser.parse_args(argv)
 
 
+def iter_output_file_list(file_list, source_base_path, output_base_path, output_file_suffix):
+    return iter_output_files(file_list, source_base_path, output_base_path, output_file_suffix)
+
+
 def get_output_file_list(file_list, source_base_path, output_base_path, output_file_suffix):
-    return [
-        get_output_file(filename, source_base_path, output_base_path, output_file_suffix)
-        for filename in file_list
-    ]
+    return list(iter_output_file_list(
+        file_list, source_base_path, output_base_path, output_file_suffix
+    ))
 
 
-def run(opt):
-    source_file_list = load_file_list(
-        join_if_relative_path(
-            opt.source_base_path,
-            opt.source_file_list
-        ),
-        column=opt.source_file_column,
-        limit=opt.limit
+def get_source_fingerprint(source_url: str) -> int:
+    return int.from_bytes(
+        blake2b(source_url.encode('utf-8'), digest_size=FINGERPRINT_DIGEST_SIZE).digest(),
+        'big'
     )
-    source_base_path = get_or_validate_base_path(
-        source_file_list, opt.source_base_path
+
+
+def format_fingerprint(fingerprint: int) -> str:
+    return '%016x' % fingerprint
+
+
+def get_options_fingerprint(opt, source_base_path: str) -> str:
+    return blake2b(repr([
+        source_base_path, opt.output_base_path, opt.output_file_suffix,
+        opt.output_file_column, bool(opt.use_relative_paths)
+    ]).encode('utf-8'), digest_size=FINGERPRINT_DIGEST_SIZE).hexdigest()
+
+
+def get_fingerprint_file_path(output_file_list: str) -> str:
+    return output_file_list + FINGERPRINT_FILE_SUFFIX
+
+
+def save_fingerprints(fingerprint_file_path: str, options_fingerprint: str, fingerprints):
+    save_plain_file_list(fingerprint_file_path, chain(
+        [options_fingerprint],
+        (format_fingerprint(fingerprint) for fingerprint in fingerprints)
+    ))
+
+
+def read_options_fingerprint(fingerprint_file_path: str) -> str:
+    # reading just the first line (fully consuming the iterable, to close the file)
+    return next(iter(load_plain_file_list(fingerprint_file_path, limit=1)), None)
+
+
+def iter_source_fingerprints(fingerprint_file_path: str):
+    """
+    Returns an iterable of the source fingerprints (in the order of the output file list),
+    i.e. skipping the options fingerprint.
+    """
+    return (
+        int(line, 16)
+        for line in islice(iter_plain_file_list(fingerprint_file_path), 1, None)
     )
 
-    target_file_list = get_output_file_list(
-        source_file_list, source_base_path, opt.output_base_path, opt.output_file_suffix
+
+def _count(iterable) -> int:
+    return sum(1 for _ in iterable)
+
+
+def _check_output_files(opt, file_list):
+    if opt.check_limit:
+        file_list = islice(file_list, opt.check_limit)
+    LOGGER.info(
+        'checking %s files...',
+        opt.check_limit or 'all'
     )
+    with open_file_metadata_cache_for_args(opt) as file_metadata_cache:
+        check_files_and_report_result(
+            file_list,
+            example_count=opt.example_count,
+            **get_file_exists_kwargs(opt, file_metadata_cache=file_metadata_cache),
+            **get_sample_kwargs(opt)
+        )
 
-    if opt.check:
-        check_file_list = (
-            target_file_list[:opt.check_limit] if opt.check_limit
-            else target_file_list
+
+def _to_saved_output_file_list(opt, target_file_list):
+    if opt.use_relative_paths:
+        return iter_relative_file_list(opt.output_base_path, target_file_list)
+    return target_file_list
+
+
+def _can_run_incremental(opt, options_fingerprint: str) -> bool:
+    fingerprint_file_path = get_fingerprint_file_path(opt.output_file_list)
+    if not FileSystems.exists(opt.output_file_list) or not FileSystems.exists(
+            fingerprint_file_path):
+        LOGGER.info('no previous output file list or fingerprints found, running full update')
+        return False
+    if read_options_fingerprint(fingerprint_file_path) != options_fingerprint:
+        LOGGER.info('options changed since the previous run, running full update')
+        return False
+    previous_output_count = _count(_iter_previous_output_file_list(opt))
+    previous_fingerprint_count = _count(iter_source_fingerprints(fingerprint_file_path))
+    if previous_output_count != previous_fingerprint_count:
+        LOGGER.warning(
+            'previous output file list (%d) and fingerprints (%d) do not match,'
+            ' running full update',
+            previous_output_count, previous_fingerprint_count
         )
-        LOGGER.info(
-            'checking %d (out of %d) files...',
-            len(check_file_list), len(target_file_list)
+        return False
+    return True
+
+
+def _iter_previous_output_file_list(opt):
+    return iter_file_list(
+        opt.output_file_list,
+        column=opt.output_file_column,
+        to_absolute=False
+    )
+
+
+def _get_added_source_file_list(source_file_list, previous_fingerprint_set: set):
+    current_fingerprint_set = set()
+    added_source_file_list = []
+    added_fingerprints = []
+    for source_url in source_file_list:
+        fingerprint = get_source_fingerprint(source_url)
+        current_fingerprint_set.add(fingerprint)
+        if fingerprint not in previous_fingerprint_set:
+            added_source_file_list.append(source_url)
+            added_fingerprints.append(fingerprint)
+    return current_fingerprint_set, added_source_file_list, added_fingerprints
+
+
+def _iter_kept_previous_rows(opt, current_fingerprint_set: set):
+    fingerprint_file_path = get_fingerprint_file_path(opt.output_file_list)
+    for output_url, fingerprint in zip_longest(
+        _iter_previous_output_file_list(opt),
+        iter_source_fingerprints(fingerprint_file_path)
+    ):
+        if output_url is None or fingerprint is None:
+            # should have been checked by _can_run_incremental
+            raise ValueError(
+                'previous output file list and fingerprints do not match: %s' % (
+                    opt.output_file_list
+                )
+            )
+        if fingerprint in current_fingerprint_set:
+            yield output_url, fingerprint
+
+
+def _save_merged_file_list(
+        opt, options_fingerprint: str, current_fingerprint_set: set,
+        added_target_file_list, added_fingerprints):
+    fingerprint_file_path = get_fingerprint_file_path(opt.output_file_list)
+    # write to temporary files first, as we are reading the previous files while writing
+    temp_output_file_list = opt.output_file_list + TEMP_FILE_SUFFIX
+    temp_fingerprint_file_path = fingerprint_file_path + TEMP_FILE_SUFFIX
+    LOGGER.info('saving merged file list to: %s', opt.output_file_list)
+    save_file_list(
+        temp_output_file_list,
+        chain(
+            (output_url for output_url, _ in _iter_kept_previous_rows(
+                opt, current_fingerprint_set
+            )),
+            _to_saved_output_file_list(opt, added_target_file_list)
+        ),
+        column=opt.output_file_column
+    )
+    save_fingerprints(
+        temp_fingerprint_file_path,
+        options_fingerprint,
+        chain(
+            (fingerprint for _, fingerprint in _iter_kept_previous_rows(
+                opt, current_fingerprint_set
+            )),
+            added_fingerprints
         )
-        check_files_and_report_result(
-            check_file_list,
-            example_count=opt.example_count
+    )
+    FileSystems.rename(
+        [temp_output_file_list, temp_fingerprint_file_path],
+        [opt.output_file_list, fingerprint_file_path]
+    )
+
+
+def run_incremental(opt, source_file_list, source_base_path: str, options_fingerprint: str):
+    """
+    Only processes source files added or removed since the previous run,
+    based on the saved source fingerprints.
+    Rows of the previous output file list are kept (in their order),
+    with the output files of the added source files appended.
+    """
+    previous_fingerprint_set = set(iter_source_fingerprints(
+        get_fingerprint_file_path(opt.output_file_list)
+    ))
+    current_fingerprint_set, added_source_file_list, added_fingerprints = (
+        _get_added_source_file_list(source_file_list, previous_fingerprint_set)
+    )
+    removed_count = len(previous_fingerprint_set - current_fingerprint_set)
+    LOGGER.info(
+        'source files added: %d, removed: %d (previous: %d)',
+        len(added_source_file_list), removed_count, len(previous_fingerprint_set)
+    )
+    added_target_file_list = get_output_file_list(
+        added_source_file_list, source_base_path, opt.output_base_path, opt.output_file_suffix
+    )
+    if opt.check and added_target_file_list:
+        _check_output_files(opt, added_target_file_list)
+    if not added_source_file_list and not removed_count:
+        LOGGER.info('output file list is up to date: %s', opt.output_file_list)
+        return
+    _save_merged_file_list(
+        opt, options_fingerprint, current_fingerprint_set,
+        added_target_file_list, added_fingerprints
+    )
+
+
+def run(opt):
+    # the source file list is streamed (rather than loaded into memory),
+    # which requires a separate pass to determine the base path
+    source_file_list_path = join_if_relative_path(
+        opt.source_base_path,
+        opt.source_file_list
+    )
+
+    def _iter_source_file_list():
+        return iter_file_list(
+            source_file_list_path,
+            column=opt.source_file_column,
+            limit=opt.limit
         )
 
-    if opt.use_relative_paths:
-        target_file_list = to_relative_file_list(opt.output_base_path, target_file_list)
+    source_base_path = get_or_validate_base_path(
+        _iter_source_file_list(), opt.source_base_path
+    )
+
+    options_fingerprint = None
+    if opt.incremental:
+        options_fingerprint = get_options_fingerprint(opt, source_base_path)
+        if _can_run_incremental(opt, options_fingerprint):
+            run_incremental(
+                opt, _iter_source_file_list(), source_base_path, options_fingerprint
+            )
+            return
+
+    def _iter_target_file_list():
+        return iter_output_file_list(
+            _iter_source_file_list(),
+            source_base_path, opt.output_base_path, opt.output_file_suffix
+        )
+
+    if opt.check:
+        _check_output_files(opt, _iter_target_file_list())
 
     LOGGER.info(
-        'saving file list (with %d files) to: %s',
-        len(target_file_list), opt.output_file_list
+        'saving file list to: %s', opt.output_file_list
     )
     save_file_list(
         opt.output_file_list,
-        target_file_list,
+        _to_saved_output_file_list(opt, _iter_target_file_list()),
         column=opt.output_file_column
     )
 
+    if opt.incremental:
+        save_fingerprints(
+            get_fingerprint_file_path(opt.output_file_list),
+            options_fingerprint,
+            map(get_source_fingerprint, _iter_source_file_list())
+        )
+
 
 def process_args(args):
     if not args.output_base_path:
@@ -0,0 +1,78 @@
+import argparse
+import logging
+
+from sciencebeam_utils.beam_utils.csv import (
+    DEFAULT_MAX_ROWS_IN_MEMORY,
+    merge_csv_files_matching_pattern
+)
+
+from sciencebeam_utils.tools.tool_utils import (
+    setup_logging,
+    add_default_args,
+    process_default_args
+)
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        'Merge sharded csv/tsv files into a single file.'
+    )
+    parser.add_argument(
+        '--input-file-pattern', type=str, required=True,
+        help='pattern of the csv/tsv files to merge (e.g. the shards written by WriteDictCsv)'
+    )
+    parser.add_argument(
+        '--output-file', type=str, required=True,
+        help='path to the merged csv/tsv file'
+    )
+    parser.add_argument(
+        '--key-column', type=str, required=False,
+        help='the column to sort or dedupe by'
+    )
+    parser.add_argument(
+        '--sort', action='store_true', default=False,
+        help='sort the rows by the key column'
+    )
+    parser.add_argument(
+        '--dedupe', action='store_true', default=False,
+        help='only keep the first row for every key (implies sort)'
+    )
+    parser.add_argument(
+        '--max-rows-in-memory', type=int, default=DEFAULT_MAX_ROWS_IN_MEMORY,
+        help='maximum number of rows to sort in memory (before using temporary files)'
+    )
+
+    add_default_args(parser)
+
+    return parser.parse_args(argv)
+
+
+def run(opt):
+    if (opt.sort or opt.dedupe) and not opt.key_column:
+        raise ValueError('--key-column required for --sort or --dedupe')
+    row_count = merge_csv_files_matching_pattern(
+        opt.input_file_pattern,
+        opt.output_file,
+        key_column=opt.key_column,
+        sort=opt.sort,
+        dedupe=opt.dedupe,
+        max_rows_in_memory=opt.max_rows_in_memory
+    )
+    LOGGER.info('saved %d rows to: %s', row_count, opt.output_file)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    process_default_args(args)
+
+    run(args)
+
+
+if __name__ == '__main__':
+    setup_logging()
+
+    main()
@@ -1,12 +1,10 @@
 from __future__ import absolute_import
 
+import csv
 import os
 import logging
-from itertools import islice
-
-from backports import csv  # pylint: disable=no-name-in-module
-
-from six import text_type
+from itertools import chain, islice
+from operator import itemgetter
 
 from apache_beam.io.filesystems import FileSystems
 
@@ -14,10 +12,11 @@ from sciencebeam_utils.utils.csv import (
     csv_delimiter_by_filename
 )
 
-from sciencebeam_utils.beam_utils.io import open_file
+from sciencebeam_utils.beam_utils.io import open_buffered_text_file
 
 from .file_path import (
-    relative_path,
+    PathPrefixIndex,
+    get_relative_path_fn,
     join_if_relative_path
 )
 
@@ -29,45 +28,120 @@ def is_csv_or_tsv_file_list(file_list_path):
     return '.csv' in file_list_path or '.tsv' in file_list_path
 
 
-def load_plain_file_list(file_list_path, limit=None):
-    with open_file(file_list_path, 'r') as f:
+def iter_plain_file_list(file_list_path, limit=None):
+    with open_buffered_text_file(file_list_path) as f:
         lines = (x.rstrip() for x in f)
         if limit:
             lines = islice(lines, 0, limit)
-        return list(lines)
+        yield from lines
 
 
-def load_csv_or_tsv_file_list(file_list_path, column, header=True, limit=None):
+def load_plain_file_list(file_list_path, limit=None):
+    return list(iter_plain_file_list(file_list_path, limit=limit))
+
+
+def _get_csv_column_index(header_row, column):
+    if isinstance(column, int):
+        return column
+    try:
+        return header_row.index(column)
+    except ValueError as exc:
+        raise ValueError(
+            'column %s not found, available columns: %s' %
+            (column, header_row)
+        ) from exc
+
+
+def _get_csv_column_indices(reader, columns, header):
+    if not header:
+        assert all(isinstance(column, int) for column in columns)
+        return list(columns)
+    header_row = next(reader, None)
+    if header_row is None:
+        return None
+    return [_get_csv_column_index(header_row, column) for column in columns]
+
+
+def _get_row_values_fn(column_indices):
+    if len(column_indices) == 1:
+        column_index = column_indices[0]
+        return lambda row: (row[column_index],)
+    return itemgetter(*column_indices)
+
+
+def iter_csv_or_tsv_file_list_columns(file_list_path, columns, header=True, limit=None):
+    """
+    Reads the values of multiple columns in a single pass,
+    yielding a tuple of values (in the order of the columns) for every row.
+    """
     delimiter = csv_delimiter_by_filename(file_list_path)
-    with open_file(file_list_path, 'r') as f:
-        reader = csv.reader(f, delimiter=text_type(delimiter))
-        if not header:
-            assert isinstance(column, int)
-            column_index = column
-        else:
-            header_row = next(reader)
-            if isinstance(column, int):
-                column_index = column
-            else:
-                try:
-                    column_index = header_row.index(column)
-                except ValueError as exc:
-                    raise ValueError(
-                        'column %s not found, available columns: %s' %
-                        (column, header_row)
-                    ) from exc
-        lines = (x[column_index] for x in reader)
+    # using the (faster) C csv implementation and decoding the file in blocks
+    with open_buffered_text_file(file_list_path, newline='') as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        column_indices = _get_csv_column_indices(reader, columns, header=header)
+        if column_indices is None:
+            return
+        rows = map(_get_row_values_fn(column_indices), reader)
         if limit:
-            lines = islice(lines, 0, limit)
-        return list(lines)
+            rows = islice(rows, 0, limit)
+        yield from rows
+
+
+def iter_csv_or_tsv_file_list(file_list_path, column, header=True, limit=None):
+    return (
+        values[0]
+        for values in iter_csv_or_tsv_file_list_columns(
+            file_list_path, [column], header=header, limit=limit
+        )
+    )
+
+
+def load_csv_or_tsv_file_list(file_list_path, column, header=True, limit=None):
+    return list(iter_csv_or_tsv_file_list(
+        file_list_path, column=column, header=header, limit=limit
+    ))
+
+
+def iter_absolute_file_list(base_path, file_list):
+    return (join_if_relative_path(base_path, s) for s in file_list)
 
 
 def to_absolute_file_list(base_path, file_list):
-    return [join_if_relative_path(base_path, s) for s in file_list]
+    return list(iter_absolute_file_list(base_path, file_list))
+
+
+def iter_relative_file_list(base_path, file_list):
+    return map(get_relative_path_fn(base_path), file_list)
 
 
 def to_relative_file_list(base_path, file_list):
-    return [relative_path(base_path, s) for s in file_list]
+    return list(iter_relative_file_list(base_path, file_list))
+
+
+def iter_relative_file_list_for_base_paths(base_paths, file_list):
+    """
+    Makes every path relative to the longest matching base path
+    (e.g. as returned by base_paths_for_file_list for mixed-bucket file lists).
+    """
+    return map(PathPrefixIndex(base_paths).relative_path, file_list)
+
+
+def iter_file_list(file_list_path, column, header=True, limit=None, to_absolute=True):
+    """
+    Lazily reads the file list, without materialising it in memory.
+    The file list will remain open until the returned iterable is exhausted.
+    """
+    if is_csv_or_tsv_file_list(file_list_path):
+        file_list = iter_csv_or_tsv_file_list(
+            file_list_path, column=column, header=header, limit=limit
+        )
+    else:
+        file_list = iter_plain_file_list(file_list_path, limit=limit)
+    if to_absolute:
+        file_list = iter_absolute_file_list(
+            os.path.dirname(file_list_path), file_list
+        )
+    return file_list
 
 
 def load_file_list(file_list_path, column, header=True, limit=None, to_absolute=True):
@@ -84,14 +158,56 @@ def load_file_list(file_list_path, column, header=True, limit=None, to_absolute=
     return file_list
 
 
+def iter_file_list_columns(
+        file_list_path, columns, header=True, limit=None, to_absolute=True):
+    """
+    Lazily reads multiple columns of the file list in a single pass,
+    yielding a tuple of values (in the order of the columns) for every row.
+    """
+    if is_csv_or_tsv_file_list(file_list_path):
+        rows = iter_csv_or_tsv_file_list_columns(
+            file_list_path, columns=columns, header=header, limit=limit
+        )
+    else:
+        if len(columns) != 1:
+            raise ValueError(
+                'plain file list only supports a single column, requested: %s' % columns
+            )
+        rows = ((s,) for s in iter_plain_file_list(file_list_path, limit=limit))
+    if to_absolute:
+        base_path = os.path.dirname(file_list_path)
+        rows = (
+            tuple(join_if_relative_path(base_path, s) for s in row)
+            for row in rows
+        )
+    return rows
+
+
+def load_file_list_columns(
+        file_list_path, columns, header=True, limit=None, to_absolute=True):
+    """
+    Returns a list of values for every column (in the order of the columns).
+    """
+    column_file_lists = [[] for _ in columns]
+    for row in iter_file_list_columns(
+            file_list_path, columns=columns, header=header, limit=limit,
+            to_absolute=to_absolute):
+        for column_file_list, value in zip(column_file_lists, row):
+            column_file_list.append(value)
+    return column_file_lists
+
+
 def save_plain_file_list(file_list_path, file_list):
     with FileSystems.create(file_list_path) as f:
-        f.write('\n'.join(file_list).encode('utf-8'))
+        for i, line in enumerate(file_list):
+            if i:
+                f.write(b'\n')
+            f.write(line.encode('utf-8'))
 
 
 def save_csv_or_tsv_file_list(file_list_path, file_list, column, header=True):
     if header:
-        file_list = [column] + file_list
+        file_list = chain([column], file_list)
     save_plain_file_list(file_list_path, file_list)
 
 
@@ -28,6 +28,72 @@ def relative_path(base_path, path):
     return path[len(base_path):] if path.startswith(base_path) else path
 
 
+def get_relative_path_fn(base_path):
+    """
+    Returns a function equivalent to relative_path (with the given base path),
+    but with the base path prefix determined once.
+    """
+    if not base_path:
+        return lambda path: path
+    prefix = base_path if base_path.endswith('/') else base_path + '/'
+    prefix_length = len(prefix)
+    return lambda path: path[prefix_length:] if path.startswith(prefix) else path
+
+
+def split_path_segments(path):
+    """
+    Splits the path into segments, keeping the scheme and bucket (if any) as the first segment
+    (e.g. 'gs://bucket/path/file' -> ['gs://bucket', 'path', 'file']).
+    Joining the segments with '/' will return the original path.
+    """
+    scheme_index = path.find('://')
+    if scheme_index < 0:
+        return path.split('/')
+    segments = path[scheme_index + 3:].split('/')
+    segments[0] = path[:scheme_index + 3] + segments[0]
+    return segments
+
+
+class PathPrefixIndex:
+    """
+    Segment trie of base paths, allowing paths to be made relative to
+    the longest matching base path (e.g. where file lists contain multiple buckets).
+    """
+
+    _BASE_PATH_KEY = '/'  # segments will never contain a slash
+
+    def __init__(self, base_paths=None):
+        self._root = {}
+        for base_path in base_paths or []:
+            self.add(base_path)
+
+    def add(self, base_path):
+        base_path = base_path.rstrip('/')
+        if not base_path:
+            return
+        node = self._root
+        for segment in split_path_segments(base_path):
+            node = node.setdefault(segment, {})
+        node[self._BASE_PATH_KEY] = base_path
+
+    def find_base_path(self, path):
+        node = self._root
+        base_path = None
+        # the base path needs to be a parent directory (not the path itself)
+        for segment in split_path_segments(path)[:-1]:
+            node = node.get(segment)
+            if node is None:
+                break
+            base_path = node.get(self._BASE_PATH_KEY, base_path)
+        return base_path
+
+    def relative_path(self, path):
+        base_path = self.find_base_path(path)
+        if base_path is None:
+            return path
+        return path[len(base_path) + 1:]
+
+
 def is_relative_path(path):
     return not path.startswith('/') and '://' not in path
 
@@ -61,14 +127,92 @@ def get_output_file(filename, source_base_path, output_base_path, output_file_su
     )
 
 
+def _common_prefix_of_iterable(file_list):
+    common_prefix = None
+    for path in file_list:
+        if common_prefix is None:
+            common_prefix = path
+        elif not path.startswith(common_prefix):
+            common_prefix = os.path.commonprefix([common_prefix, path])
+    return common_prefix or ''
+
+
+def _strip_ext_for_output_file(path):
+    # equivalent to change_ext(path, None, '') (without the suffix)
+    root = os.path.splitext(path)[0]
+    if path.endswith('.gz'):
+        root = os.path.splitext(root)[0]
+    return root
+
+
+def get_output_file_fn(source_base_path, output_base_path, output_file_suffix):
+    """
+    Returns a function equivalent to get_output_file (with the same arguments),
+    but with the output file system join and source base path prefix resolved once.
+    Use this (or iter_output_files) when translating many files.
+    """
+    get_relative_source_path = get_relative_path_fn(source_base_path)
+    # Note: FileSystems.join of a relative path is a concatenation with the base path
+    #   (with a separator unless already present), determine that prefix once
+    placeholder = 'x'
+    output_prefix = FileSystems.join(output_base_path, placeholder)[:-len(placeholder)]
+    join = FileSystems.join
+
+    def get_output_file_for_filename(filename):
+        path = _strip_ext_for_output_file(get_relative_source_path(filename)) + output_file_suffix
+        if is_relative_path(path):
+            return output_prefix + path
+        return join(output_base_path, path)
+
+    return get_output_file_for_filename
+
+
+def iter_output_files(file_list, source_base_path, output_base_path, output_file_suffix):
+    return map(
+        get_output_file_fn(source_base_path, output_base_path, output_file_suffix),
+        file_list
+    )
+
+
 def base_path_for_file_list(file_list):
-    common_prefix = os.path.commonprefix(file_list)
+    return _common_prefix_to_base_path(_common_prefix_of_iterable(file_list))
+
+
+def _common_prefix_to_base_path(common_prefix):
     i = max(common_prefix.rfind('/'), common_prefix.rfind('\\'))
     if i >= 0:
         return common_prefix[:i]
     return ''
 
 
+def _get_path_root(path):
+    # the scheme and bucket (if any)
+    scheme_index = path.find('://')
+    if scheme_index < 0:
+        return ''
+    return split_path_segments(path)[0]
+
+
+def base_paths_for_file_list(file_list):
+    """
+    Determines the common base path for every root (scheme and bucket) in a single pass,
+    keeping only one common prefix per root in memory.
+    Returns the base paths in the order the roots first appeared.
+    """
+    common_prefix_by_root = {}
+    for path in file_list:
+        root = _get_path_root(path)
+        common_prefix = common_prefix_by_root.get(root)
+        if common_prefix is None:
+            common_prefix_by_root[root] = path
+        elif not path.startswith(common_prefix):
+            common_prefix_by_root[root] = os.path.commonprefix([common_prefix, path])
+    return [
+        _common_prefix_to_base_path(common_prefix)
+        for common_prefix in common_prefix_by_root.values()
+    ]
+
+
 def get_or_validate_base_path(file_list, base_path):
     common_path = base_path_for_file_list(file_list)
     if base_path:
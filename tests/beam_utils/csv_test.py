@@ -1,12 +1,24 @@
 from __future__ import absolute_import
 
+import gzip
+import logging
 from contextlib import contextmanager
+from io import StringIO
+from operator import itemgetter
+from pathlib import Path
+from time import perf_counter
 from unittest.mock import patch
 
 import pytest
 
+from backports import csv  # pylint: disable=no-name-in-module
+
 import apache_beam as beam
+from apache_beam.io.filesystem import CompressionTypes
+from apache_beam.io.filesystems import FileSystems
+from apache_beam.io import source_test_utils
 from apache_beam.testing.util import assert_that, equal_to
+from apache_beam.transforms.window import GlobalWindow
 
 from sciencebeam_utils.beam_utils.testing import (
     TestPipeline,
@@ -16,14 +28,34 @@ from sciencebeam_utils.beam_utils.testing import (
 )
 
 from sciencebeam_utils.beam_utils.csv import (
+    FormatDictCsvRowsFn,
     WriteDictCsv,
+    WriteDeadLetterCsv,
+    dead_letter_record_to_csv_dict,
+    get_compression_type,
+    get_shard_index_by_chunk_key,
+    CsvFileSource,
+    ReadCsvRecords,
     ReadDictCsv,
+    get_csv_record_fn,
+    iter_externally_sorted_rows,
+    iter_csv_rows_with_columns,
+    merge_csv_files,
+    save_csv_rows,
+    MergeCsvFiles,
+    iter_csv_records_with_global_limit,
+    ReadLineIterator,
     format_csv_rows
 )
 
 
+LOGGER = logging.getLogger(__name__)
+
+
 MODULE_UNDER_TEST = 'sciencebeam_utils.beam_utils.csv'
 
+BENCHMARK_ROW_COUNT = 20000
+
 UNICODE_STR_1 = 'file1\u1234.pdf'
 
 
@@ -40,6 +72,214 @@ def to_csv(rows, delimiter):
     return (format_csv_rows(rows, delimiter).replace('\r\n', '\n') + '\n').encode('utf-8')
 
 
+def _read_all_split_records(source, desired_bundle_size):
+    records = []
+    for split in source.split(desired_bundle_size=desired_bundle_size):
+        records.extend(source_test_utils.read_from_source(
+            split.source, split.start_position, split.stop_position
+        ))
+    return records
+
+
+class TestGetCsvRecordFn:
+    def test_should_return_values_of_single_column(self):
+        assert get_csv_record_fn(['a', 'b'], ['b'])(['a1', 'b1']) == ('b1',)
+
+    def test_should_return_values_of_columns_in_passed_in_order(self):
+        assert get_csv_record_fn(['a', 'b', 'c'], ['c', 'a'])(['a1', 'b1', 'c1']) == (
+            'c1', 'a1'
+        )
+
+    def test_should_convert_values_using_schema(self):
+        to_record = get_csv_record_fn(
+            ['id', 'count', 'score'], ['id', 'count', 'score'],
+            schema={'id': str, 'count': int, 'score': float}
+        )
+        assert to_record(['id1', '12', '0.5']) == ('id1', 12, 0.5)
+
+    def test_should_parse_bool_values(self):
+        to_record = get_csv_record_fn(['flag'], ['flag'], schema={'flag': bool})
+        assert [
+            to_record([value])[0]
+            for value in ['true', 'True', '1', 'false', 'FALSE', '0', '']
+        ] == [True, True, True, False, False, False, None]
+
+    def test_should_raise_error_for_invalid_bool_value(self):
+        to_record = get_csv_record_fn(['flag'], ['flag'], schema={'flag': bool})
+        with pytest.raises(ValueError):
+            to_record(['yes'])
+
+    def test_should_convert_empty_typed_values_to_none(self):
+        to_record = get_csv_record_fn(['id', 'count'], ['id', 'count'], schema={'count': int})
+        assert to_record(['', '']) == ('', None)
+
+    def test_should_pad_short_rows(self):
+        to_record = get_csv_record_fn(['id', 'count'], ['id', 'count'], schema={'count': int})
+        assert to_record(['id1']) == ('id1', None)
+
+    def test_should_select_columns_by_index_without_header(self):
+        assert get_csv_record_fn(None, [1])(['a1', 'b1']) == ('b1',)
+
+    def test_should_raise_error_if_column_not_found(self):
+        with pytest.raises(ValueError):
+            get_csv_record_fn(['a', 'b'], ['other'])
+
+
+class TestCsvFileSource:
+    def _write_rows(self, path: Path, row_count: int) -> list:
+        rows = [['a', 'b']] + [
+            ['a%d' % i, 'value, %d' % i] for i in range(row_count)
+        ]
+        path.write_bytes(to_csv(rows, ','))
+        return [{'a': row[0], 'b': row[1]} for row in rows[1:]]
+
+    def test_should_read_all_rows_without_splitting(self, tmp_path: Path):
+        path = tmp_path / 'data.csv'
+        expected_rows = self._write_rows(path, 10)
+        source = CsvFileSource(str(path), splittable=True)
+        assert source_test_utils.read_from_source(source) == expected_rows
+
+    def test_should_read_each_row_once_across_small_splits(self, tmp_path: Path):
+        path = tmp_path / 'data.csv'
+        expected_rows = self._write_rows(path, 100)
+        source = CsvFileSource(str(path), splittable=True)
+        for desired_bundle_size in [1, 7, 13, 100]:
+            assert _read_all_split_records(
+                source, desired_bundle_size
+            ) == expected_rows
+
+    def test_should_split_into_multiple_sources(self, tmp_path: Path):
+        path = tmp_path / 'data.csv'
+        self._write_rows(path, 100)
+        source = CsvFileSource(str(path), splittable=True)
+        assert len(list(source.split(desired_bundle_size=100))) > 1
+
+    def test_should_read_split_at_fraction(self, tmp_path: Path):
+        path = tmp_path / 'data.csv'
+        self._write_rows(path, 5)
+        source = CsvFileSource(str(path), splittable=True)
+        source_test_utils.assert_split_at_fraction_exhaustive(source)
+
+    def test_should_read_list_output_without_header(self, tmp_path: Path):
+        path = tmp_path / 'data.csv'
+        path.write_bytes(to_csv([['a1', 'b1'], ['a2', 'b2'], ['a3', 'b3']], ','))
+        source = CsvFileSource(
+            str(path), splittable=True, header=False, dictionary_output=False
+        )
+        assert _read_all_split_records(source, 5) == [
+            ['a1', 'b1'], ['a2', 'b2'], ['a3', 'b3']
+        ]
+
+    def test_should_read_compressed_file_as_a_whole(self, tmp_path: Path):
+        path = tmp_path / 'data.csv.gz'
+        rows = [['a', 'b'], ['a1', 'b1'], ['a2', 'b2']]
+        path.write_bytes(gzip.compress(to_csv(rows, ',')))
+        source = CsvFileSource(str(path), splittable=True)
+        assert _read_all_split_records(source, 1) == [
+            {'a': 'a1', 'b': 'b1'}, {'a': 'a2', 'b': 'b2'}
+        ]
+
+    def test_should_read_typed_records_using_schema(self, tmp_path: Path):
+        path = tmp_path / 'data.tsv'
+        path.write_bytes(to_csv([
+            ['id', 'other', 'count'],
+            ['id1', 'x', '1'],
+            ['id2', 'y', '']
+        ], '\t'))
+        for splittable in [False, True]:
+            source = CsvFileSource(
+                str(path), delimiter='\t', splittable=splittable,
+                schema={'count': int, 'id': str}
+            )
+            assert source_test_utils.read_from_source(source) == [
+                (1, 'id1'), (None, 'id2')
+            ]
+
+    def test_should_read_projected_columns_with_schema_subset(self, tmp_path: Path):
+        path = tmp_path / 'data.csv'
+        path.write_bytes(to_csv([['id', 'count'], ['id1', '1']], ','))
+        source = CsvFileSource(str(path), columns=['id', 'count'], schema={'count': int})
+        assert source_test_utils.read_from_source(source) == [('id1', 1)]
+
+    def test_should_not_allow_limit_when_splittable(self, tmp_path: Path):
+        path = tmp_path / 'data.csv'
+        self._write_rows(path, 1)
+        with pytest.raises(ValueError):
+            CsvFileSource(str(path), splittable=True, limit=1)
+
+
+def _read_rows_using_read_line_iterator(file_name, delimiter):
+    # the previous implementation of CsvFileSource.read_records
+    with FileSystems.open(file_name) as f:
+        return list(csv.reader(ReadLineIterator(f), delimiter=delimiter))
+
+
+def _get_elapsed_seconds(fn):
+    start = perf_counter()
+    fn()
+    return perf_counter() - start
+
+
+@pytest.mark.slow
+class TestCsvFileSourceBenchmark:
+    def test_should_be_faster_than_read_line_iterator(self, tmp_path: Path):
+        path = tmp_path / 'data.tsv.gz'
+        with gzip.open(str(path), 'wt', encoding='utf-8') as f:
+            f.write('url\tother\n')
+            for i in range(BENCHMARK_ROW_COUNT):
+                f.write('gs://bucket/path/to/file%d.pdf\tother\u1234 %d\n' % (i, i))
+        source = CsvFileSource(str(path), delimiter='\t', dictionary_output=False)
+        expected_rows = _read_rows_using_read_line_iterator(str(path), '\t')
+        assert source_test_utils.read_from_source(source) == expected_rows[1:]
+        read_line_iterator_seconds = _get_elapsed_seconds(
+            lambda: _read_rows_using_read_line_iterator(str(path), '\t')
+        )
+        block_reader_seconds = _get_elapsed_seconds(
+            lambda: source_test_utils.read_from_source(source)
+        )
+        LOGGER.info(
+            'rows/sec, read line iterator: %.0f, block reader: %.0f',
+            BENCHMARK_ROW_COUNT / read_line_iterator_seconds,
+            BENCHMARK_ROW_COUNT / block_reader_seconds
+        )
+        assert block_reader_seconds < read_line_iterator_seconds
+
+
+class TestIterCsvRecordsWithGlobalLimit:
+    def _write_shards(self, tmp_path: Path, shard_count: int, row_count: int):
+        for shard_index in range(shard_count):
+            (tmp_path / ('data-%d.tsv' % shard_index)).write_bytes(to_csv(
+                [['a']] + [['s%dr%d' % (shard_index, i)] for i in range(row_count)], '\t'
+            ))
+
+    def test_should_limit_rows_across_files(self, tmp_path: Path):
+        self._write_shards(tmp_path, shard_count=3, row_count=2)
+        assert list(iter_csv_records_with_global_limit(
+            str(tmp_path / 'data-*.tsv'), 3, delimiter='\t'
+        )) == [{'a': 's0r0'}, {'a': 's0r1'}, {'a': 's1r0'}]
+
+    def test_should_not_open_remaining_files(self, tmp_path: Path):
+        self._write_shards(tmp_path, shard_count=3, row_count=2)
+        original_open_file = CsvFileSource.open_file
+        opened_file_names = []
+
+        def open_file(source, file_name):
+            opened_file_names.append(file_name)
+            return original_open_file(source, file_name)
+
+        with patch.object(CsvFileSource, 'open_file', open_file):
+            list(iter_csv_records_with_global_limit(
+                str(tmp_path / 'data-*.tsv'), 2, delimiter='\t'
+            ))
+        assert opened_file_names == [str(tmp_path / 'data-0.tsv')]
+
+    def test_should_return_all_rows_if_limit_is_not_reached(self, tmp_path: Path):
+        self._write_shards(tmp_path, shard_count=2, row_count=1)
+        assert list(iter_csv_records_with_global_limit(
+            str(tmp_path / 'data-*.tsv'), 10, delimiter='\t'
+        )) == [{'a': 's0r0'}, {'a': 's1r0'}]
+
+
 class TestFormatCsvRows:
     def test_should_format_empty_rows(self):
         assert format_csv_rows([]) == ''
@@ -63,6 +303,89 @@ class TestFormatCsvRows:
         )
 
 
+class TestGetCompressionType:
+    def test_should_return_none_by_default(self):
+        assert get_compression_type(None) is None
+
+    def test_should_return_gzip_compression_type(self):
+        assert get_compression_type('gzip') == CompressionTypes.GZIP
+
+    def test_should_raise_error_for_unsupported_compression(self):
+        with pytest.raises(ValueError):
+            get_compression_type('other')
+
+
+class TestGetShardIndexByChunkKey:
+    def test_should_return_empty_dict_without_chunks(self):
+        assert get_shard_index_by_chunk_key({}, 100) == {}
+
+    def test_should_pack_chunks_up_to_max_bytes(self):
+        assert get_shard_index_by_chunk_key(
+            {'a': 60, 'b': 40, 'c': 30, 'd': 70, 'e': 10}, 100
+        ) == {'a': 0, 'b': 0, 'c': 1, 'd': 1, 'e': 2}
+
+    def test_should_assign_chunk_exceeding_max_bytes_to_own_shard(self):
+        assert get_shard_index_by_chunk_key(
+            {'a': 10, 'b': 500, 'c': 10}, 100
+        ) == {'a': 0, 'b': 1, 'c': 2}
+
+
+def _read_shard_lines(paths, compressed=False):
+    lines_by_path = {}
+    for path in paths:
+        content = path.read_bytes()
+        if compressed:
+            content = gzip.decompress(content)
+        lines_by_path[path.name] = content.decode('utf-8').splitlines()
+    return lines_by_path
+
+
+@pytest.mark.slow
+class TestFormatDictCsvRowsFn(BeamTest):
+    def test_should_format_rows_in_batches(self):
+        with TestPipeline() as p:
+            result = (
+                p |
+                beam.Create([
+                    {'a': 'a1', 'b': 'b1'},
+                    {'a': 'a2', 'b': 'b2'},
+                    {'a': 'a3', 'b': 'b3'}
+                ]) |
+                beam.ParDo(FormatDictCsvRowsFn(['a', 'b'], batch_size=2))
+            )
+            assert_that(
+                result | beam.FlatMap(lambda chunk: chunk.decode('utf-8').split('\n')),
+                equal_to(['a1,b1', 'a2,b2', 'a3,b3'])
+            )
+
+    def test_should_format_rows_like_format_csv_rows(self):
+        rows = [
+            {'a': 'with, delimiter', 'b': 'with "quote"'},
+            {'a': UNICODE_STR_1, 'b': UNICODE_STR_1.encode('utf-8')},
+            {'a': 123}
+        ]
+        fn = FormatDictCsvRowsFn(['a', 'b'])
+        fn.start_bundle()
+        for row in rows:
+            assert not list(fn.process(row, window=GlobalWindow()))
+        chunks = list(fn.finish_bundle())
+        assert [chunk.value for chunk in chunks] == [format_csv_rows([
+            [row.get('a'), row.get('b')] for row in rows
+        ]).replace('\r\n', '\n').encode('utf-8')]
+
+    def test_should_quote_carriage_return_and_read_back_rows(self):
+        rows = [{'a': 'with\rcarriage return', 'b': 'b1'}, {'a': 'a2', 'b': 'with\r\nnewline'}]
+        fn = FormatDictCsvRowsFn(['a', 'b'], delimiter='\t')
+        fn.start_bundle()
+        for row in rows:
+            assert not list(fn.process(row, window=GlobalWindow()))
+        chunks = list(fn.finish_bundle())
+        text = b'\n'.join(chunk.value for chunk in chunks).decode('utf-8')
+        assert list(csv.reader(StringIO(text, newline=''), delimiter='\t')) == [
+            [row['a'], row['b']] for row in rows
+        ]
+
+
 @pytest.mark.slow
 class TestWriteDictCsv(BeamTest):
     def test_should_write_tsv_with_header(self, test_context):
@@ -85,6 +408,162 @@ class TestWriteDictCsv(BeamTest):
                 ['a1', 'b1']
             ], '\t')
 
+    def test_should_write_multiple_batches(self, test_context):
+        rows = [['a%d' % i, 'b%d' % i] for i in range(5)]
+        with patch_module_under_test(WriteToText=MockWriteToText):
+            with TestPipeline() as p:
+                _ = (  # noqa: F841
+                    p |
+                    beam.Create([{'a': a, 'b': b} for a, b in rows]) |
+                    WriteDictCsv(
+                        '.temp/dummy',
+                        ['a', 'b'],
+                        '.tsv',
+                        batch_size=2
+                    )
+                )
+            content = test_context.get_file_content('.temp/dummy.tsv')
+            assert content.splitlines()[0] == b'a\tb'
+            assert sorted(content.splitlines()[1:]) == sorted(
+                to_csv(rows, '\t').splitlines()
+            )
+
+    def test_should_write_explicit_number_of_shards(self, tmp_path: Path):
+        rows = [{'a': 'a%d' % i} for i in range(10)]
+        with TestPipeline() as p:
+            _ = (  # noqa: F841
+                p |
+                beam.Create(rows) |
+                WriteDictCsv(str(tmp_path / 'out'), ['a'], '.tsv', num_shards=2, batch_size=1)
+            )
+        lines_by_path = _read_shard_lines(tmp_path.glob('out-*.tsv'))
+        assert sorted(lines_by_path) == ['out-00000-of-00002.tsv', 'out-00001-of-00002.tsv']
+        assert all(lines[0] == 'a' for lines in lines_by_path.values())
+        assert sorted(
+            line for lines in lines_by_path.values() for line in lines[1:]
+        ) == sorted(row['a'] for row in rows)
+
+    def test_should_write_gzip_compressed_file(self, tmp_path: Path):
+        with TestPipeline() as p:
+            _ = (  # noqa: F841
+                p |
+                beam.Create([{'a': 'a1'}]) |
+                WriteDictCsv(str(tmp_path / 'out'), ['a'], '.tsv', compression='gzip')
+            )
+        lines_by_path = _read_shard_lines(tmp_path.glob('out*'), compressed=True)
+        assert list(lines_by_path.values()) == [['a', 'a1']]
+        assert list(lines_by_path)[0].endswith('.tsv.gz')
+
+    def test_should_write_shards_with_max_bytes(self, tmp_path: Path):
+        rows = [{'a': 'value%03d' % i} for i in range(100)]
+        with TestPipeline() as p:
+            _ = (  # noqa: F841
+                p |
+                beam.Create(rows) |
+                WriteDictCsv(
+                    str(tmp_path / 'out'), ['a'], '.tsv',
+                    max_bytes_per_shard=250, batch_size=5
+                )
+            )
+        lines_by_path = _read_shard_lines(tmp_path.glob('out-*.tsv'))
+        # 100 rows of 9 bytes (+ line feed), i.e. 20 chunks of 50 bytes, 1000 bytes in total
+        assert sorted(lines_by_path) == [
+            'out-%05d-of-00004.tsv' % i for i in range(4)
+        ]
+        assert all(len(lines) == 1 + 25 for lines in lines_by_path.values())
+        assert all(lines[0] == 'a' for lines in lines_by_path.values())
+        assert sorted(
+            line for lines in lines_by_path.values() for line in lines[1:]
+        ) == sorted(row['a'] for row in rows)
+
+    def test_should_write_header_only_shard_with_max_bytes_for_empty_input(
+            self, tmp_path: Path):
+        with TestPipeline() as p:
+            _ = (  # noqa: F841
+                p |
+                beam.Create([]) |
+                WriteDictCsv(
+                    str(tmp_path / 'out'), ['a', 'b'], '.tsv', max_bytes_per_shard=250
+                )
+            )
+        assert _read_shard_lines(tmp_path.glob('out-*.tsv')) == {
+            'out-00000-of-00001.tsv': ['a\tb']
+        }
+
+    def test_should_replace_stale_shards_with_max_bytes(self, tmp_path: Path):
+        stale_shard_path = tmp_path / 'out-00001-of-00002.tsv'
+        stale_shard_path.write_text('stale')
+        stale_temp_path = tmp_path / 'out-00000-of-00001.tsv.temp-123'
+        stale_temp_path.write_text('stale')
+        other_path = tmp_path / 'other-00000-of-00001.tsv'
+        other_path.write_text('other')
+        with TestPipeline() as p:
+            _ = (  # noqa: F841
+                p |
+                beam.Create([{'a': 'a1'}]) |
+                WriteDictCsv(
+                    str(tmp_path / 'out'), ['a'], '.tsv', max_bytes_per_shard=250
+                )
+            )
+        assert sorted(path.name for path in tmp_path.iterdir()) == [
+            'other-00000-of-00001.tsv', 'out-00000-of-00001.tsv'
+        ]
+        assert _read_shard_lines(tmp_path.glob('out-*.tsv')) == {
+            'out-00000-of-00001.tsv': ['a', 'a1']
+        }
+
+    def test_should_not_allow_num_shards_and_max_bytes(self):
+        with pytest.raises(ValueError):
+            WriteDictCsv('out', ['a'], '.tsv', num_shards=1, max_bytes_per_shard=1)
+
+
+class TestDeadLetterRecordToCsvDict:
+    def test_should_use_recorded_exception_type(self):
+        csv_dict = dead_letter_record_to_csv_dict({
+            'element': 'url1',
+            'exception_type': 'OriginalError',
+            'exception': RuntimeError('oh dear')
+        })
+        assert csv_dict['exception_type'] == 'OriginalError'
+
+    def test_should_fall_back_to_type_of_exception(self):
+        csv_dict = dead_letter_record_to_csv_dict({
+            'element': 'url1',
+            'exception': RuntimeError('oh dear')
+        })
+        assert csv_dict['exception_type'] == 'RuntimeError'
+
+
+@pytest.mark.slow
+class TestWriteDeadLetterCsv(BeamTest):
+    def test_should_write_dead_letter_records(self, tmp_path: Path):
+        with TestPipeline() as p:
+            _ = (  # noqa: F841
+                p |
+                beam.Create([{
+                    'element': {'url': 'url1'},
+                    'exception': RuntimeError('oh dear'),
+                    'traceback': 'line1\nline2',
+                    'start_timestamp': 1.5,
+                    'duration_seconds': 0.25
+                }]) |
+                WriteDeadLetterCsv(
+                    str(tmp_path / 'failed'),
+                    element_to_text_fn=lambda x: x['url'],
+                    num_shards=1
+                )
+            )
+        with open(str(tmp_path / 'failed-00000-of-00001.tsv'), 'r', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f, delimiter='\t'))
+        assert rows == [{
+            'element': 'url1',
+            'exception_type': 'RuntimeError',
+            'exception': 'oh dear',
+            'traceback': 'line1\nline2',
+            'start_timestamp': '1.5',
+            'duration_seconds': '0.25'
+        }]
+
 
 @pytest.mark.slow
 class TestReadDictCsv(BeamTest):
@@ -151,3 +630,164 @@ class TestReadDictCsv(BeamTest):
                     'a': 'a2',
                     'b': 'b2'
                 }]))
+
+    def test_should_apply_limit_across_files_with_global_limit(self, tmp_path: Path):
+        for shard_index in range(3):
+            (tmp_path / ('data-%d.tsv' % shard_index)).write_bytes(to_csv([
+                ['a', 'b'],
+                ['a%d1' % shard_index, 'b1'],
+                ['a%d2' % shard_index, 'b2']
+            ], '\t'))
+
+        with TestPipeline() as p:
+            result = (
+                p |
+                ReadDictCsv(str(tmp_path / 'data-*.tsv'), limit=3, global_limit=True)
+            )
+            assert_that(result, equal_to([
+                {'a': 'a01', 'b': 'b1'},
+                {'a': 'a02', 'b': 'b2'},
+                {'a': 'a11', 'b': 'b1'}
+            ]))
+
+    def test_should_read_rows_using_splittable_source(self, test_context):
+        with patch_beam_io():
+            test_context.set_file_content('.temp/dummy.tsv', to_csv([
+                ['a', 'b'],
+                ['a1', 'b1'],
+                ['a2', 'b2']
+            ], '\t'))
+
+            with TestPipeline() as p:
+                result = (
+                    p |
+                    ReadDictCsv('.temp/dummy.tsv', splittable=True)
+                )
+                assert_that(result, equal_to([{
+                    'a': 'a1',
+                    'b': 'b1'
+                }, {
+                    'a': 'a2',
+                    'b': 'b2'
+                }]))
+
+
+@pytest.mark.slow
+class TestReadCsvRecords(BeamTest):
+    def test_should_read_typed_records(self, test_context):
+        with patch_beam_io():
+            test_context.set_file_content('.temp/dummy.tsv', to_csv([
+                ['a', 'b'],
+                ['a1', '1'],
+                ['a2', '2']
+            ], '\t'))
+
+            with TestPipeline() as p:
+                result = (
+                    p |
+                    ReadCsvRecords('.temp/dummy.tsv', schema={'a': str, 'b': int})
+                )
+                assert_that(result, equal_to([('a1', 1), ('a2', 2)]))
+
+
+class TestSaveCsvRows:
+    def test_should_quote_carriage_return_and_read_back_rows(self, tmp_path: Path):
+        file_name = str(tmp_path / 'data.tsv')
+        rows = [['with\rcarriage return', 'b1'], ['a2', 'b2']]
+        assert save_csv_rows(file_name, ['a', 'b'], iter(rows), batch_size=1) == 2
+        assert list(iter_csv_rows_with_columns([file_name], ['a', 'b'])) == rows
+
+
+class TestIterExternallySortedRows:
+    def test_should_sort_rows_in_memory(self):
+        assert list(iter_externally_sorted_rows(
+            [['b'], ['a'], ['c']], key=itemgetter(0), max_rows_in_memory=10
+        )) == [['a'], ['b'], ['c']]
+
+    def test_should_sort_rows_using_multiple_runs(self):
+        rows = [[str(i % 7), str(i)] for i in range(20)]
+        assert list(iter_externally_sorted_rows(
+            rows, key=itemgetter(0), max_rows_in_memory=3
+        )) == sorted(rows, key=itemgetter(0))
+
+    def test_should_sort_rows_filling_exactly_one_run(self):
+        assert list(iter_externally_sorted_rows(
+            [['b'], ['a']], key=itemgetter(0), max_rows_in_memory=2
+        )) == [['a'], ['b']]
+
+    def test_should_return_no_rows_for_empty_input(self):
+        assert list(iter_externally_sorted_rows(
+            [], key=itemgetter(0), max_rows_in_memory=2
+        )) == []
+
+
+class TestIterCsvRowsWithColumns:
+    def test_should_reorder_columns_of_files_with_different_header(self, tmp_path: Path):
+        (tmp_path / 'file1.csv').write_bytes(to_csv([['a', 'b'], ['a1', 'b1']], ','))
+        (tmp_path / 'file2.csv').write_bytes(to_csv([['b', 'c'], ['b2', 'c2']], ','))
+        assert list(iter_csv_rows_with_columns(
+            [str(tmp_path / 'file1.csv'), str(tmp_path / 'file2.csv')], ['a', 'b']
+        )) == [['a1', 'b1'], ['', 'b2']]
+
+
+class TestMergeCsvFiles:
+    def _write_shards(self, tmp_path: Path):
+        (tmp_path / 'out-00000-of-00002.tsv').write_bytes(to_csv([
+            ['id', 'value'], ['b', 'with, comma'], ['a', '1']
+        ], '\t'))
+        (tmp_path / 'out-00001-of-00002.tsv').write_bytes(to_csv([
+            ['id', 'value'], ['a', '2'], ['c', '3']
+        ], '\t'))
+        return [
+            str(tmp_path / 'out-00000-of-00002.tsv'), str(tmp_path / 'out-00001-of-00002.tsv')
+        ]
+
+    def test_should_merge_files_with_header_written_once(self, tmp_path: Path):
+        output_file = tmp_path / 'merged.tsv'
+        assert merge_csv_files(self._write_shards(tmp_path), str(output_file)) == 4
+        assert output_file.read_bytes() == to_csv([
+            ['id', 'value'], ['b', 'with, comma'], ['a', '1'], ['a', '2'], ['c', '3']
+        ], '\t')
+
+    def test_should_sort_by_key_column(self, tmp_path: Path):
+        output_file = tmp_path / 'merged.tsv'
+        merge_csv_files(
+            self._write_shards(tmp_path), str(output_file), key_column='id', sort=True,
+            max_rows_in_memory=1
+        )
+        assert output_file.read_bytes() == to_csv([
+            ['id', 'value'], ['a', '1'], ['a', '2'], ['b', 'with, comma'], ['c', '3']
+        ], '\t')
+
+    def test_should_dedupe_by_key_column_keeping_first_row(self, tmp_path: Path):
+        output_file = tmp_path / 'merged.tsv'
+        assert merge_csv_files(
+            self._write_shards(tmp_path), str(output_file), key_column='id', dedupe=True,
+            max_rows_in_memory=1
+        ) == 3
+        assert output_file.read_bytes() == to_csv([
+            ['id', 'value'], ['a', '1'], ['b', 'with, comma'], ['c', '3']
+        ], '\t')
+
+    def test_should_write_gzip_compressed_output(self, tmp_path: Path):
+        output_file = tmp_path / 'merged.tsv.gz'
+        merge_csv_files(self._write_shards(tmp_path), str(output_file))
+        assert gzip.decompress(output_file.read_bytes()).splitlines()[0] == b'id\tvalue'
+
+    def test_should_require_key_column_to_dedupe(self, tmp_path: Path):
+        with pytest.raises(ValueError):
+            merge_csv_files(self._write_shards(tmp_path), str(tmp_path / 'out.tsv'), dedupe=True)
+
+
+@pytest.mark.slow
+class TestMergeCsvFilesTransform:
+    def test_should_merge_files_matching_pattern(self, tmp_path: Path):
+        (tmp_path / 'out-00000-of-00002.tsv').write_bytes(to_csv([['id'], ['b']], '\t'))
+        (tmp_path / 'out-00001-of-00002.tsv').write_bytes(to_csv([['id'], ['a']], '\t'))
+        output_file = tmp_path / 'out-merged.tsv'
+        with TestPipeline() as p:
+            result = p | MergeCsvFiles(
+                str(tmp_path / 'out-*.tsv'), str(output_file), key_column='id', sort=True
+            )
+            assert_that(result, equal_to([2]))
+        assert output_file.read_bytes() == to_csv([['id'], ['a'], ['b']], '\t')
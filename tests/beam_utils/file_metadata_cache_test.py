@@ -0,0 +1,101 @@
+from pathlib import Path
+from time import sleep
+from unittest.mock import Mock, patch
+
+from sciencebeam_utils.beam_utils import file_metadata_cache as file_metadata_cache_module
+from sciencebeam_utils.beam_utils.file_metadata_cache import (
+    MISSING_FILE_METADATA,
+    FileMetadata,
+    FileMetadataCache,
+    get_file_metadata
+)
+
+
+FILE_METADATA_1 = FileMetadata(exists=True, size_in_bytes=123, last_updated_in_seconds=1.0)
+
+
+class TestGetFileMetadata:
+    def test_should_return_metadata_of_existing_file(self, tmp_path: Path):
+        file_path = tmp_path / 'file1'
+        file_path.write_text('abc')
+        file_metadata = get_file_metadata(str(file_path))
+        assert file_metadata.exists
+        assert file_metadata.size_in_bytes == 3
+
+    def test_should_return_not_exists_for_missing_file(self, tmp_path: Path):
+        assert not get_file_metadata(str(tmp_path / 'file1')).exists
+
+    def test_should_not_return_metadata_of_other_matching_file(self):
+        other_beam_file_metadata = Mock(path='/path/file1.other', size_in_bytes=123)
+        with patch.object(file_metadata_cache_module, 'FileSystems') as FileSystems:
+            FileSystems.match.return_value = [
+                Mock(metadata_list=[other_beam_file_metadata])
+            ]
+            assert not get_file_metadata('/path/file1').exists
+
+    def test_should_not_match_path_containing_glob_characters(self, tmp_path: Path):
+        (tmp_path / 'file1').touch()
+        assert not get_file_metadata(str(tmp_path / 'file[1]')).exists
+
+
+class TestFileMetadataCache:
+    def test_should_return_none_if_not_cached(self, tmp_path: Path):
+        with FileMetadataCache(str(tmp_path / 'cache.sqlite')) as cache:
+            assert cache.get('/path/file1') is None
+
+    def test_should_return_cached_file_metadata(self, tmp_path: Path):
+        with FileMetadataCache(str(tmp_path / 'cache.sqlite')) as cache:
+            cache.put('/path/file1', FILE_METADATA_1)
+            assert cache.get('/path/file1') == FILE_METADATA_1
+
+    def test_should_persist_file_metadata(self, tmp_path: Path):
+        cache_path = str(tmp_path / 'cache.sqlite')
+        with FileMetadataCache(cache_path) as cache:
+            cache.put('/path/file1', FILE_METADATA_1)
+        with FileMetadataCache(cache_path) as cache:
+            assert cache.get('/path/file1') == FILE_METADATA_1
+
+    def test_should_ignore_expired_file_metadata(self, tmp_path: Path):
+        with FileMetadataCache(str(tmp_path / 'cache.sqlite'), ttl_seconds=-1) as cache:
+            cache.put('/path/file1', FILE_METADATA_1)
+            assert cache.get('/path/file1') is None
+
+    def test_should_not_cache_missing_file_by_default(self, tmp_path: Path):
+        with FileMetadataCache(str(tmp_path / 'cache.sqlite')) as cache:
+            cache.put('/path/file1', FILE_METADATA_1)
+            cache.put('/path/file1', MISSING_FILE_METADATA)
+            assert cache.get('/path/file1') is None
+
+    def test_should_cache_missing_file_with_missing_ttl(self, tmp_path: Path):
+        with FileMetadataCache(
+                str(tmp_path / 'cache.sqlite'), missing_ttl_seconds=60) as cache:
+            cache.put('/path/file1', MISSING_FILE_METADATA)
+            assert cache.get('/path/file1') == MISSING_FILE_METADATA
+
+    def test_should_ignore_expired_missing_file(self, tmp_path: Path):
+        with FileMetadataCache(
+                str(tmp_path / 'cache.sqlite'), missing_ttl_seconds=1e-9) as cache:
+            cache.put('/path/file1', FILE_METADATA_1)
+            cache.put('/path/file2', MISSING_FILE_METADATA)
+            sleep(0.001)
+            assert cache.get('/path/file1') == FILE_METADATA_1
+            assert cache.get('/path/file2') is None
+
+    def test_should_ignore_cached_file_metadata_when_refreshing(self, tmp_path: Path):
+        with FileMetadataCache(str(tmp_path / 'cache.sqlite'), refresh=True) as cache:
+            cache.put('/path/file1', FILE_METADATA_1)
+            assert cache.get('/path/file1') is None
+
+    def test_should_invalidate_file_metadata(self, tmp_path: Path):
+        with FileMetadataCache(str(tmp_path / 'cache.sqlite')) as cache:
+            cache.put('/path/file1', FILE_METADATA_1)
+            cache.invalidate('/path/file1')
+            assert cache.get('/path/file1') is None
+
+    def test_should_only_retrieve_file_metadata_once(self, tmp_path: Path):
+        with FileMetadataCache(str(tmp_path / 'cache.sqlite')) as cache:
+            with patch.object(file_metadata_cache_module, 'get_file_metadata') as mock:
+                mock.return_value = FILE_METADATA_1
+                assert cache.exists('/path/file1')
+                assert cache.exists('/path/file1')
+                mock.assert_called_once_with('/path/file1')
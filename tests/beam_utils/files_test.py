@@ -1,3 +1,4 @@
+from pathlib import Path
 from unittest.mock import patch
 
 import apache_beam as beam
@@ -13,7 +14,8 @@ from sciencebeam_utils.beam_utils.files import (
     ReadFileList,
     DeferredReadFileList,
     FindFiles,
-    DeferredFindFiles
+    DeferredFindFiles,
+    ReadFileContents
 )
 
 
@@ -26,13 +28,13 @@ LIMIT = 10
 
 
 class TestReadFileList(BeamTest):
-    def test_should_use_load_file_list(self):
-        with patch.object(files_module, 'load_file_list') as load_file_list:
-            load_file_list.return_value = [FILE_1, FILE_2]
+    def test_should_use_iter_file_list(self):
+        with patch.object(files_module, 'iter_file_list') as iter_file_list:
+            iter_file_list.return_value = iter([FILE_1, FILE_2])
             with TestPipeline() as p:
                 result = p | ReadFileList(FILE_LIST_PATH, column=COLUMN, limit=LIMIT)
                 assert_that(result, equal_to([FILE_1, FILE_2]))
-            load_file_list.assert_called_with(FILE_LIST_PATH, column=COLUMN, limit=LIMIT)
+            iter_file_list.assert_called_with(FILE_LIST_PATH, column=COLUMN, limit=LIMIT)
 
 
 class TestDeferredReadFileList(BeamTest):
@@ -77,3 +79,21 @@ class TestDeferredFindFiles(BeamTest):
             with TestPipeline() as p:
                 result = p | DeferredFindFiles(FILE_LIST_PATH, limit=1)
                 assert_that(result, equal_to([FILE_1]))
+
+
+class TestReadFileContents(BeamTest):
+    def test_should_read_file_contents_in_batches(self, tmp_path: Path):
+        paths = []
+        for i in range(5):
+            path = tmp_path / ('file%d.bin' % i)
+            path.write_bytes(b'data%d' % i)
+            paths.append(str(path))
+        with TestPipeline() as p:
+            result = (
+                p |
+                beam.Create(paths) |
+                beam.ParDo(ReadFileContents(batch_size=2, max_concurrency=2))
+            )
+            assert_that(result, equal_to([
+                (path, b'data%d' % i) for i, path in enumerate(paths)
+            ]))
@@ -0,0 +1,291 @@
+import gzip
+import os
+import threading
+import time
+import tracemalloc
+from io import BytesIO
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from sciencebeam_utils.beam_utils.file_metadata_cache import (
+    FileMetadata,
+    FileMetadataCache
+)
+
+import sciencebeam_utils.beam_utils.io as io_module
+from sciencebeam_utils.beam_utils.io import (
+    ExistingDirectoryCache,
+    get_size_hint,
+    read_all_from_paths,
+    read_all_from_path,
+    read_all_from_path_as_memoryview,
+    iter_decoded_lines,
+    mkdirs_if_not_exists,
+    save_file_content
+)
+
+
+class TestMkdirsIfNotExists:
+    def test_should_create_directory(self, tmp_path: Path):
+        path = tmp_path / 'dir1'
+        mkdirs_if_not_exists(str(path))
+        assert path.is_dir()
+
+    def test_should_only_check_directory_once(self, tmp_path: Path):
+        path = str(tmp_path / 'dir1')
+        existing_directory_cache = ExistingDirectoryCache()
+        with patch.object(
+                io_module.FileSystems, 'exists', wraps=io_module.FileSystems.exists) as exists:
+            mkdirs_if_not_exists(path, existing_directory_cache=existing_directory_cache)
+            mkdirs_if_not_exists(path, existing_directory_cache=existing_directory_cache)
+            assert exists.call_count == 1
+        assert existing_directory_cache.contains(path)
+
+    def test_should_always_check_directory_without_cache(self, tmp_path: Path):
+        path = str(tmp_path / 'dir1')
+        with patch.object(
+                io_module.FileSystems, 'exists', wraps=io_module.FileSystems.exists) as exists:
+            mkdirs_if_not_exists(path, existing_directory_cache=None)
+            mkdirs_if_not_exists(path, existing_directory_cache=None)
+            assert exists.call_count == 2
+
+    def test_should_skip_object_store_directories(self):
+        with patch.object(io_module.FileSystems, 'exists') as exists:
+            mkdirs_if_not_exists(
+                'gs://bucket/dir1', existing_directory_cache=None,
+                skip_object_store_directories=True
+            )
+            exists.assert_not_called()
+
+
+class TestExistingDirectoryCache:
+    def test_should_not_contain_unknown_directory(self):
+        assert not ExistingDirectoryCache().contains('/dir1')
+
+    def test_should_contain_added_directory(self):
+        existing_directory_cache = ExistingDirectoryCache()
+        existing_directory_cache.add('/dir1')
+        assert existing_directory_cache.contains('/dir1')
+
+    def test_should_remove_least_recently_used_directory(self):
+        existing_directory_cache = ExistingDirectoryCache(max_size=2)
+        existing_directory_cache.add('/dir1')
+        existing_directory_cache.add('/dir2')
+        assert existing_directory_cache.contains('/dir1')
+        existing_directory_cache.add('/dir3')
+        assert len(existing_directory_cache) == 2
+        assert existing_directory_cache.contains('/dir1')
+        assert not existing_directory_cache.contains('/dir2')
+        assert existing_directory_cache.contains('/dir3')
+
+
+class TestSaveFileContent:
+    def test_should_save_file_content_and_invalidate_cache(self, tmp_path: Path):
+        path = tmp_path / 'dir1' / 'file1'
+        with FileMetadataCache(
+                str(tmp_path / 'cache.sqlite'), missing_ttl_seconds=60) as file_metadata_cache:
+            file_metadata_cache.put(str(path), FileMetadata(exists=False))
+            save_file_content(str(path), b'abc', file_metadata_cache=file_metadata_cache)
+            assert file_metadata_cache.get(str(path)) is None
+            assert file_metadata_cache.get(str(path.parent)) is None
+        assert path.read_bytes() == b'abc'
+
+    def test_should_save_file_content_to_existing_directory(self, tmp_path: Path):
+        existing_directory_cache = ExistingDirectoryCache()
+        for name in ['file1', 'file2']:
+            save_file_content(
+                str(tmp_path / 'dir1' / name), b'abc',
+                existing_directory_cache=existing_directory_cache
+            )
+        assert len(existing_directory_cache) == 1
+        assert (tmp_path / 'dir1' / 'file2').read_bytes() == b'abc'
+
+
+class TestIterDecodedLines:
+    def test_should_return_no_lines_for_empty_file(self):
+        assert list(iter_decoded_lines(BytesIO(b''))) == []
+
+    def test_should_retain_line_feed(self):
+        assert list(iter_decoded_lines(BytesIO(b'line1\nline2\n'))) == [
+            'line1\n', 'line2\n'
+        ]
+
+    def test_should_return_last_line_without_line_feed(self):
+        assert list(iter_decoded_lines(BytesIO(b'line1\nline2'))) == ['line1\n', 'line2']
+
+    def test_should_only_split_on_line_feed(self):
+        assert list(iter_decoded_lines(BytesIO(b'line1\r\nline\r2\n'))) == [
+            'line1\r\n', 'line\r2\n'
+        ]
+
+    def test_should_join_lines_across_blocks(self):
+        assert list(iter_decoded_lines(BytesIO(b'line1\nline2\nline3'), block_size=3)) == [
+            'line1\n', 'line2\n', 'line3'
+        ]
+
+    def test_should_decode_characters_split_across_blocks(self):
+        text = 'a\u1234b\n\u1234\n'
+        for block_size in range(1, 5):
+            assert list(iter_decoded_lines(
+                BytesIO(text.encode('utf-8')), block_size=block_size
+            )) == ['a\u1234b\n', '\u1234\n']
+
+
+class TestGetSizeHint:
+    def test_should_return_file_size(self, tmp_path: Path):
+        path = tmp_path / 'file.bin'
+        path.write_bytes(b'12345')
+        assert get_size_hint(str(path)) == 5
+
+    def test_should_return_none_for_missing_file(self, tmp_path: Path):
+        assert get_size_hint(str(tmp_path / 'missing.bin')) is None
+
+
+class TestReadAllFromPathAsMemoryview:
+    def test_should_memory_map_local_uncompressed_file(self, tmp_path: Path):
+        path = tmp_path / 'file.bin'
+        path.write_bytes(b'data')
+        result = read_all_from_path_as_memoryview(str(path))
+        assert bytes(result) == b'data'
+        assert result.readonly
+
+    def test_should_read_empty_file(self, tmp_path: Path):
+        path = tmp_path / 'file.bin'
+        path.write_bytes(b'')
+        assert bytes(read_all_from_path_as_memoryview(str(path))) == b''
+        assert bytes(read_all_from_path_as_memoryview(str(path), use_mmap=False)) == b''
+
+    def test_should_read_into_buffer_without_mmap(self, tmp_path: Path):
+        path = tmp_path / 'file.bin'
+        path.write_bytes(b'0123456789')
+        result = read_all_from_path_as_memoryview(str(path), buffer_size=3, use_mmap=False)
+        assert isinstance(result, memoryview)
+        assert bytes(result) == b'0123456789'
+
+    def test_should_grow_buffer_if_size_hint_is_too_small(self, tmp_path: Path):
+        path = tmp_path / 'file.bin'
+        path.write_bytes(b'0123456789')
+        assert bytes(read_all_from_path_as_memoryview(
+            str(path), buffer_size=3, size_hint=2, use_mmap=False
+        )) == b'0123456789'
+
+    def test_should_read_decompressed_content_of_compressed_file(self, tmp_path: Path):
+        path = tmp_path / 'file.bin.gz'
+        data = b'0123456789' * 1000
+        path.write_bytes(gzip.compress(data))
+        assert bytes(read_all_from_path_as_memoryview(str(path), buffer_size=100)) == data
+
+
+class _ConcurrencyTracker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.current = 0
+        self.max = 0
+        self.read_paths = []
+
+    def read_all_from_path(self, path, **_):
+        with self._lock:
+            self.read_paths.append(path)
+            self.current += 1
+            self.max = max(self.max, self.current)
+        time.sleep(0.01)
+        with self._lock:
+            self.current -= 1
+        return path.encode('utf-8')
+
+
+class TestReadAllFromPaths:
+    def test_should_read_all_files(self, tmp_path: Path):
+        paths = []
+        for i in range(10):
+            path = tmp_path / ('file%d.bin' % i)
+            path.write_bytes(b'data%d' % i)
+            paths.append(str(path))
+        assert sorted(read_all_from_paths(paths, max_concurrency=3)) == [
+            (path, b'data%d' % i) for i, path in enumerate(paths)
+        ]
+
+    def test_should_read_files_concurrently(self):
+        tracker = _ConcurrencyTracker()
+        paths = ['file%d' % i for i in range(20)]
+        with patch.object(io_module, 'read_all_from_path', tracker.read_all_from_path):
+            result = list(read_all_from_paths(paths, max_concurrency=4))
+        assert sorted(result) == sorted((path, path.encode('utf-8')) for path in paths)
+        assert 1 < tracker.max <= 4
+
+    def test_should_limit_in_flight_bytes_using_size_hint(self):
+        tracker = _ConcurrencyTracker()
+        paths = ['file%d' % i for i in range(10)]
+        with patch.object(io_module, 'read_all_from_path', tracker.read_all_from_path):
+            with patch.object(io_module, 'get_size_hint') as get_size_hint_mock:
+                result = list(read_all_from_paths(
+                    paths, max_concurrency=4, max_in_flight_bytes=20,
+                    size_hint_fn=lambda _: 10
+                ))
+                get_size_hint_mock.assert_not_called()
+        assert len(result) == len(paths)
+        assert tracker.max <= 2
+
+    def test_should_wait_for_read_content_to_be_consumed(self):
+        tracker = _ConcurrencyTracker()
+        paths = ['file%d' % i for i in range(20)]
+        with patch.object(io_module, 'read_all_from_path', tracker.read_all_from_path):
+            with patch.object(io_module, 'get_size_hint') as get_size_hint_mock:
+                result = read_all_from_paths(paths, max_concurrency=4, max_in_flight_bytes=5)
+                next(result)
+                time.sleep(0.1)
+                # only the reads started before the first content was read
+                started_count = len(tracker.read_paths)
+                assert started_count < len(paths)
+                assert len(list(result)) == len(paths) - 1
+                get_size_hint_mock.assert_not_called()
+
+    def test_should_read_file_exceeding_max_in_flight_bytes(self):
+        tracker = _ConcurrencyTracker()
+        with patch.object(io_module, 'read_all_from_path', tracker.read_all_from_path):
+            assert list(read_all_from_paths(
+                ['file1', 'file2'], max_concurrency=2, max_in_flight_bytes=10,
+                size_hint_fn=lambda _: 100
+            ))
+
+    def test_should_not_block_if_not_fully_consumed(self):
+        tracker = _ConcurrencyTracker()
+        paths = ['file%d' % i for i in range(10)]
+        with patch.object(io_module, 'read_all_from_path', tracker.read_all_from_path):
+            result = read_all_from_paths(
+                paths, max_concurrency=4, max_in_flight_bytes=10, size_hint_fn=lambda _: 10
+            )
+            next(result)
+            result.close()
+
+    def test_should_raise_read_error(self, tmp_path: Path):
+        with pytest.raises(IOError):
+            list(read_all_from_paths([str(tmp_path / 'missing.bin')]))
+
+
+def _get_peak_allocated_bytes(fn):
+    tracemalloc.start()
+    try:
+        result = fn()
+        return tracemalloc.get_traced_memory()[1], result
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.slow
+class TestReadAllFromPathAsMemoryviewBenchmark:
+    def test_should_use_less_memory_than_read_all_from_path(self, tmp_path: Path):
+        path = tmp_path / 'file.bin'
+        data = os.urandom(20 * 1024 * 1024)
+        path.write_bytes(data)
+        read_all_peak, read_all_result = _get_peak_allocated_bytes(
+            lambda: read_all_from_path(str(path))
+        )
+        del read_all_result
+        memoryview_peak, memoryview_result = _get_peak_allocated_bytes(
+            lambda: read_all_from_path_as_memoryview(str(path), use_mmap=False)
+        )
+        assert bytes(memoryview_result) == data
+        assert memoryview_peak < read_all_peak * 0.75
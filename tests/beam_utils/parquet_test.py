@@ -0,0 +1,93 @@
+from pathlib import Path
+
+import pytest
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import apache_beam as beam
+from apache_beam.testing.util import assert_that, equal_to
+
+from sciencebeam_utils.beam_utils.testing import (
+    TestPipeline
+)
+
+from sciencebeam_utils.beam_utils.parquet import (
+    WriteDictParquet,
+    ReadDictParquet
+)
+
+
+UNICODE_STR_1 = 'file1\u1234.pdf'
+
+
+def _to_rows(table_dict):
+    columns = list(table_dict.keys())
+    return [
+        dict(zip(columns, values))
+        for values in zip(*[table_dict[column] for column in columns])
+    ]
+
+
+def _read_parquet_rows(path_pattern):
+    return [
+        row
+        for path in sorted(Path(path_pattern).parent.glob(Path(path_pattern).name))
+        for row in _to_rows(pq.read_table(str(path)).to_pydict())
+    ]
+
+
+@pytest.mark.slow
+class TestWriteDictParquet:
+    def test_should_write_columns_as_strings(self, tmp_path: Path):
+        with TestPipeline() as p:
+            _ = (  # noqa: F841
+                p |
+                beam.Create([
+                    {'a': 'a1', 'b': 1, 'other': 'x'},
+                    {'a': UNICODE_STR_1.encode('utf-8')}
+                ]) |
+                WriteDictParquet(str(tmp_path / 'out'), ['a', 'b'])
+            )
+        rows = _read_parquet_rows(str(tmp_path / 'out*.parquet'))
+        assert sorted(rows, key=lambda row: row['a']) == [
+            {'a': 'a1', 'b': '1'},
+            {'a': UNICODE_STR_1, 'b': None}
+        ]
+
+    def test_should_write_using_passed_in_schema(self, tmp_path: Path):
+        schema = pa.schema([('a', pa.string()), ('b', pa.int64())])
+        with TestPipeline() as p:
+            _ = (  # noqa: F841
+                p |
+                beam.Create([{'a': 'a1', 'b': 1}]) |
+                WriteDictParquet(str(tmp_path / 'out'), ['a', 'b'], schema=schema)
+            )
+        assert _read_parquet_rows(str(tmp_path / 'out*.parquet')) == [{'a': 'a1', 'b': 1}]
+
+
+@pytest.mark.slow
+class TestReadDictParquet:
+    def test_should_read_selected_columns_across_row_groups(self, tmp_path: Path):
+        path = tmp_path / 'data.parquet'
+        rows = [{'a': 'a%d' % i, 'b': 'b%d' % i} for i in range(10)]
+        pq.write_table(pa.Table.from_pydict({
+            column: [row[column] for row in rows]
+            for column in ['a', 'b']
+        }), str(path), row_group_size=3)
+        assert pq.ParquetFile(str(path)).num_row_groups > 1
+        with TestPipeline() as p:
+            result = p | ReadDictParquet(str(path), columns=['a'])
+            assert_that(result, equal_to([{'a': row['a']} for row in rows]))
+
+    def test_should_read_written_rows(self, tmp_path: Path):
+        rows = [{'a': 'a1', 'b': 'b1'}, {'a': 'a2', 'b': 'b2'}]
+        with TestPipeline() as p:
+            _ = (  # noqa: F841
+                p |
+                beam.Create(rows) |
+                WriteDictParquet(str(tmp_path / 'out'), ['a', 'b'])
+            )
+        with TestPipeline() as p:
+            result = p | ReadDictParquet(str(tmp_path / 'out*.parquet'))
+            assert_that(result, equal_to(rows))
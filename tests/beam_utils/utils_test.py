@@ -1,8 +1,12 @@
 import logging
+from time import perf_counter
+from unittest.mock import Mock, patch
 
 import pytest
 
 import apache_beam as beam
+from apache_beam.metrics.metric import Metrics, MetricsFilter
+from apache_beam.pipeline import PipelineVisitor
 from apache_beam.testing.util import (
     assert_that,
     equal_to
@@ -11,14 +15,35 @@ from apache_beam.testing.util import (
 from sciencebeam_utils.beam_utils.testing import (
     BeamTest,
     TestPipeline,
-    get_counter_value
+    get_counter_value,
+    get_counter_values,
+    get_latency_percentiles
 )
 
+import sciencebeam_utils.beam_utils.utils as utils_module
 from sciencebeam_utils.beam_utils.utils import (
+    MAIN_OUTPUT_TAG,
     MapOrLog,
+    BatchMapOrLog,
     TransformAndLog,
     TransformAndCount,
-    PreventFusion
+    TimedMap,
+    TransformAndTime,
+    get_bytes_in_counter_name,
+    get_bytes_out_counter_name,
+    get_bundle_time_name,
+    get_elements_in_counter_name,
+    get_elements_out_counter_name,
+    get_percentiles_from_bucket_counts,
+    get_processing_time_distribution_name,
+    get_size_in_bytes,
+    PreventFusion,
+    Redistribute,
+    RateLimiter,
+    get_dead_letter_record,
+    _get_default_output_log_fn,
+    _get_sampled_log_fn,
+    _iter_batch_results_or_log
 )
 
 
@@ -26,6 +51,13 @@ SOME_VALUE_1 = 'value 1'
 SOME_VALUE_2 = 'value 2'
 SOME_VALUE_CAUSING_EXCEPTION = 1
 
+BENCHMARK_ELEMENT_COUNT = 50000
+
+SHUFFLE_BYTES_METRIC_NAME = 'shuffle_bytes'
+
+
+LOGGER = logging.getLogger(__name__)
+
 
 def SOME_FN(x):
     return x.upper()
@@ -47,6 +79,23 @@ def setup_module():
     logging.basicConfig(level='DEBUG')
 
 
+# a fake clock (module level, to be shared by the pickled functions within the process),
+# only advancing via advance_fake_clock
+_FAKE_CLOCK = {'seconds': 0.0}
+
+
+def fake_perf_counter():
+    return _FAKE_CLOCK['seconds']
+
+
+def advance_fake_clock(seconds):
+    _FAKE_CLOCK['seconds'] += seconds
+
+
+def patch_perf_counter_with_fake_clock():
+    return patch.object(utils_module, 'perf_counter', fake_perf_counter)
+
+
 @pytest.mark.slow
 class TestMapOrLog(BeamTest):
     def test_should_pass_through_return_value_if_no_exception_was_raised(self):
@@ -87,6 +136,47 @@ class TestMapOrLog(BeamTest):
             )
             assert get_counter_value(p.run(), ERROR_COUNT_METRIC_NAME) == 1
 
+    def test_should_output_failed_elements_to_dead_letter_tag(self):
+        with TestPipeline() as p:
+            result = (
+                p |
+                beam.Create([SOME_VALUE_1, SOME_VALUE_CAUSING_EXCEPTION]) |
+                MapOrLog(SOME_FN, dead_letter_tag='failed')
+            )
+            assert_that(
+                result[MAIN_OUTPUT_TAG], equal_to([SOME_FN(SOME_VALUE_1)]),
+                label='main'
+            )
+            assert_that(
+                result.failed | beam.Map(lambda x: (
+                    x['element'],
+                    type(x['exception']).__name__,
+                    'AttributeError' in x['traceback'],
+                    x['start_timestamp'] > 0,
+                    x['duration_seconds'] >= 0
+                )),
+                equal_to([(
+                    SOME_VALUE_CAUSING_EXCEPTION, 'AttributeError', True, True, True
+                )]),
+                label='failed'
+            )
+
+
+class _NotSerializableError(RuntimeError):
+    def __reduce__(self):
+        raise TypeError('not serializable')
+
+
+class TestGetDeadLetterRecord:
+    def test_should_keep_original_type_of_not_serializable_exception(self):
+        dead_letter_record = get_dead_letter_record(
+            SOME_VALUE_1, _NotSerializableError('oh dear'),
+            start_timestamp=1.5, duration_seconds=0.25
+        )
+        assert dead_letter_record['exception_type'] == '_NotSerializableError'
+        assert type(dead_letter_record['exception']).__name__ == 'SerializableException'
+        assert str(dead_letter_record['exception']) == 'oh dear'
+
 
 @pytest.mark.slow
 class TestTransformAndCount(BeamTest):
@@ -130,6 +220,145 @@ class TestTransformAndCount(BeamTest):
             )
 
 
+class TestGetPercentilesFromBucketCounts:
+    def test_should_return_none_without_values(self):
+        assert get_percentiles_from_bucket_counts([0, 0], [10]) == {
+            50: None, 95: None, 99: None
+        }
+
+    def test_should_return_upper_bound_of_bucket(self):
+        assert get_percentiles_from_bucket_counts(
+            [50, 45, 4, 1], [1, 10, 100], percentiles=[50, 95, 99, 100], max_value=123
+        ) == {50: 1, 95: 10, 99: 100, 100: 123}
+
+
+class TestGetSizeInBytes:
+    def test_should_return_size_of_bytes_like_values(self):
+        assert get_size_in_bytes(b'abc') == 3
+        assert get_size_in_bytes(bytearray(b'abc')) == 3
+        assert get_size_in_bytes(memoryview(b'abc')) == 3
+
+    def test_should_return_length_of_str(self):
+        assert get_size_in_bytes('abc') == 3
+
+    def test_should_return_zero_for_other_values(self):
+        assert get_size_in_bytes({'a': 'abc'}) == 0
+
+
+@pytest.mark.slow
+class TestTimedMap(BeamTest):
+    def test_should_pass_through_result(self):
+        with TestPipeline() as p:
+            result = (
+                p |
+                beam.Create([SOME_VALUE_1]) |
+                TimedMap(SOME_FN, COUNT_METRIC_NAME_1)
+            )
+            assert_that(result, equal_to([SOME_FN(SOME_VALUE_1)]))
+
+    def test_should_record_processing_time_and_bytes(self):
+        with TestPipeline() as p:
+            _ = (  # noqa: F841
+                p |
+                beam.Create([SOME_VALUE_1, SOME_VALUE_2]) |
+                TimedMap(
+                    lambda x: x + x, COUNT_METRIC_NAME_1,
+                    bytes_in_fn=len, bytes_out_fn=len
+                )
+            )
+            counter_values = get_counter_values(p.run(), [
+                get_processing_time_distribution_name(COUNT_METRIC_NAME_1),
+                get_bytes_in_counter_name(COUNT_METRIC_NAME_1),
+                get_bytes_out_counter_name(COUNT_METRIC_NAME_1)
+            ])
+        total_length = len(SOME_VALUE_1) + len(SOME_VALUE_2)
+        assert counter_values[
+            get_processing_time_distribution_name(COUNT_METRIC_NAME_1)
+        ].count == 2
+        assert counter_values[get_bytes_in_counter_name(COUNT_METRIC_NAME_1)] == total_length
+        assert counter_values[
+            get_bytes_out_counter_name(COUNT_METRIC_NAME_1)
+        ] == 2 * total_length
+
+    def test_should_report_latency_percentiles(self):
+        def fn(x):
+            if x >= 90:
+                advance_fake_clock(0.015)
+            return x
+        with patch_perf_counter_with_fake_clock():
+            with TestPipeline() as p:
+                _ = (  # noqa: F841
+                    p |
+                    beam.Create(list(range(100))) |
+                    TimedMap(fn, COUNT_METRIC_NAME_1)
+                )
+                percentiles = get_latency_percentiles(p.run(), COUNT_METRIC_NAME_1)
+        assert percentiles == {50: 1, 95: 20, 99: 20}
+
+
+@pytest.mark.slow
+class TestTransformAndTime(BeamTest):
+    def test_should_count_elements_and_bytes_in_and_out(self):
+        with TestPipeline() as p:
+            result = (
+                p |
+                beam.Create([b'abc', b'de']) |
+                TransformAndTime(
+                    beam.FlatMap(lambda x: [x + x] if len(x) > 2 else []),
+                    COUNT_METRIC_NAME_1,
+                    bytes_in_fn=get_size_in_bytes, bytes_out_fn=get_size_in_bytes
+                )
+            )
+            assert_that(result, equal_to([b'abcabc']))
+            counter_values = get_counter_values(p.run(), [
+                get_elements_in_counter_name(COUNT_METRIC_NAME_1),
+                get_elements_out_counter_name(COUNT_METRIC_NAME_1),
+                get_bytes_in_counter_name(COUNT_METRIC_NAME_1),
+                get_bytes_out_counter_name(COUNT_METRIC_NAME_1)
+            ])
+        assert counter_values == {
+            get_elements_in_counter_name(COUNT_METRIC_NAME_1): 2,
+            get_elements_out_counter_name(COUNT_METRIC_NAME_1): 1,
+            get_bytes_in_counter_name(COUNT_METRIC_NAME_1): 5,
+            get_bytes_out_counter_name(COUNT_METRIC_NAME_1): 6
+        }
+
+    def test_should_not_count_bytes_without_bytes_fn(self):
+        with TestPipeline() as p:
+            _ = (  # noqa: F841
+                p |
+                beam.Create([{'a': 'abc'}]) |
+                TransformAndTime(beam.Map(lambda x: x), COUNT_METRIC_NAME_1)
+            )
+            counter_values = get_counter_values(p.run(), [
+                get_bytes_in_counter_name(COUNT_METRIC_NAME_1),
+                get_bytes_out_counter_name(COUNT_METRIC_NAME_1)
+            ])
+        assert not counter_values
+
+    def test_should_record_bundle_time(self):
+        def fn(x):
+            advance_fake_clock(0.015)
+            return x
+        with patch_perf_counter_with_fake_clock():
+            with TestPipeline() as p:
+                _ = (  # noqa: F841
+                    p |
+                    beam.Create([SOME_VALUE_1, SOME_VALUE_2]) |
+                    TransformAndTime(beam.Map(fn), COUNT_METRIC_NAME_1)
+                )
+                pipeline_result = p.run()
+                bundle_time = get_counter_value(
+                    pipeline_result,
+                    get_processing_time_distribution_name(
+                        get_bundle_time_name(COUNT_METRIC_NAME_1)
+                    )
+                )
+        # the fake clock only advances while processing the elements (in a single bundle)
+        assert bundle_time.count == 1
+        assert bundle_time.sum == 30000
+
+
 @pytest.mark.slow
 class TestTransformAndLog(BeamTest):
     def test_should_not_change_result(self):
@@ -143,6 +372,158 @@ class TestTransformAndLog(BeamTest):
             )
             assert_that(result, equal_to([SOME_VALUE_1.upper()]))
 
+    def test_should_not_change_result_when_sampling(self):
+        values = ['value %d' % i for i in range(10)]
+        with TestPipeline() as p:
+            result = (
+                p |
+                beam.Create(values) |
+                TransformAndLog(
+                    beam.Map(lambda x: x.upper()),
+                    sample_every=3, sample_probability=0.5, max_logs_per_second=1
+                )
+            )
+            assert_that(result, equal_to([value.upper() for value in values]))
+
+
+class TestGetDefaultOutputLogFn:
+    def test_should_not_format_value_if_log_level_is_disabled(self):
+        log_value_fn = Mock()
+        with patch.object(utils_module, 'get_logger') as get_logger_mock:
+            get_logger_mock.return_value.isEnabledFor.return_value = False
+            _get_default_output_log_fn('debug', '', log_value_fn)(SOME_VALUE_1)
+        log_value_fn.assert_not_called()
+        get_logger_mock.return_value.log.assert_not_called()
+
+    def test_should_log_value_if_log_level_is_enabled(self):
+        with patch.object(utils_module, 'get_logger') as get_logger_mock:
+            get_logger_mock.return_value.isEnabledFor.return_value = True
+            _get_default_output_log_fn('info', 'prefix:', str.upper)(SOME_VALUE_1)
+        get_logger_mock.return_value.log.assert_called_with(
+            logging.INFO, '%s%.50s...', 'prefix:', SOME_VALUE_1.upper()
+        )
+
+
+class TestRateLimiter:
+    def test_should_limit_events_per_second(self):
+        now = [0.0]
+        rate_limiter = RateLimiter(2, clock=lambda: now[0])
+        assert [rate_limiter.try_acquire() for _ in range(3)] == [True, True, False]
+        now[0] = 0.9
+        assert not rate_limiter.try_acquire()
+        now[0] = 1.0
+        assert [rate_limiter.try_acquire() for _ in range(3)] == [True, True, False]
+
+
+class TestGetSampledLogFn:
+    def test_should_return_log_fn_without_sampling(self):
+        log_fn = Mock()
+        assert _get_sampled_log_fn(log_fn) is log_fn
+
+    def test_should_log_every_nth_element(self):
+        logged = []
+        sampled_log_fn = _get_sampled_log_fn(logged.append, sample_every=3)
+        for i in range(10):
+            sampled_log_fn(i)
+        assert logged == [0, 3, 6, 9]
+
+    def test_should_log_elements_with_probability(self):
+        logged = []
+        sampled_log_fn = _get_sampled_log_fn(logged.append, sample_probability=0.1)
+        for i in range(1000):
+            sampled_log_fn(i)
+        assert 30 < len(logged) < 300
+
+    def test_should_not_log_elements_with_zero_probability(self):
+        logged = []
+        sampled_log_fn = _get_sampled_log_fn(logged.append, sample_probability=0)
+        for i in range(10):
+            sampled_log_fn(i)
+        assert not logged
+
+    def test_should_limit_logs_per_second(self):
+        logged = []
+        sampled_log_fn = _get_sampled_log_fn(logged.append, max_logs_per_second=5)
+        for i in range(100):
+            sampled_log_fn(i)
+        assert logged == [0, 1, 2, 3, 4]
+
+
+def _upper_batch_failing_for(failing_values, batch_sizes=None):
+    def fn_batch(batch):
+        if batch_sizes is not None:
+            batch_sizes.append(len(batch))
+        if any(x in failing_values for x in batch):
+            raise RuntimeError('failing batch')
+        return [x.upper() for x in batch]
+    return fn_batch
+
+
+class TestIterBatchResultsOrLog:
+    def test_should_return_results_of_successful_batch(self):
+        batch_sizes = []
+        assert list(_iter_batch_results_or_log(
+            _upper_batch_failing_for(set(), batch_sizes), ['a', 'b', 'c'], None
+        )) == ['A', 'B', 'C']
+        assert batch_sizes == [3]
+
+    def test_should_isolate_failing_item(self):
+        errors = []
+        values = ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h']
+        batch_sizes = []
+        assert list(_iter_batch_results_or_log(
+            _upper_batch_failing_for({'c'}, batch_sizes), values,
+            lambda e, x: errors.append(x)
+        )) == ['A', 'B', 'D', 'E', 'F', 'G', 'H']
+        assert errors == ['c']
+        # the items not in a failing batch will be processed as part of a batch
+        assert batch_sizes == [8, 4, 2, 2, 1, 1, 4]
+
+    def test_should_isolate_multiple_failing_items(self):
+        errors = []
+        assert list(_iter_batch_results_or_log(
+            _upper_batch_failing_for({'a', 'd'}), ['a', 'b', 'c', 'd'],
+            lambda e, x: errors.append(x)
+        )) == ['B', 'C']
+        assert errors == ['a', 'd']
+
+    def test_should_treat_batch_with_missing_results_as_failed(self):
+        errors = []
+
+        def fn_batch(batch):
+            return [x.upper() for x in batch if x != 'c']
+
+        assert list(_iter_batch_results_or_log(
+            fn_batch, ['a', 'b', 'c', 'd'],
+            lambda e, x: errors.append((type(e), x))
+        )) == ['A', 'B', 'D']
+        assert errors == [(ValueError, 'c')]
+
+
+@pytest.mark.slow
+class TestBatchMapOrLog(BeamTest):
+    def test_should_pass_through_results_of_batch(self):
+        with TestPipeline() as p:
+            result = (
+                p |
+                beam.Create([SOME_VALUE_1, SOME_VALUE_2]) |
+                BatchMapOrLog(_upper_batch_failing_for(set()), max_batch_size=2)
+            )
+            assert_that(result, equal_to([SOME_VALUE_1.upper(), SOME_VALUE_2.upper()]))
+
+    def test_should_skip_and_count_failing_items(self):
+        with TestPipeline() as p:
+            result = (
+                p |
+                beam.Create([SOME_VALUE_1, SOME_VALUE_2]) |
+                BatchMapOrLog(
+                    _upper_batch_failing_for({SOME_VALUE_1}), max_batch_size=2,
+                    error_count=ERROR_COUNT_METRIC_NAME
+                )
+            )
+            assert_that(result, equal_to([SOME_VALUE_2.upper()]))
+            assert get_counter_value(p.run(), ERROR_COUNT_METRIC_NAME) == 1
+
 
 @pytest.mark.slow
 class TestPreventFusion(BeamTest):
@@ -163,3 +544,121 @@ class TestPreventFusion(BeamTest):
                 PreventFusion(lambda _: 1)
             )
             assert_that(result, equal_to([SOME_VALUE_1, SOME_VALUE_2]))
+
+
+@pytest.mark.slow
+class TestRedistribute(BeamTest):
+    def test_should_not_change_result(self):
+        with TestPipeline() as p:
+            result = (
+                p |
+                beam.Create([SOME_VALUE_1, SOME_VALUE_2]) |
+                Redistribute(bucket_count=2)
+            )
+            assert_that(result, equal_to([SOME_VALUE_1, SOME_VALUE_2]))
+
+    def test_should_not_change_result_with_batches(self):
+        values = ['value %d' % i for i in range(10)]
+        with TestPipeline() as p:
+            result = (
+                p |
+                beam.Create(values) |
+                Redistribute(bucket_count=2, batch_size=3)
+            )
+            assert_that(result, equal_to(values))
+
+
+def _get_pipeline_seconds(values, transform):
+    start = perf_counter()
+    with TestPipeline() as p:
+        _ = (  # noqa: F841
+            p |
+            beam.Create(values) |
+            transform |
+            beam.combiners.Count.Globally()
+        )
+    return perf_counter() - start
+
+
+class _GroupByKeyInputsVisitor(PipelineVisitor):
+    def __init__(self, label_prefix):
+        self.label_prefix = label_prefix
+        self.group_by_key_inputs = []
+
+    def _add_group_by_key_inputs(self, transform_node):
+        if (
+            isinstance(transform_node.transform, beam.GroupByKey)
+            and transform_node.full_label.startswith(self.label_prefix)
+        ):
+            for pcoll in transform_node.inputs:
+                if pcoll not in self.group_by_key_inputs:
+                    self.group_by_key_inputs.append(pcoll)
+
+    def enter_composite_transform(self, transform_node):
+        self._add_group_by_key_inputs(transform_node)
+
+    def visit_transform(self, transform_node):
+        self._add_group_by_key_inputs(transform_node)
+
+
+def _get_shuffle_bytes(values, transform):
+    # measures the encoded size of the actual elements passed to the GroupByKey
+    # (i.e. including any metadata added by the transform), using the pcollection's coder
+    with TestPipeline() as p:
+        _ = (  # noqa: F841
+            p |
+            beam.Create(values) |
+            transform |
+            beam.combiners.Count.Globally()
+        )
+        # only the GroupByKey of the transform (not the one used by Count)
+        visitor = _GroupByKeyInputsVisitor(transform.label + '/')
+        p.visit(visitor)
+        assert visitor.group_by_key_inputs
+        shuffle_bytes_counter = Metrics.counter('Benchmark', SHUFFLE_BYTES_METRIC_NAME)
+        for i, pcoll in enumerate(visitor.group_by_key_inputs):
+            coder = beam.coders.registry.get_coder(pcoll.element_type)
+            _ = (  # noqa: F841
+                pcoll |
+                ('MeasureShuffleBytes%d' % i) >> beam.Map(
+                    lambda x, coder=coder: shuffle_bytes_counter.inc(len(coder.encode(x)))
+                )
+            )
+        pipeline_result = p.run()
+        pipeline_result.wait_until_finish()
+        # summing the counters of all of the measuring steps
+        return sum(
+            counter.committed
+            for counter in pipeline_result.metrics().query(
+                MetricsFilter().with_name(SHUFFLE_BYTES_METRIC_NAME)
+            )['counters']
+        )
+
+
+@pytest.mark.slow
+class TestRedistributeBenchmark:
+    def test_should_shuffle_fewer_bytes_than_prevent_fusion_when_batched(self):
+        values = ['gs://bucket/path/to/file%d.pdf' % i for i in range(BENCHMARK_ELEMENT_COUNT)]
+        transform_fn_by_name = {
+            'prevent fusion': PreventFusion,
+            'redistribute': Redistribute,
+            'redistribute (batched)': lambda: Redistribute(batch_size=100)
+        }
+        shuffle_bytes_by_name = {
+            name: _get_shuffle_bytes(values, transform_fn())
+            for name, transform_fn in transform_fn_by_name.items()
+        }
+        seconds_by_name = {
+            name: _get_pipeline_seconds(values, transform_fn())
+            for name, transform_fn in transform_fn_by_name.items()
+        }
+        for name, shuffle_bytes in shuffle_bytes_by_name.items():
+            LOGGER.info(
+                '%s: shuffle bytes: %d (%.1f per element), seconds: %.3f',
+                name, shuffle_bytes, shuffle_bytes / len(values), seconds_by_name[name]
+            )
+        # not asserting the wall time, which is dominated by the local runner's overhead
+        assert (
+            shuffle_bytes_by_name['redistribute (batched)']
+            < shuffle_bytes_by_name['prevent fusion']
+        )
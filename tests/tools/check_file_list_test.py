@@ -1,11 +1,26 @@
+import argparse
+from pathlib import Path
+from random import Random
 from unittest.mock import patch
 
 import pytest
 
+from sciencebeam_utils.beam_utils.file_metadata_cache import (
+    FileMetadata,
+    FileMetadataCache
+)
+
 import sciencebeam_utils.tools.check_file_list as check_file_list_module
 from sciencebeam_utils.tools.check_file_list import (
     DEFAULT_EXAMPLE_COUNT,
+    iter_file_list_with_file_exists,
     map_file_list_to_file_exists,
+    get_wilson_score_interval,
+    get_z_score_for_confidence,
+    get_normal_inv_cdf,
+    open_file_metadata_cache_for_args,
+    sample_file_list,
+    check_file_sample_and_report_result,
     format_file_list,
     format_file_exists_results,
     check_files_and_report_result
@@ -26,6 +41,143 @@ class TestMapFileListToFileExists:
             FileSystems.exists.assert_called_with(FILE_1)
 
 
+class TestIterFileListWithFileExists:
+    def test_should_check_files_lazily_and_preserve_order(self, tmp_path: Path):
+        file_list = [str(tmp_path / name) for name in ['file1', 'file2', 'file3']]
+        Path(file_list[1]).touch()
+        result = iter_file_list_with_file_exists(iter(file_list), max_workers=2)
+        assert not isinstance(result, list)
+        assert list(result) == [
+            (file_list[0], False), (file_list[1], True), (file_list[2], False)
+        ]
+
+    def test_should_check_files_using_directory_listing(self, tmp_path: Path):
+        (tmp_path / 'dir1').mkdir()
+        file_list = [
+            str(tmp_path / 'dir1' / 'file1'),
+            str(tmp_path / 'dir1' / 'file2'),
+            str(tmp_path / 'dir2' / 'file3'),
+            str(tmp_path / 'file4')
+        ]
+        Path(file_list[1]).touch()
+        Path(file_list[3]).touch()
+        m = check_file_list_module
+        with patch.object(
+            m, 'get_file_metadata_in_directory',
+            wraps=m.get_file_metadata_in_directory
+        ) as get_file_metadata_in_directory_mock:
+            assert list(iter_file_list_with_file_exists(
+                file_list, list_directories=True, min_directory_file_count=1, batch_size=3
+            )) == [
+                (file_list[0], False), (file_list[1], True),
+                (file_list[2], False), (file_list[3], True)
+            ]
+            assert get_file_metadata_in_directory_mock.call_count == 3
+
+    def test_should_only_list_directories_with_enough_files(self, tmp_path: Path):
+        file_list = [str(tmp_path / 'file1'), str(tmp_path / 'other' / 'file2')]
+        Path(file_list[0]).touch()
+        m = check_file_list_module
+        with patch.object(m, 'get_file_metadata_in_directory') as get_file_metadata_mock:
+            assert list(iter_file_list_with_file_exists(
+                file_list, list_directories=True, min_directory_file_count=2
+            )) == [(file_list[0], True), (file_list[1], False)]
+            get_file_metadata_mock.assert_not_called()
+
+    def test_should_list_each_directory_once_across_batches(self, tmp_path: Path):
+        file_list = [str(tmp_path / ('file%d' % i)) for i in range(50)]
+        Path(file_list[1]).touch()
+        m = check_file_list_module
+        with patch.object(
+            m, 'get_file_metadata_in_directory',
+            wraps=m.get_file_metadata_in_directory
+        ) as get_file_metadata_in_directory_mock:
+            result = list(iter_file_list_with_file_exists(
+                file_list, list_directories=True, min_directory_file_count=5, batch_size=5
+            ))
+            get_file_metadata_in_directory_mock.assert_called_once_with(str(tmp_path))
+        assert result == [(file_path, i == 1) for i, file_path in enumerate(file_list)]
+
+    def test_should_list_directory_again_after_its_listing_was_removed(self, tmp_path: Path):
+        file_lists = [
+            [str(tmp_path / name / ('file%d' % i)) for i in range(2)]
+            for name in ['dir1', 'dir2']
+        ]
+        file_list = file_lists[0] + file_lists[1] + file_lists[0]
+        Path(file_list[0]).parent.mkdir()
+        Path(file_list[0]).touch()
+        m = check_file_list_module
+        with patch.object(
+            m, 'get_file_metadata_in_directory',
+            wraps=m.get_file_metadata_in_directory
+        ) as get_file_metadata_in_directory_mock:
+            result = list(iter_file_list_with_file_exists(
+                file_list, list_directories=True, min_directory_file_count=2,
+                max_directory_listing_count=1, batch_size=2
+            ))
+            assert get_file_metadata_in_directory_mock.call_count == 3
+        assert result == [
+            (file_path, file_path == file_list[0]) for file_path in file_list
+        ]
+
+    def test_should_list_directory_once_enough_files_were_requested(self, tmp_path: Path):
+        file_list = [str(tmp_path / ('file%d' % i)) for i in range(10)]
+        m = check_file_list_module
+        with patch.object(
+            m, 'get_file_metadata_in_directory',
+            wraps=m.get_file_metadata_in_directory
+        ) as get_file_metadata_in_directory_mock:
+            with patch.object(
+                m.FileSystems, 'exists', wraps=m.FileSystems.exists
+            ) as exists_mock:
+                assert not any(
+                    file_exists
+                    for _, file_exists in iter_file_list_with_file_exists(
+                        file_list, list_directories=True,
+                        min_directory_file_count=4, batch_size=2
+                    )
+                )
+            # the first batch is checked individually, until the count reached 4
+            assert exists_mock.call_count == 2
+            get_file_metadata_in_directory_mock.assert_called_once_with(str(tmp_path))
+
+    def test_should_only_check_existence_of_individual_files(self, tmp_path: Path):
+        file_list = [str(tmp_path / 'file1'), str(tmp_path / 'file2')]
+        Path(file_list[0]).touch()
+        m = check_file_list_module
+        with patch.object(m, 'get_file_metadata') as get_file_metadata_mock:
+            assert list(iter_file_list_with_file_exists(
+                file_list, list_directories=True
+            )) == [(file_list[0], True), (file_list[1], False)]
+            get_file_metadata_mock.assert_not_called()
+
+    def test_should_not_list_directory_containing_glob_characters(self, tmp_path: Path):
+        directory = tmp_path / 'dir[1]'
+        directory.mkdir()
+        file_list = [str(directory / 'file1'), str(directory / 'file2')]
+        Path(file_list[0]).touch()
+        assert list(iter_file_list_with_file_exists(
+            file_list, list_directories=True
+        )) == [(file_list[0], True), (file_list[1], False)]
+
+
+class TestOpenFileMetadataCacheForArgs:
+    def test_should_return_none_without_metadata_cache(self):
+        with open_file_metadata_cache_for_args(
+                argparse.Namespace(metadata_cache=None)) as file_metadata_cache:
+            assert file_metadata_cache is None
+
+    def test_should_open_metadata_cache(self, tmp_path: Path):
+        with open_file_metadata_cache_for_args(argparse.Namespace(
+            metadata_cache=str(tmp_path / 'cache.sqlite'),
+            metadata_cache_ttl=10,
+            metadata_cache_missing_ttl=5,
+            refresh_metadata_cache=False
+        )) as file_metadata_cache:
+            assert isinstance(file_metadata_cache, FileMetadataCache)
+            assert file_metadata_cache.missing_ttl_seconds == 5
+
+
 class TestFormatFileList:
     def test_should_format_multiple_files(self):
         assert (
@@ -56,22 +208,164 @@ class TestFormatFileExistsResults:
         )
 
 
+class TestIterFileListWithFileExistsUsingFileMetadataCache:
+    def test_should_use_cached_file_exists(self, tmp_path: Path):
+        file_list = [str(tmp_path / 'file1'), str(tmp_path / 'file2')]
+        with FileMetadataCache(str(tmp_path / 'cache.sqlite')) as file_metadata_cache:
+            file_metadata_cache.put(file_list[0], FileMetadata(exists=True))
+            m = check_file_list_module
+            with patch.object(m, 'FileSystems') as FileSystems:
+                FileSystems.exists.return_value = False
+                assert list(iter_file_list_with_file_exists(
+                    file_list, file_metadata_cache=file_metadata_cache
+                )) == [(file_list[0], True), (file_list[1], False)]
+
+    def test_should_cache_directory_listing_results(self, tmp_path: Path):
+        file_list = [str(tmp_path / 'file1'), str(tmp_path / 'file2')]
+        Path(file_list[0]).write_text('abc')
+        with FileMetadataCache(str(tmp_path / 'cache.sqlite')) as file_metadata_cache:
+            assert list(iter_file_list_with_file_exists(
+                file_list, file_metadata_cache=file_metadata_cache, list_directories=True
+            )) == [(file_list[0], True), (file_list[1], False)]
+            assert file_metadata_cache.get(file_list[0]).size_in_bytes == 3
+            # missing files are not cached by default
+            assert file_metadata_cache.get(file_list[1]) is None
+            m = check_file_list_module
+            with patch.object(m, 'get_file_metadata_in_directory') as get_file_metadata_mock:
+                assert list(iter_file_list_with_file_exists(
+                    file_list, file_metadata_cache=file_metadata_cache, list_directories=True
+                )) == [(file_list[0], True), (file_list[1], False)]
+                get_file_metadata_mock.assert_not_called()
+
+
+class TestGetWilsonScoreInterval:
+    def test_should_return_full_interval_without_any_checks(self):
+        assert get_wilson_score_interval(0, 0, 1.96) == (0.0, 1.0)
+
+    def test_should_return_interval_around_proportion(self):
+        lower, upper = get_wilson_score_interval(90, 100, 1.96)
+        assert round(lower, 3) == 0.826
+        assert round(upper, 3) == 0.945
+
+    def test_should_narrow_interval_with_more_checks(self):
+        lower_1, upper_1 = get_wilson_score_interval(90, 100, 1.96)
+        lower_2, upper_2 = get_wilson_score_interval(900, 1000, 1.96)
+        assert upper_2 - lower_2 < upper_1 - lower_1
+
+    def test_should_convert_confidence_to_z_score(self):
+        assert round(get_z_score_for_confidence(0.95), 2) == 1.96
+
+    def test_should_calculate_z_score_for_high_confidence(self):
+        assert round(get_z_score_for_confidence(0.99), 3) == 2.576
+        assert round(get_z_score_for_confidence(0.999), 3) == 3.291
+
+
+class TestGetNormalInvCdf:
+    def test_should_return_zero_for_median(self):
+        assert get_normal_inv_cdf(0.5) == 0
+
+    def test_should_be_symmetric(self):
+        assert get_normal_inv_cdf(0.01) == pytest.approx(-get_normal_inv_cdf(0.99))
+        assert round(get_normal_inv_cdf(0.01), 4) == -2.3263
+
+    def test_should_raise_error_for_invalid_probability(self):
+        with pytest.raises(ValueError):
+            get_normal_inv_cdf(1)
+
+
+class TestSampleFileList:
+    def test_should_return_all_files_if_sample_size_is_larger(self):
+        assert sorted(sample_file_list(iter([FILE_1, FILE_2]), 10)) == [FILE_1, FILE_2]
+
+    def test_should_return_sample_of_requested_size(self):
+        file_list = ['file%d' % i for i in range(100)]
+        sample = sample_file_list(iter(file_list), 10, random=Random(1))
+        assert len(sample) == 10
+        assert len(set(sample)) == 10
+        assert set(sample) <= set(file_list)
+
+
+class TestCheckFileSampleAndReportResult:
+    def test_should_stop_once_within_margin(self):
+        m = check_file_list_module
+        with patch.object(m, 'FileSystems') as FileSystems:
+            FileSystems.exists.return_value = True
+            file_list = ['file%d' % i for i in range(1000)]
+            check_file_sample_and_report_result(
+                file_list, sample_size=1000, sample_margin=0.2, max_workers=1
+            )
+            assert FileSystems.exists.call_count < 100
+
+    def test_should_stop_once_missing_count_was_reached(self):
+        m = check_file_list_module
+        with patch.object(m, 'FileSystems') as FileSystems:
+            FileSystems.exists.side_effect = lambda file_path: file_path != 'file0'
+            with patch.object(m, 'format_file_exists_estimate') as format_mock:
+                check_file_sample_and_report_result(
+                    ['file%d' % i for i in range(1000)],
+                    sample_size=1000, sample_margin=0.0, sample_missing_count=1,
+                    sample_seed=1, max_workers=1
+                )
+                args = format_mock.call_args[0]
+                assert args[1] == 1
+                assert args[2] == ['file0']
+            assert FileSystems.exists.call_count < 1000
+
+    def test_should_raise_error_if_none_of_the_files_were_found(self):
+        m = check_file_list_module
+        with patch.object(m, 'FileSystems') as FileSystems:
+            FileSystems.exists.return_value = False
+            with pytest.raises(AssertionError):
+                check_file_sample_and_report_result([FILE_1, FILE_2], sample_size=10)
+
+
 class TestCheckFileListAndReportResults:
     def test_should_pass_file_list_to_format(self):
         m = check_file_list_module
-        with patch.object(m, 'map_file_list_to_file_exists') as map_file_list_to_file_exists_mock:
-            with patch.object(m, 'format_file_exists_results') as format_file_exists_results_mock:
-                map_file_list_to_file_exists_mock.return_value = [True, True]
+        with patch.object(m, 'iter_file_list_with_file_exists') as iter_file_exists_mock:
+            with patch.object(m, 'format_file_exists_counts') as format_file_exists_counts_mock:
+                iter_file_exists_mock.return_value = [(FILE_1, True), (FILE_2, False)]
                 check_files_and_report_result([FILE_1, FILE_2])
-                map_file_list_to_file_exists_mock.assert_called_with([FILE_1, FILE_2])
-                format_file_exists_results_mock.assert_called_with(
-                    [True, True], [FILE_1, FILE_2],
-                    example_count=DEFAULT_EXAMPLE_COUNT
-                )
+                iter_file_exists_mock.assert_called_with([FILE_1, FILE_2])
+                format_file_exists_counts_mock.assert_called_with(1, 1, [FILE_2])
+
+    def test_should_pass_checker_options(self):
+        m = check_file_list_module
+        with patch.object(m, 'iter_file_list_with_file_exists') as iter_file_exists_mock:
+            iter_file_exists_mock.return_value = [(FILE_1, True)]
+            check_files_and_report_result(
+                [FILE_1],
+                example_count=DEFAULT_EXAMPLE_COUNT,
+                max_workers=2,
+                list_directories=True
+            )
+            iter_file_exists_mock.assert_called_with(
+                [FILE_1], max_workers=2, list_directories=True
+            )
+
+    def test_should_limit_missing_examples(self):
+        m = check_file_list_module
+        with patch.object(m, 'iter_file_list_with_file_exists') as iter_file_exists_mock:
+            with patch.object(m, 'format_file_exists_counts') as format_file_exists_counts_mock:
+                iter_file_exists_mock.return_value = [
+                    (FILE_1, True), (FILE_2, False), ('file3', False)
+                ]
+                check_files_and_report_result([FILE_1, FILE_2, 'file3'], example_count=1)
+                format_file_exists_counts_mock.assert_called_with(1, 2, [FILE_2])
+
+    def test_should_check_sample_if_sample_size_was_specified(self):
+        m = check_file_list_module
+        with patch.object(m, 'check_file_sample_and_report_result') as check_sample_mock:
+            check_files_and_report_result(
+                [FILE_1, FILE_2], example_count=1, sample_size=1, sample_margin=0.1
+            )
+            check_sample_mock.assert_called_with(
+                [FILE_1, FILE_2], sample_size=1, example_count=1, sample_margin=0.1
+            )
 
     def test_should_raise_error_if_none_of_the_files_were_found(self):
         m = check_file_list_module
-        with patch.object(m, 'map_file_list_to_file_exists') as map_file_list_to_file_exists_mock:
+        with patch.object(m, 'iter_file_list_with_file_exists') as iter_file_exists_mock:
             with pytest.raises(AssertionError):
-                map_file_list_to_file_exists_mock.return_value = [False, False]
+                iter_file_exists_mock.return_value = [(FILE_1, False), (FILE_2, False)]
                 check_files_and_report_result([FILE_1, FILE_2])
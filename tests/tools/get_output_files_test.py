@@ -1,12 +1,19 @@
 import os
+from pathlib import Path
 from unittest.mock import patch, ANY
 
 import pytest
 
 from sciencebeam_utils.tools import get_output_files
-from sciencebeam_utils.tools.check_file_list import DEFAULT_EXAMPLE_COUNT
+from sciencebeam_utils.tools.check_file_list import (
+    DEFAULT_EXAMPLE_COUNT,
+    DEFAULT_MAX_WORKERS,
+    DEFAULT_BATCH_SIZE
+)
 from sciencebeam_utils.tools.get_output_files import (
     get_output_file_list,
+    get_fingerprint_file_path,
+    read_options_fingerprint,
     run,
     parse_args,
     main
@@ -25,16 +32,21 @@ FILE_1 = BASE_SOURCE_PATH + '/file1'
 FILE_2 = BASE_SOURCE_PATH + '/file2'
 
 
-@pytest.fixture(name='load_file_list_mock')
-def _load_file_list():
-    with patch.object(get_output_files, 'load_file_list') as m:
-        m.return_value = [FILE_1, FILE_2]
+@pytest.fixture(name='source_file_list')
+def _source_file_list():
+    return [FILE_1, FILE_2]
+
+
+@pytest.fixture(name='iter_file_list_mock')
+def _iter_file_list(source_file_list):
+    with patch.object(get_output_files, 'iter_file_list') as m:
+        m.side_effect = lambda *_, **__: iter(source_file_list)
         yield m
 
 
-@pytest.fixture(name='get_output_file_list_mock')
-def _get_output_file_list():
-    with patch.object(get_output_files, 'get_output_file_list') as m:
+@pytest.fixture(name='iter_output_file_list_mock')
+def _iter_output_file_list():
+    with patch.object(get_output_files, 'iter_output_file_list') as m:
         yield m
 
 
@@ -50,9 +62,9 @@ def _check_files_and_report_result():
         yield m
 
 
-@pytest.fixture(name='to_relative_file_list_mock')
-def _to_relative_file_list():
-    with patch.object(get_output_files, 'to_relative_file_list') as m:
+@pytest.fixture(name='iter_relative_file_list_mock')
+def _iter_relative_file_list():
+    with patch.object(get_output_files, 'iter_relative_file_list') as m:
         yield m
 
 
@@ -67,45 +79,45 @@ class TestGetOutputFileList:
 
 
 @pytest.mark.usefixtures(
-    "load_file_list_mock", "get_output_file_list_mock", "save_file_list_mock",
-    "to_relative_file_list_mock"
+    "iter_file_list_mock", "iter_output_file_list_mock", "save_file_list_mock",
+    "iter_relative_file_list_mock"
 )
 class TestRun:
     def test_should_pass_around_parameters(
             self,
-            load_file_list_mock,
-            get_output_file_list_mock,
+            iter_file_list_mock,
+            iter_output_file_list_mock,
             save_file_list_mock):
 
-        load_file_list_mock.return_value = [FILE_1, FILE_2]
         opt = parse_args(SOME_ARGV)
         run(opt)
-        load_file_list_mock.assert_called_with(
+        iter_file_list_mock.assert_called_with(
             opt.source_file_list,
             column=opt.source_file_column,
             limit=opt.limit
         )
-        get_output_file_list_mock.assert_called_with(
-            load_file_list_mock.return_value,
+        iter_output_file_list_mock.assert_called_with(
+            ANY,
             BASE_SOURCE_PATH,
             opt.output_base_path,
             opt.output_file_suffix
         )
+        assert list(iter_output_file_list_mock.call_args[0][0]) == [FILE_1, FILE_2]
         save_file_list_mock.assert_called_with(
             opt.output_file_list,
-            get_output_file_list_mock.return_value,
+            iter_output_file_list_mock.return_value,
             column=opt.source_file_column
         )
 
     def test_should_make_file_list_absolute_if_it_is_relative(
             self,
-            load_file_list_mock):
+            iter_file_list_mock):
 
         opt = parse_args(SOME_ARGV)
         opt.source_base_path = BASE_SOURCE_PATH
         opt.source_file_list = 'source.tsv'
         run(opt)
-        load_file_list_mock.assert_called_with(
+        iter_file_list_mock.assert_called_with(
             os.path.join(opt.source_base_path, opt.source_file_list),
             column=opt.source_file_column,
             limit=opt.limit
@@ -119,14 +131,14 @@ class TestRun:
 
     def test_should_use_passed_in_source_path_if_valid(
             self,
-            get_output_file_list_mock,
-            load_file_list_mock):
+            iter_output_file_list_mock,
+            source_file_list):
 
         opt = parse_args(SOME_ARGV)
         opt.source_base_path = '/base'
-        load_file_list_mock.return_value = ['/base/source/file1', '/base/source/file2']
+        source_file_list[:] = ['/base/source/file1', '/base/source/file2']
         run(opt)
-        get_output_file_list_mock.assert_called_with(
+        iter_output_file_list_mock.assert_called_with(
             ANY,
             opt.source_base_path,
             ANY,
@@ -135,53 +147,152 @@ class TestRun:
 
     def test_should_check_file_list_if_enabled(
             self,
-            get_output_file_list_mock,
+            iter_output_file_list_mock,
             check_files_and_report_result_mock):
 
         opt = parse_args(SOME_ARGV)
         opt.check = True
         run(opt)
         check_files_and_report_result_mock.assert_called_with(
-            get_output_file_list_mock.return_value,
-            example_count=DEFAULT_EXAMPLE_COUNT
+            iter_output_file_list_mock.return_value,
+            example_count=DEFAULT_EXAMPLE_COUNT,
+            max_workers=DEFAULT_MAX_WORKERS,
+            batch_size=DEFAULT_BATCH_SIZE,
+            list_directories=False
         )
 
     def test_should_limit_files_to_check(
             self,
-            load_file_list_mock,
-            get_output_file_list_mock,
+            iter_output_file_list_mock,
             check_files_and_report_result_mock):
 
         opt = parse_args(SOME_ARGV)
         opt.check = True
         opt.check_limit = 1
-        load_file_list_mock.return_value = [FILE_1, FILE_2]
+        iter_output_file_list_mock.side_effect = lambda *_: iter([FILE_1, FILE_2])
         run(opt)
         check_files_and_report_result_mock.assert_called_with(
-            get_output_file_list_mock.return_value[:opt.check_limit],
-            example_count=DEFAULT_EXAMPLE_COUNT
+            ANY,
+            example_count=DEFAULT_EXAMPLE_COUNT,
+            max_workers=DEFAULT_MAX_WORKERS,
+            batch_size=DEFAULT_BATCH_SIZE,
+            list_directories=False
         )
+        assert list(check_files_and_report_result_mock.call_args[0][0]) == [FILE_1]
 
     def test_should_save_relative_paths_if_enabled(
             self,
-            get_output_file_list_mock,
-            to_relative_file_list_mock,
+            iter_output_file_list_mock,
+            iter_relative_file_list_mock,
             save_file_list_mock):
 
         opt = parse_args(SOME_ARGV)
         opt.use_relative_paths = True
         run(opt)
-        to_relative_file_list_mock.assert_called_with(
+        iter_relative_file_list_mock.assert_called_with(
             opt.output_base_path,
-            get_output_file_list_mock.return_value,
+            iter_output_file_list_mock.return_value,
         )
         save_file_list_mock.assert_called_with(
             opt.output_file_list,
-            to_relative_file_list_mock.return_value,
+            iter_relative_file_list_mock.return_value,
             column=opt.source_file_column
         )
 
 
+def _write_lines(path: Path, lines):
+    path.write_text('\n'.join(lines), encoding='utf-8')
+
+
+def _read_lines(path: Path):
+    return path.read_text(encoding='utf-8').splitlines()
+
+
+class TestReadOptionsFingerprint:
+    def test_should_return_first_line(self, tmp_path: Path):
+        _write_lines(tmp_path / 'fingerprints', ['options1', '0123'])
+        assert read_options_fingerprint(str(tmp_path / 'fingerprints')) == 'options1'
+
+    def test_should_return_none_for_empty_file(self, tmp_path: Path):
+        _write_lines(tmp_path / 'fingerprints', [])
+        assert read_options_fingerprint(str(tmp_path / 'fingerprints')) is None
+
+
+class TestRunIncremental:
+    def _run(self, tmp_path: Path, *args):
+        opt = parse_args([
+            '--source-file-list=%s' % (tmp_path / 'source.lst'),
+            '--source-base-path=%s' % (tmp_path / 'source'),
+            '--output-base-path=%s' % (tmp_path / 'output'),
+            '--output-file-list=%s' % (tmp_path / 'output.lst'),
+            '--output-file-suffix=.xml',
+            '--incremental'
+        ] + list(args))
+        run(opt)
+
+    def test_should_save_fingerprints_on_first_run(self, tmp_path: Path):
+        _write_lines(tmp_path / 'source.lst', ['source/file1.pdf', 'source/file2.pdf'])
+        self._run(tmp_path)
+        assert _read_lines(tmp_path / 'output.lst') == [
+            str(tmp_path / 'output/file1.xml'), str(tmp_path / 'output/file2.xml')
+        ]
+        fingerprint_file_path = Path(get_fingerprint_file_path(str(tmp_path / 'output.lst')))
+        assert len(_read_lines(fingerprint_file_path)) == 1 + 2
+
+    def test_should_merge_added_and_removed_source_files(self, tmp_path: Path):
+        _write_lines(tmp_path / 'source.lst', ['source/file1.pdf', 'source/file2.pdf'])
+        self._run(tmp_path)
+        _write_lines(tmp_path / 'source.lst', [
+            'source/file3.pdf', 'source/file2.pdf', 'source/file4.pdf'
+        ])
+        self._run(tmp_path)
+        assert _read_lines(tmp_path / 'output.lst') == [
+            str(tmp_path / 'output/file2.xml'),
+            str(tmp_path / 'output/file3.xml'),
+            str(tmp_path / 'output/file4.xml')
+        ]
+        fingerprint_file_path = Path(get_fingerprint_file_path(str(tmp_path / 'output.lst')))
+        assert len(_read_lines(fingerprint_file_path)) == 1 + 3
+
+    def test_should_only_check_added_output_files(self, tmp_path: Path):
+        _write_lines(tmp_path / 'source.lst', ['source/file1.pdf'])
+        self._run(tmp_path)
+        _write_lines(tmp_path / 'source.lst', ['source/file1.pdf', 'source/file2.pdf'])
+        with patch.object(get_output_files, 'check_files_and_report_result') as check_mock:
+            self._run(tmp_path, '--check')
+            check_mock.assert_called_once()
+            assert list(check_mock.call_args[0][0]) == [str(tmp_path / 'output/file2.xml')]
+
+    def test_should_run_full_update_if_options_changed(self, tmp_path: Path):
+        _write_lines(tmp_path / 'source.lst', ['source/file1.pdf', 'source/file2.pdf'])
+        self._run(tmp_path)
+        _write_lines(tmp_path / 'source.lst', ['source/file2.pdf', 'source/file1.pdf'])
+        self._run(tmp_path, '--use-relative-paths')
+        assert _read_lines(tmp_path / 'output.lst') == ['file2.xml', 'file1.xml']
+
+    def test_should_run_full_update_if_fingerprints_do_not_match_output_file_list(
+            self, tmp_path: Path):
+        _write_lines(tmp_path / 'source.lst', ['source/file1.pdf', 'source/file2.pdf'])
+        self._run(tmp_path)
+        fingerprint_file_path = Path(get_fingerprint_file_path(str(tmp_path / 'output.lst')))
+        # drop the fingerprint of file1 (the one of file2 would otherwise be paired with file1)
+        fingerprint_lines = _read_lines(fingerprint_file_path)
+        _write_lines(fingerprint_file_path, fingerprint_lines[:1] + fingerprint_lines[2:])
+        _write_lines(tmp_path / 'source.lst', ['source/file2.pdf', 'source/file1.pdf'])
+        self._run(tmp_path)
+        assert _read_lines(tmp_path / 'output.lst') == [
+            str(tmp_path / 'output/file2.xml'), str(tmp_path / 'output/file1.xml')
+        ]
+        assert len(_read_lines(fingerprint_file_path)) == 1 + 2
+
+    def test_should_keep_relative_paths(self, tmp_path: Path):
+        _write_lines(tmp_path / 'source.lst', ['source/file1.pdf'])
+        self._run(tmp_path, '--use-relative-paths')
+        _write_lines(tmp_path / 'source.lst', ['source/file1.pdf', 'source/file2.pdf'])
+        self._run(tmp_path, '--use-relative-paths')
+        assert _read_lines(tmp_path / 'output.lst') == ['file1.xml', 'file2.xml']
+
+
 class TestMain:
     def test_should_parse_args_and_call_run(self):
         m = get_output_files
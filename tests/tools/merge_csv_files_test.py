@@ -0,0 +1,36 @@
+from pathlib import Path
+
+import pytest
+
+from sciencebeam_utils.tools.merge_csv_files import (
+    main
+)
+
+
+def _write_lines(path: Path, lines):
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+
+
+class TestMain:
+    def test_should_merge_and_dedupe_files(self, tmp_path: Path):
+        _write_lines(tmp_path / 'results-00000-of-00002.tsv', ['id\tvalue', 'b\t1', 'a\t2'])
+        _write_lines(tmp_path / 'results-00001-of-00002.tsv', ['id\tvalue', 'a\t3', 'c\t4'])
+        output_file = tmp_path / 'results.tsv'
+        main([
+            '--input-file-pattern', str(tmp_path / 'results-*.tsv'),
+            '--output-file', str(output_file),
+            '--key-column', 'id',
+            '--dedupe',
+            '--max-rows-in-memory', '2'
+        ])
+        assert output_file.read_text(encoding='utf-8').splitlines() == [
+            'id\tvalue', 'a\t2', 'b\t1', 'c\t4'
+        ]
+
+    def test_should_require_key_column_for_sort(self, tmp_path: Path):
+        with pytest.raises(ValueError):
+            main([
+                '--input-file-pattern', str(tmp_path / 'results-*.tsv'),
+                '--output-file', str(tmp_path / 'results.tsv'),
+                '--sort'
+            ])
@@ -1,18 +1,29 @@
+import gzip
+import logging
 import os
 from tempfile import NamedTemporaryFile
+from time import perf_counter
 from unittest.mock import patch
 from backports.tempfile import TemporaryDirectory
 
+from backports import csv  # pylint: disable=no-name-in-module
+
 import pytest
 
+from sciencebeam_utils.beam_utils.io import open_file
+
 import sciencebeam_utils.utils.file_list as file_list_loader
 from sciencebeam_utils.utils.file_list import (
     is_csv_or_tsv_file_list,
     load_plain_file_list,
     load_csv_or_tsv_file_list,
+    iter_csv_or_tsv_file_list_columns,
     to_absolute_file_list,
     to_relative_file_list,
+    iter_relative_file_list_for_base_paths,
+    iter_file_list,
     load_file_list,
+    load_file_list_columns,
     save_plain_file_list,
     save_csv_or_tsv_file_list,
     save_file_list
@@ -24,6 +35,11 @@ FILE_2 = 'file2.pdf'
 UNICODE_FILE_1 = 'file1\u1234.pdf'
 FILE_LIST = [FILE_1, FILE_2]
 
+BENCHMARK_ROW_COUNT = 20000
+
+
+LOGGER = logging.getLogger(__name__)
+
 
 @pytest.fixture(name='load_plain_file_list_mock')
 def _load_plain_file_list():
@@ -128,6 +144,128 @@ class TestLoadCsvOrTsvFileList:
             f.flush()
             assert load_csv_or_tsv_file_list(f.name, 'url', limit=1) == [FILE_1]
 
+    def test_should_read_tsv_using_column_name(self):
+        with NamedTemporaryFile('w', suffix='.tsv') as f:
+            f.write('\n'.join(['other\turl', 'x\t' + FILE_1, 'y\t' + FILE_2]))
+            f.flush()
+            assert load_csv_or_tsv_file_list(f.name, 'url') == [FILE_1, FILE_2]
+
+    def test_should_read_quoted_value_with_delimiter(self):
+        with NamedTemporaryFile('w', suffix='.csv') as f:
+            f.write('\n'.join(['url,other', '"a,b.pdf",x']))
+            f.flush()
+            assert load_csv_or_tsv_file_list(f.name, 'url') == ['a,b.pdf']
+
+    def test_should_read_gzipped_file(self):
+        with TemporaryDirectory() as path:
+            file_list_path = os.path.join(path, 'file-list.csv.gz')
+            with gzip.open(file_list_path, 'wb') as f:
+                f.write('\n'.join(['url', UNICODE_FILE_1, FILE_2]).encode('utf-8'))
+            assert load_csv_or_tsv_file_list(file_list_path, 'url') == [UNICODE_FILE_1, FILE_2]
+
+    def test_should_return_empty_list_for_empty_file(self):
+        with NamedTemporaryFile('w') as f:
+            assert load_csv_or_tsv_file_list(f.name, 'url') == []
+
+
+class TestIterCsvOrTsvFileListColumns:
+    def test_should_read_multiple_columns_using_column_names(self):
+        with NamedTemporaryFile('w', suffix='.tsv') as f:
+            f.write('\n'.join(['a\tb\tc', 'a1\tb1\tc1', 'a2\tb2\tc2']))
+            f.flush()
+            assert list(iter_csv_or_tsv_file_list_columns(f.name, ['c', 'a'])) == [
+                ('c1', 'a1'), ('c2', 'a2')
+            ]
+
+    def test_should_read_single_column_as_tuple(self):
+        with NamedTemporaryFile('w', suffix='.tsv') as f:
+            f.write('\n'.join(['a\tb', 'a1\tb1']))
+            f.flush()
+            assert list(iter_csv_or_tsv_file_list_columns(f.name, ['b'])) == [('b1',)]
+
+    def test_should_read_multiple_columns_without_header_and_apply_limit(self):
+        with NamedTemporaryFile('w', suffix='.tsv') as f:
+            f.write('\n'.join(['a1\tb1', 'a2\tb2']))
+            f.flush()
+            assert list(iter_csv_or_tsv_file_list_columns(
+                f.name, [1, 0], header=False, limit=1
+            )) == [('b1', 'a1')]
+
+    def test_should_raise_exception_if_column_name_is_invalid(self):
+        with NamedTemporaryFile('w', suffix='.tsv') as f:
+            f.write('\n'.join(['a\tb', 'a1\tb1']))
+            f.flush()
+            with pytest.raises(ValueError):
+                list(iter_csv_or_tsv_file_list_columns(f.name, ['a', 'xyz']))
+
+
+class TestLoadFileListColumns:
+    def test_should_return_absolute_column_file_lists(self):
+        with TemporaryDirectory() as path:
+            file_list_path = os.path.join(path, 'file-list.tsv')
+            with open(file_list_path, 'w', encoding='utf-8') as f:
+                f.write('\n'.join([
+                    'source_url\txml_url', 'file1.pdf\tfile1.xml', '/other/file2.pdf\tfile2.xml'
+                ]))
+            assert load_file_list_columns(file_list_path, ['source_url', 'xml_url']) == [
+                [os.path.join(path, 'file1.pdf'), '/other/file2.pdf'],
+                [os.path.join(path, 'file1.xml'), os.path.join(path, 'file2.xml')]
+            ]
+
+    def test_should_read_single_column_of_plain_file_list(self):
+        with TemporaryDirectory() as path:
+            file_list_path = os.path.join(path, 'file-list.lst')
+            save_plain_file_list(file_list_path, [FILE_1, FILE_2])
+            assert load_file_list_columns(file_list_path, ['url'], to_absolute=False) == [
+                [FILE_1, FILE_2]
+            ]
+
+    def test_should_reject_multiple_columns_for_plain_file_list(self):
+        with pytest.raises(ValueError):
+            load_file_list_columns('file-list.lst', ['a', 'b'])
+
+
+def _load_csv_or_tsv_file_list_using_stream_reader(file_list_path, column):
+    # the previous implementation, using codecs.StreamReaderWriter and backports.csv
+    with open_file(file_list_path, 'r') as f:
+        reader = csv.reader(f, delimiter='\t')
+        column_index = next(reader).index(column)
+        return [row[column_index] for row in reader]
+
+
+def _get_elapsed_seconds(fn):
+    start = perf_counter()
+    fn()
+    return perf_counter() - start
+
+
+@pytest.mark.slow
+class TestLoadCsvOrTsvFileListBenchmark:
+    def test_should_return_same_result_as_stream_reader(self):
+        # the timings are only logged (for manual comparison), to avoid a flaky test
+        with TemporaryDirectory() as path:
+            file_list_path = os.path.join(path, 'file-list.tsv.gz')
+            with gzip.open(file_list_path, 'wt', encoding='utf-8') as f:
+                f.write('url\tother\n')
+                for i in range(BENCHMARK_ROW_COUNT):
+                    f.write('gs://bucket/path/to/file%d.pdf\tother%d\n' % (i, i))
+            results = {}
+            stream_reader_seconds = _get_elapsed_seconds(lambda: results.setdefault(
+                'stream_reader',
+                _load_csv_or_tsv_file_list_using_stream_reader(file_list_path, 'url')
+            ))
+            fast_reader_seconds = _get_elapsed_seconds(lambda: results.setdefault(
+                'fast_reader',
+                load_csv_or_tsv_file_list(file_list_path, 'url')
+            ))
+            LOGGER.info(
+                'rows/sec, stream reader: %.0f, fast reader: %.0f',
+                BENCHMARK_ROW_COUNT / stream_reader_seconds,
+                BENCHMARK_ROW_COUNT / fast_reader_seconds
+            )
+            assert results['fast_reader'] == results['stream_reader']
+            assert len(results['fast_reader']) == BENCHMARK_ROW_COUNT
+
 
 class TestToAbsoluteFileList:
     def test_should_make_path_absolute(self):
@@ -145,6 +283,14 @@ class TestToRelativeFileList:
         assert to_relative_file_list('/base/path', ['/other/file1']) == ['/other/file1']
 
 
+class TestIterRelativeFileListForBasePaths:
+    def test_should_make_paths_relative_to_matching_base_path(self):
+        assert list(iter_relative_file_list_for_base_paths(
+            ['gs://bucket1/path', 'gs://bucket2/other'],
+            ['gs://bucket1/path/sub/file1', 'gs://bucket2/other/file2', '/other/file3']
+        )) == ['sub/file1', 'file2', '/other/file3']
+
+
 @pytest.mark.usefixtures(
     'load_plain_file_list_mock', 'load_csv_or_tsv_file_list_mock', 'to_absolute_file_list_mock'
 )
@@ -175,6 +321,24 @@ class TestLoadFileList:
         assert result == to_absolute_file_list_mock.return_value
 
 
+class TestIterFileList:
+    def test_should_lazily_read_plain_file_list(self):
+        with TemporaryDirectory() as path:
+            file_list_path = os.path.join(path, 'file-list.lst')
+            save_plain_file_list(file_list_path, [FILE_1, FILE_2])
+            result = iter_file_list(file_list_path, column='url')
+            assert not isinstance(result, list)
+            assert list(result) == [os.path.join(path, FILE_1), os.path.join(path, FILE_2)]
+
+    def test_should_lazily_read_csv_file_list_with_limit(self):
+        with TemporaryDirectory() as path:
+            file_list_path = os.path.join(path, 'file-list.csv')
+            save_csv_or_tsv_file_list(file_list_path, [FILE_1, FILE_2], column='url')
+            result = iter_file_list(file_list_path, column='url', limit=1, to_absolute=False)
+            assert not isinstance(result, list)
+            assert list(result) == [FILE_1]
+
+
 class TestSavePlainFileList:
     def test_should_write_multiple_file_paths(self):
         with TemporaryDirectory() as path:
@@ -188,6 +352,12 @@ class TestSavePlainFileList:
             save_plain_file_list(file_list_path, [UNICODE_FILE_1])
             assert load_plain_file_list(file_list_path) == [UNICODE_FILE_1]
 
+    def test_should_write_file_paths_from_iterable(self):
+        with TemporaryDirectory() as path:
+            file_list_path = os.path.join(path, 'out.lst')
+            save_plain_file_list(file_list_path, iter([FILE_1, FILE_2]))
+            assert load_plain_file_list(file_list_path) == [FILE_1, FILE_2]
+
 
 class TestSaveCsvOrTsvFileList:
     def test_should_write_multiple_file_paths(self):
@@ -1,15 +1,30 @@
+import logging
+from time import perf_counter
+
 import pytest
 
 from sciencebeam_utils.utils.file_path import (
     relative_path,
+    get_relative_path_fn,
+    split_path_segments,
+    PathPrefixIndex,
     join_if_relative_path,
     change_ext,
     get_output_file,
+    get_output_file_fn,
+    iter_output_files,
     base_path_for_file_list,
+    base_paths_for_file_list,
     get_or_validate_base_path
 )
 
 
+LOGGER = logging.getLogger(__name__)
+
+
+BENCHMARK_FILE_COUNT = 100000
+
+
 class TestRelativePath:
     def test_should_return_path_if_base_path_is_none(self):
         assert relative_path(None, 'file') == 'file'
@@ -21,6 +36,74 @@ class TestRelativePath:
         assert relative_path('/parent', '/parent/file') == 'file'
 
 
+class TestGetRelativePathFn:
+    def test_should_return_path_if_base_path_is_none(self):
+        assert get_relative_path_fn(None)('file') == 'file'
+
+    def test_should_return_path_if_path_outside_base_path(self):
+        assert get_relative_path_fn('/parent')('/other/file') == '/other/file'
+
+    def test_should_return_relative_path_if_base_path_matches(self):
+        assert get_relative_path_fn('/parent')('/parent/file') == 'file'
+
+    def test_should_accept_base_path_with_trailing_slash(self):
+        assert get_relative_path_fn('/parent/')('/parent/file') == 'file'
+
+    def test_should_not_match_partial_directory_name(self):
+        assert get_relative_path_fn('/parent')('/parent2/file') == '/parent2/file'
+
+
+class TestSplitPathSegments:
+    def test_should_split_local_path(self):
+        assert split_path_segments('/base/path/file') == ['', 'base', 'path', 'file']
+
+    def test_should_keep_scheme_and_bucket_as_first_segment(self):
+        assert split_path_segments('gs://bucket/path/file') == ['gs://bucket', 'path', 'file']
+
+    def test_should_be_reversible(self):
+        for path in ['/base/path/file', 'gs://bucket/path/file', 'relative/file', 'file']:
+            assert '/'.join(split_path_segments(path)) == path
+
+
+class TestPathPrefixIndex:
+    def test_should_return_path_if_there_are_no_base_paths(self):
+        assert PathPrefixIndex().relative_path('/base/path/file') == '/base/path/file'
+
+    def test_should_return_path_if_path_outside_base_paths(self):
+        assert PathPrefixIndex(['/base/path']).relative_path('/other/file') == '/other/file'
+
+    def test_should_make_path_relative_to_matching_base_path(self):
+        index = PathPrefixIndex(['gs://bucket1/path', 'gs://bucket2/other'])
+        assert index.relative_path('gs://bucket1/path/sub/file') == 'sub/file'
+        assert index.relative_path('gs://bucket2/other/file') == 'file'
+
+    def test_should_use_longest_matching_base_path(self):
+        index = PathPrefixIndex(['/base', '/base/path'])
+        assert index.relative_path('/base/path/file') == 'file'
+        assert index.relative_path('/base/other/file') == 'other/file'
+
+    def test_should_not_match_partial_directory_name(self):
+        index = PathPrefixIndex(['/base/path'])
+        assert index.relative_path('/base/path2/file') == '/base/path2/file'
+
+    def test_should_not_match_base_path_itself(self):
+        index = PathPrefixIndex(['/base/path'])
+        assert index.relative_path('/base/path') == '/base/path'
+
+    def test_should_ignore_trailing_slash_of_base_path(self):
+        index = PathPrefixIndex(['gs://bucket/path/'])
+        assert index.find_base_path('gs://bucket/path/file') == 'gs://bucket/path'
+
+    def test_should_ignore_empty_base_path(self):
+        index = PathPrefixIndex([''])
+        assert index.find_base_path('file') is None
+        assert index.relative_path('file') == 'file'
+
+    def test_should_match_bucket_root(self):
+        index = PathPrefixIndex(['gs://bucket'])
+        assert index.relative_path('gs://bucket/path/file') == 'path/file'
+
+
 class TestJoinIfRelativePath:
     def test_should_return_path_if_base_path_is_none(self):
         assert join_if_relative_path(None, 'file') == 'file'
@@ -53,6 +136,67 @@ class TestGetOutputFile:
         ) == '/output/path/file.xml'
 
 
+class TestGetOutputFileFn:
+    @pytest.mark.parametrize('source_base_path,output_base_path,filename', [
+        ('/source', '/output', '/source/path/file.pdf'),
+        ('/source/', '/output/', '/source/path/file.pdf'),
+        ('/source', '/output', '/source/path/file.pdf.gz'),
+        ('/source', '/output', '/source/path/file.tar.gz'),
+        ('/source', '/output', '/source/path/file'),
+        ('/source', '/output', '/source/path.ext/file'),
+        ('/source', '/output', '/source/path/.gz'),
+        ('/source', '/output', '/other/path/file.pdf'),
+        ('/source', 'output', '/source/path/file.pdf'),
+        ('', '/output', 'path/file.pdf'),
+        (None, '/output', '/source/path/file.pdf')
+    ])
+    def test_should_return_same_result_as_get_output_file(
+            self, source_base_path, output_base_path, filename):
+        assert get_output_file_fn(source_base_path, output_base_path, '.xml')(filename) == (
+            get_output_file(filename, source_base_path, output_base_path, '.xml')
+        )
+
+    def test_should_translate_multiple_files(self):
+        assert list(iter_output_files(
+            ['/source/file1.pdf', '/source/file2.pdf'], '/source', '/output', '.xml'
+        )) == ['/output/file1.xml', '/output/file2.xml']
+
+
+def _get_elapsed_seconds(fn):
+    start = perf_counter()
+    fn()
+    return perf_counter() - start
+
+
+@pytest.mark.slow
+class TestIterOutputFilesBenchmark:
+    def test_should_be_faster_than_get_output_file(self):
+        file_list = [
+            '/source/path/to/file%d.pdf.gz' % i
+            for i in range(BENCHMARK_FILE_COUNT)
+        ]
+        expected_output_files = [
+            get_output_file(filename, '/source', '/output', '.xml')
+            for filename in file_list
+        ]
+        assert list(iter_output_files(file_list, '/source', '/output', '.xml')) == (
+            expected_output_files
+        )
+        per_file_seconds = _get_elapsed_seconds(lambda: [
+            get_output_file(filename, '/source', '/output', '.xml')
+            for filename in file_list
+        ])
+        batch_seconds = _get_elapsed_seconds(
+            lambda: list(iter_output_files(file_list, '/source', '/output', '.xml'))
+        )
+        LOGGER.info(
+            'files/sec, get_output_file: %.0f, iter_output_files: %.0f',
+            BENCHMARK_FILE_COUNT / per_file_seconds,
+            BENCHMARK_FILE_COUNT / batch_seconds
+        )
+        assert batch_seconds < per_file_seconds
+
+
 class TestBasePathForFileList:
     def test_should_return_empty_string_if_file_list_is_empty(self):
         assert base_path_for_file_list([]) == ''
@@ -82,6 +226,38 @@ class TestBasePathForFileList:
     def test_should_return_common_path_ignoring_partial_name_match(self):
         assert base_path_for_file_list(['/base/path/file1', '/base/path/file2']) == '/base/path'
 
+    def test_should_accept_iterable(self):
+        assert base_path_for_file_list(iter([
+            '/base/path/1/file', '/base/path/2/file', '/base/other/file'
+        ])) == '/base'
+
+
+class TestBasePathsForFileList:
+    def test_should_return_empty_list_if_file_list_is_empty(self):
+        assert base_paths_for_file_list([]) == []
+
+    def test_should_return_common_path_of_local_files(self):
+        assert base_paths_for_file_list([
+            '/base/path/1/file', '/base/path/2/file'
+        ]) == ['/base/path']
+
+    def test_should_return_common_path_for_every_bucket(self):
+        assert base_paths_for_file_list(iter([
+            'gs://bucket1/path/1/file',
+            'gs://bucket2/other/file',
+            'gs://bucket1/path/2/file',
+            's3://bucket1/path/file'
+        ])) == ['gs://bucket1/path', 'gs://bucket2/other', 's3://bucket1/path']
+
+    def test_should_be_usable_with_path_prefix_index(self):
+        file_list = [
+            'gs://bucket1/path/1/file', 'gs://bucket2/other/file', 'gs://bucket1/path/2/file'
+        ]
+        index = PathPrefixIndex(base_paths_for_file_list(file_list))
+        assert [index.relative_path(path) for path in file_list] == [
+            '1/file', 'file', '2/file'
+        ]
+
 
 class TestGetOrValidateBasePath:
     def test_should_return_base_path_of_two_files_if_no_base_path_was_provided(self):